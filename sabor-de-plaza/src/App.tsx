@@ -2,7 +2,7 @@ import { useState } from 'react';
 import { LandingHero } from './components/LandingHero';
 import { Dashboard } from './components/Dashboard';
 import { Footer } from './components/Footer';
-import { useCosechaData } from './hooks/useMockData';
+import { useCosechaData } from './hooks/useCosechaData';
 
 type View = 'LANDING' | 'DASHBOARD';
 
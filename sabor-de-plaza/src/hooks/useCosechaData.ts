@@ -0,0 +1,56 @@
+import { useEffect, useState } from 'react';
+import type { ProductAlert } from '../types/productAlert';
+import { useMockData } from './useMockData';
+
+// Generado por sipsa_shards.py en public/data/
+interface ShardEntry {
+  file: string;
+  sha256: string;
+  bytes: number;
+  records: number;
+}
+
+interface ShardManifest {
+  version: number;
+  generatedAt: string;
+  markets: Record<string, string>;
+  shards: Record<string, ShardEntry>;
+}
+
+const DATA_URL = `${import.meta.env.BASE_URL}data/`;
+
+async function fetchShard<T>(manifest: ShardManifest, name: string): Promise<T> {
+  const entry = manifest.shards[name];
+  if (!entry) throw new Error(`Shard no encontrado: ${name}`);
+  // El nombre lleva el hash del contenido: se puede usar la caché del navegador sin revalidar
+  const res = await fetch(DATA_URL + entry.file, { cache: 'force-cache' });
+  if (!res.ok) throw new Error(`${res.status} ${entry.file}`);
+  return res.json() as Promise<T>;
+}
+
+/** Los 16 Elegidos desde los shards estáticos; mientras cargan (o si no hay datos) usa el mock. */
+export function useCosechaData(): ProductAlert[] {
+  const mock = useMockData();
+  const [products, setProducts] = useState<ProductAlert[] | null>(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    fetch(DATA_URL + 'manifest.json', { cache: 'no-cache' })
+      .then((res) => {
+        if (!res.ok) throw new Error(`${res.status} manifest.json`);
+        return res.json() as Promise<ShardManifest>;
+      })
+      .then((manifest) => fetchShard<ProductAlert[]>(manifest, 'elegidos'))
+      .then((elegidos) => {
+        if (!cancelled && elegidos.length > 0) setProducts(elegidos);
+      })
+      .catch(() => {
+        // Sin datos publicados: se queda con el mock
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, []);
+
+  return products ?? mock;
+}
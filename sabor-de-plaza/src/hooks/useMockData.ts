@@ -73,7 +73,3 @@ export function useMockData(): ProductAlert[] {
     return list.sort((a, b) => b.savingsPercentage - a.savingsPercentage);
   }, []);
 }
-
-export function useCosechaData(): ProductAlert[] {
-  return useMockData();
-}
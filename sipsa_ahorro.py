@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motor de "Ahorro" (project.md §3.3) sobre el histórico SIPSA semanal.
+
+    Ahorro % = (Promedio 90 días - Precio Actual) / Promedio 90 días × 100
+
+Mantiene una matriz (pares producto×plaza) × semanas con sumas y conteos
+móviles de la ventana de 90 días. Al llegar semanas nuevas solo se suman sus
+columnas y se restan las que salen de la ventana; no se recalcula la ventana
+completa. El estado se guarda en disco entre ejecuciones.
+
+Emite el contrato ProductAlert de sabor-de-plaza/src/types/productAlert.ts.
+SIPSA publica precios semanales, así que history7d son las últimas 7
+observaciones semanales del par.
+
+Ejecución:
+  python sipsa_ahorro.py                       # todas las plazas
+  python sipsa_ahorro.py --plaza Medellín      # solo plazas que contengan el texto
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from sipsa_history import HISTORY_DIR, iter_history, load_manifest
+from sipsa_registry import normalize_key, product_category
+from sipsa_util import atomic_path
+
+AHORRO_WINDOW_DAYS = 90
+HISTORY_POINTS = 7
+STATE_VERSION = 1
+STATE_PATH = os.path.join(".cache", "sipsa", "ahorro_state.npz")
+OUT_PATH = os.path.join("out", "product_alerts.json")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def state_path(history_dir: str = HISTORY_DIR) -> str:
+    """Archivo de estado para un histórico: STATE_PATH para el de siempre, otro por directorio si no."""
+    if os.path.abspath(history_dir) == os.path.abspath(HISTORY_DIR):
+        return STATE_PATH
+    clave = hashlib.sha1(os.path.abspath(history_dir).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(os.path.dirname(STATE_PATH), f"ahorro_state_{clave}.npz")
+
+
+class AhorroState:
+    """
+    Ventana móvil de precios por par (producto, plaza).
+
+    prices es una matriz pares × semanas (NaN = sin dato). sums/counts acumulan
+    solo las columnas dentro de la ventana de 90 días; window_start es la primera
+    columna que cuenta. Se conservan además las columnas necesarias para
+    history7d aunque ya hayan salido de la ventana.
+    """
+
+    def __init__(self, productos, plazas, weeks, prices, sums, counts, window_start):
+        self.productos = list(productos)
+        self.plazas = list(plazas)
+        self.index = {k: i for i, k in enumerate(zip(self.productos, self.plazas))}
+        self.weeks = np.asarray(weeks, dtype="datetime64[D]")
+        self.prices = np.asarray(prices, dtype=np.float64).reshape(len(self.productos), len(self.weeks))
+        self.sums = np.asarray(sums, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.window_start = int(window_start)
+
+    @classmethod
+    def empty(cls) -> "AhorroState":
+        return cls([], [], [], np.empty((0, 0)), [], [], 0)
+
+    @classmethod
+    def load(cls, path: str = STATE_PATH) -> "AhorroState":
+        """Estado guardado; vacío si no existe o es de otra versión."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != STATE_VERSION:
+                    return cls.empty()
+                return cls(
+                    data["productos"].tolist(),
+                    data["plazas"].tolist(),
+                    data["weeks"],
+                    data["prices"],
+                    data["sums"],
+                    data["counts"],
+                    int(data["window_start"]),
+                )
+        except (OSError, KeyError, ValueError):
+            return cls.empty()
+
+    def save(self, path: str = STATE_PATH) -> None:
+        with atomic_path(path, suffix=".npz") as tmp:
+            np.savez_compressed(
+                tmp,
+                version=np.int32(STATE_VERSION),
+                productos=np.array(self.productos, dtype=np.str_),
+                plazas=np.array(self.plazas, dtype=np.str_),
+                weeks=self.weeks,
+                prices=self.prices,
+                sums=self.sums,
+                counts=self.counts,
+                window_start=np.int32(self.window_start),
+            )
+
+    @property
+    def week_labels(self) -> list[str]:
+        return [str(w) for w in self.weeks]
+
+    @property
+    def window_limit(self) -> np.datetime64:
+        """Semanas en esta fecha o antes quedan fuera de la ventana de 90 días."""
+        return self.weeks[-1] - np.timedelta64(AHORRO_WINDOW_DAYS, "D")
+
+    def add_weeks(self, df: pd.DataFrame) -> list[str]:
+        """
+        Incorpora semanas nuevas (DataFrame con producto, plaza, week, precio).
+
+        Las semanas ya presentes o anteriores a la ventana actual se ignoran. Si llega
+        una semana anterior a la más reciente del estado, se reconstruyen sumas y
+        conteos desde la matriz. Devuelve las semanas agregadas.
+        """
+        df = df.dropna(subset=["precio"])
+        df = df[~df["week"].isin(self.weeks)]
+        if len(self.weeks):
+            df = df[df["week"] > self.window_limit]
+        if df.empty:
+            return []
+
+        pivot = df.pivot_table(index=["producto", "plaza"], columns="week", values="precio", aggfunc="mean")
+        pivot = pivot.reindex(columns=sorted(pivot.columns))
+        new_weeks = pivot.columns.to_numpy(dtype="datetime64[D]")
+
+        # Pares nuevos: filas NaN en la matriz existente
+        nuevos = [k for k in pivot.index if k not in self.index]
+        if nuevos:
+            for k in nuevos:
+                self.index[k] = len(self.productos)
+                self.productos.append(k[0])
+                self.plazas.append(k[1])
+            extra = np.full((len(nuevos), self.prices.shape[1]), np.nan)
+            self.prices = np.vstack([self.prices, extra])
+            self.sums = np.concatenate([self.sums, np.zeros(len(nuevos))])
+            self.counts = np.concatenate([self.counts, np.zeros(len(nuevos), dtype=np.int32)])
+
+        rows = np.fromiter((self.index[k] for k in pivot.index), dtype=np.intp, count=len(pivot.index))
+        block = np.full((len(self.productos), len(new_weeks)), np.nan)
+        block[rows] = pivot.to_numpy(dtype=np.float64)
+
+        in_order = len(self.weeks) == 0 or new_weeks[0] > self.weeks[-1]
+        self.prices = np.hstack([self.prices, block])
+        self.weeks = np.concatenate([self.weeks, new_weeks])
+        if in_order:
+            self.sums += np.nansum(block, axis=1)
+            self.counts += np.count_nonzero(~np.isnan(block), axis=1).astype(np.int32)
+        else:
+            orden = np.argsort(self.weeks, kind="stable")
+            self.weeks = self.weeks[orden]
+            self.prices = self.prices[:, orden]
+            self.window_start = 0
+            window = self.prices
+            self.sums = np.nansum(window, axis=1)
+            self.counts = np.count_nonzero(~np.isnan(window), axis=1).astype(np.int32)
+        self._slide_window()
+        return [str(w) for w in new_weeks]
+
+    def _slide_window(self) -> None:
+        """Resta de las sumas las columnas que salen de la ventana y descarta las que ya no se usan."""
+        nuevo_inicio = int(np.searchsorted(self.weeks, self.window_limit, side="right"))
+        if nuevo_inicio > self.window_start:
+            salen = self.prices[:, self.window_start:nuevo_inicio]
+            self.sums -= np.nansum(salen, axis=1)
+            self.counts -= np.count_nonzero(~np.isnan(salen), axis=1).astype(np.int32)
+            self.window_start = nuevo_inicio
+        keep_from = min(self.window_start, max(0, len(self.weeks) - HISTORY_POINTS))
+        if keep_from > 0:
+            self.prices = self.prices[:, keep_from:]
+            self.weeks = self.weeks[keep_from:]
+            self.window_start -= keep_from
+
+
+def records_to_frame(records) -> pd.DataFrame:
+    """DataFrame producto, plaza, week (datetime64[D]), precio desde registros de la salida semanal."""
+    df = pd.DataFrame.from_records(records, columns=["producto", "plaza", "fecha", "precio"])
+    df["week"] = pd.to_datetime(df["fecha"].str.slice(0, 10), errors="coerce").to_numpy(dtype="datetime64[D]")
+    df["precio"] = pd.to_numeric(df["precio"], errors="coerce")
+    return df.dropna(subset=["week"])[["producto", "plaza", "week", "precio"]]
+
+
+def _alert_id(producto: str, plaza: str) -> str:
+    return "p-" + hashlib.sha1(f"{producto}|{plaza}".encode("utf-8")).hexdigest()[:10]
+
+
+def build_alerts(state: AhorroState, plazas: list[str] | None = None) -> list[dict]:
+    """
+    Lista ProductAlert para los pares con precio en la semana más reciente, ordenada por ahorro descendente.
+
+    plazas: si se indica, solo pares cuya plaza contenga alguno de esos textos.
+    """
+    if len(state.weeks) == 0:
+        return []
+    current = state.prices[:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg90 = state.sums / state.counts
+        savings = (avg90 - current) / avg90 * 100.0
+    history = pd.DataFrame(state.prices[:, -HISTORY_POINTS:]).ffill(axis=1).bfill(axis=1).to_numpy()
+    categorias = np.array([product_category(p) for p in state.productos], dtype=object)
+
+    mask = np.isfinite(current) & np.isfinite(savings) & (categorias != None)  # noqa: E711
+    if plazas:
+        filtros = [normalize_key(p) for p in plazas]
+        mask &= np.array([any(f in normalize_key(pl) for f in filtros) for pl in state.plazas], dtype=bool)
+
+    idx = np.flatnonzero(mask)
+    idx = idx[np.argsort(-savings[idx], kind="stable")]
+    alerts = []
+    for i in idx:
+        producto, plaza = state.productos[i], state.plazas[i]
+        alerts.append({
+            "id": _alert_id(producto, plaza),
+            "name": producto,
+            "category": categorias[i],
+            "market": plaza,
+            "currentPrice": round(float(current[i])),
+            "averagePrice90d": round(float(avg90[i])),
+            "savingsPercentage": round(float(savings[i]), 1),
+            "history7d": [round(float(v)) for v in history[i]],
+        })
+    return alerts
+
+
+def update_state_from_history(state: AhorroState, history_dir: str = HISTORY_DIR) -> list[str]:
+    """Agrega al estado las semanas del histórico que aún no contiene."""
+    presentes = set(state.week_labels)
+    limite = str(state.window_limit) if len(state.weeks) else ""
+    pendientes = [w for w in load_manifest(history_dir)["weeks"] if w not in presentes and w > limite]
+    if not pendientes:
+        return []
+    df = records_to_frame(iter_history(history_dir, weeks=pendientes))
+    return state.add_weeks(df)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Motor de Ahorro 90 días -> ProductAlert JSON")
+    parser.add_argument("--plaza", action="append", help="Filtrar plazas que contengan este texto (repetible)")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="Directorio del histórico semanal")
+    parser.add_argument("--out", default=OUT_PATH, help="Archivo JSON de salida")
+    parser.add_argument("--rebuild", action="store_true", help="Ignorar el estado guardado y recalcular la ventana")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    path = state_path(args.history_dir)
+    state = AhorroState.empty() if args.rebuild else AhorroState.load(path)
+    nuevas = update_state_from_history(state, args.history_dir)
+    if nuevas:
+        state.save(path)
+        logger.info("Semanas agregadas al estado de ahorro: %s", nuevas)
+    if len(state.weeks) == 0:
+        logger.error("No hay histórico en %s. Ejecute: python sipsa_plaza_precio_semana.py --sync", args.history_dir)
+        return 1
+
+    alerts = build_alerts(state, args.plaza)
+    logger.info(
+        "%s alertas de %s pares producto×plaza (semana %s) en %.3f s",
+        len(alerts), len(state.productos), state.week_labels[-1], time.perf_counter() - t0,
+    )
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(alerts, f, ensure_ascii=False, indent=2)
+    logger.info("JSON guardado: %s", args.out)
+    print(f"JSON guardado: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consulta concurrente de varias operaciones SIPSA con un solo pool de conexiones.
+
+Las llamadas se lanzan desde asyncio con concurrencia acotada (semáforo) y cada
+una corre en un hilo sobre la misma requests.Session, cuyo pool keep-alive se
+dimensiona a la concurrencia. Cada operación tiene su propio timeout de lectura
+(OPERATION_TIMEOUTS) en lugar de un READ_TIMEOUT fijo por script; los timeouts
+son los de requests (conexión y lectura), y una llamada ocupa su lugar en el
+semáforo hasta que su hilo termina. El tiempo total se acerca al de la llamada
+más lenta y no a la suma.
+
+Ejecución:
+  python sipsa_async.py                                   # Ciudad + SemanaMadr
+  python sipsa_async.py --op promediosSipsaCiudad --max-concurrency 1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sipsa_client import build_session, get_client, serialize_response
+from sipsa_stream import iter_operation_records, supports_fast_path
+
+WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
+DEFAULT_OPERATIONS = ("promediosSipsaCiudad", "promediosSipsaSemanaMadr")
+# Timeout de lectura (s) por operación; las semanales devuelven ~9k registros
+OPERATION_TIMEOUTS = {
+    "promediosSipsaCiudad": 30,
+    "promediosSipsaSemanaMadr": 120,
+}
+DEFAULT_TIMEOUT = 60
+MAX_CONCURRENCY = 4
+OUT_DIR = "out"
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OperationResult:
+    """Resultado de una operación: registros como dicts planos, duración y error si lo hubo."""
+
+    operation: str
+    records: list[dict] = field(default_factory=list)
+    elapsed: float = 0.0
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class FetchResult:
+    """Resultado combinado de una actualización completa."""
+
+    results: dict[str, OperationResult]
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return all(r.ok for r in self.results.values())
+
+    def records(self, operation: str) -> list[dict]:
+        return self.results[operation].records
+
+    def summary(self) -> dict:
+        return {
+            "elapsed": round(self.elapsed, 3),
+            "operations": {
+                op: {"records": len(r.records), "elapsed": round(r.elapsed, 3), "error": r.error}
+                for op, r in self.results.items()
+            },
+        }
+
+
+def _call_operation(client, operation: str, timeout: float) -> list[dict]:
+    """Llamada bloqueante: ruta rápida si la operación la soporta, si no Zeep + serialize_response."""
+    if supports_fast_path(operation):
+        return list(iter_operation_records(client, operation, timeout))
+    # Mismo cliente y transport (fallback, caché WSDL, contadores); el timeout aplica solo a este hilo
+    with client.transport.operation_timeout_for(timeout):
+        return serialize_response(getattr(client.service, operation)())
+
+
+async def _run_operation(client, operation: str, timeout: float, semaphore: asyncio.Semaphore) -> OperationResult:
+    async with semaphore:
+        t0 = time.perf_counter()
+        # Sin wait_for: cancelar la espera no detiene el hilo, que seguiría usando su
+        # conexión del pool con el lugar del semáforo ya liberado
+        try:
+            records = await asyncio.to_thread(_call_operation, client, operation, timeout)
+        except Exception as e:
+            return OperationResult(operation, elapsed=time.perf_counter() - t0, error=f"{type(e).__name__}: {e}")
+        elapsed = time.perf_counter() - t0
+        logger.info("%s: %s registros en %.2f s", operation, len(records), elapsed)
+        return OperationResult(operation, records, elapsed)
+
+
+async def fetch_operations(
+    client,
+    operations=DEFAULT_OPERATIONS,
+    timeouts: dict[str, float] | None = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> FetchResult:
+    """Ejecuta las operaciones concurrentemente (como máximo max_concurrency a la vez) con el mismo cliente."""
+    timeouts = {**OPERATION_TIMEOUTS, **(timeouts or {})}
+    semaphore = asyncio.Semaphore(max_concurrency)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(
+        *(_run_operation(client, op, timeouts.get(op, DEFAULT_TIMEOUT), semaphore) for op in operations)
+    )
+    return FetchResult({r.operation: r for r in results}, time.perf_counter() - t0)
+
+
+def fetch_all(
+    wsdl_url: str = WSDL_URL,
+    operations=DEFAULT_OPERATIONS,
+    timeouts: dict[str, float] | None = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> FetchResult:
+    """Construye un cliente con pool para max_concurrency conexiones y ejecuta fetch_operations."""
+    session = build_session(pool_maxsize=max_concurrency)
+    client = get_client(wsdl_url, operation_timeout=DEFAULT_TIMEOUT, session=session)
+    return asyncio.run(fetch_operations(client, operations, timeouts, max_concurrency))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Consulta concurrente de operaciones SIPSA")
+    parser.add_argument("--wsdl", default=WSDL_URL, help="URL del WSDL")
+    parser.add_argument("--op", action="append", help="Operación a consultar (repetible); por defecto Ciudad y SemanaMadr")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="Llamadas simultáneas")
+    args = parser.parse_args(argv)
+
+    try:
+        resultado = fetch_all(args.wsdl, tuple(args.op or DEFAULT_OPERATIONS), max_concurrency=args.max_concurrency)
+    except Exception as e:
+        logger.error("No se pudo conectar al WSDL: %s", e)
+        return 1
+
+    for op, r in resultado.results.items():
+        if r.ok:
+            print(f"  {op}: {len(r.records)} registros ({r.elapsed:.2f} s)")
+        else:
+            print(f"  {op}: ERROR {r.error}")
+    print(f"Tiempo total: {resultado.elapsed:.2f} s")
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    out_path = os.path.join(OUT_DIR, f"sipsa_refresh_{timestamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"summary": resultado.summary(), "operations": {op: r.records for op, r in resultado.results.items()}},
+            f,
+            ensure_ascii=False,
+            default=str,
+        )
+    logger.info("JSON guardado: %s", out_path)
+    return 0 if resultado.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
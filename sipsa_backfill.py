@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backfill histórico reanudable: guarda todas las semanas que devuelve SIPSA, no solo la última.
+
+Las operaciones SIPSA no reciben parámetros de periodo: cada una devuelve todo lo
+que el servicio tiene publicado. El backfill toma las operaciones semanales del
+catálogo del WSDL (BACKFILL_OPERATIONS; hoy solo promediosSipsaSemanaMadr, la
+única con esquema de ruta rápida y con datos por semana), las descarga con
+concurrencia acotada a la caché de respuestas (sipsa_response_cache) y parte el
+envelope en trozos de CHUNK_RECORDS registros mientras lo lee, sin cargarlo
+entero. Los trozos se parsean en un pool de procesos, de modo que la
+decodificación XML usa todos los núcleos, y los registros se guardan por semana
+en el histórico (sipsa_history, out/history). Los registros sin plaza o sin
+fecha se descartan y se cuentan.
+
+El progreso queda en out/backfill/checkpoint.json y cada trozo parseado en disco;
+si el proceso se interrumpe, la siguiente ejecución retoma desde el último trozo
+terminado mientras el envelope descargado y el tamaño de trozo no cambien.
+
+Ejecución:
+  python sipsa_backfill.py
+  python sipsa_backfill.py --workers 8 --chunk-records 2000
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from io import BytesIO
+from typing import IO, Iterator
+
+from sipsa_client import build_session, get_client, operation_catalog
+from sipsa_history import HISTORY_DIR, sync_history
+from sipsa_normalizer import RecordNormalizer
+from sipsa_response_cache import ResponseCache
+from sipsa_stream import FAST_PATH_SCHEMAS, iter_soap_records
+from sipsa_util import read_json, write_atomic
+from sipsa_views import registro_salida
+
+WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
+# Operaciones semanales con esquema de ruta rápida; el histórico se parte por semana,
+# así que las mensuales (MesMadr) o parciales no caben en él
+BACKFILL_OPERATIONS = ("promediosSipsaSemanaMadr",)
+BACKFILL_DIR = os.path.join("out", "backfill")
+CHECKPOINT_VERSION = 2
+CHUNK_RECORDS = 5000
+READ_BLOCK = 1 << 20
+# Trozos en vuelo por proceso de parseo: acota la memoria mientras se lee el envelope
+PENDING_PER_WORKER = 2
+DOWNLOAD_TIMEOUT = 600
+MAX_DOWNLOADS = 2
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+_RETURN_START = re.compile(rb"<(?:[\w-]+:)?return[\s>]")
+_RETURN_END = re.compile(rb"</(?:[\w-]+:)?return>")
+_TAG = re.compile(rb"<(/?)([\w.:-]+)[^>]*?(/?)>")
+
+
+def _closing_tags(head: bytes) -> bytes:
+    """Cierres, en orden, de los elementos que la cabecera deja abiertos (Body, Response...)."""
+    abiertos = []
+    for m in _TAG.finditer(head):
+        if m.group(3):
+            continue
+        if m.group(1):
+            if abiertos:
+                abiertos.pop()
+        else:
+            abiertos.append(m.group(2))
+    return b"".join(b"</" + tag + b">" for tag in reversed(abiertos))
+
+
+def iter_envelope_chunks(stream: IO[bytes], chunk_records: int = CHUNK_RECORDS) -> Iterator[bytes]:
+    """
+    Parte un envelope en envelopes válidos de hasta chunk_records <return> cada uno, leyéndolo por bloques.
+
+    Cada trozo repite la cabecera (declaraciones de namespace incluidas) y cierra los
+    elementos que esta deja abiertos; el último lleva el cierre original. Así cada
+    trozo se parsea igual que la respuesta completa y en memoria solo hay un trozo.
+    Una respuesta sin <return> (vacía o Fault) sale entera como único trozo.
+    """
+    buf = b""
+    head = close = None
+    n = last_end = 0
+    emitidos = 0
+    while True:
+        block = stream.read(READ_BLOCK)
+        buf += block
+        if head is None:
+            m = _RETURN_START.search(buf)
+            if m is None:
+                if block:
+                    continue
+                yield buf
+                return
+            head, buf = buf[:m.start()], buf[m.start():]
+            close = _closing_tags(head)
+        pos = 0
+        for m in _RETURN_END.finditer(buf, last_end):
+            n += 1
+            last_end = m.end()
+            if n == chunk_records:
+                yield head + buf[pos:last_end] + close
+                emitidos += 1
+                pos, n = last_end, 0
+        buf, last_end = buf[pos:], last_end - pos
+        if not block:
+            break
+    if n or not emitidos:
+        yield head + buf
+
+
+def _parse_chunk(operation: str, chunk: bytes) -> tuple[list[dict], int]:
+    """Worker del pool: envelope -> (registros con las claves de la salida semanal, descartados sin plaza o fecha)."""
+    normalizer = RecordNormalizer()
+    records = iter_soap_records(BytesIO(chunk), FAST_PATH_SCHEMAS.get(operation))
+    registros, descartados = [], 0
+    for r in normalizer.iter_normalized(records):
+        if r.plaza and r.fecha_iso:
+            registros.append(registro_salida(r))
+        else:
+            descartados += 1
+    return registros, descartados
+
+
+class Checkpoint:
+    """Progreso por operación: sha256 del envelope, trozos parseados (con sus registros) y si ya se guardó en el histórico."""
+
+    def __init__(self, base_dir: str = BACKFILL_DIR):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, "checkpoint.json")
+        data = read_json(self.path)
+        self.data = data if data and data.get("version") == CHECKPOINT_VERSION else {"version": CHECKPOINT_VERSION, "operations": {}}
+
+    def op(self, operation: str, sha256: str, chunk_records: int) -> dict:
+        """Estado de la operación; se reinicia si el envelope o el tamaño de trozo cambiaron."""
+        estado = self.data["operations"].get(operation)
+        if not estado or estado.get("sha256") != sha256 or estado.get("chunk_records") != chunk_records:
+            estado = {"sha256": sha256, "chunk_records": chunk_records, "parsed": {}, "dropped": 0, "records": 0,
+                      "done": False}
+            self.data["operations"][operation] = estado
+            self.save()
+        return estado
+
+    def chunk_path(self, operation: str, sha256: str, i: int) -> str:
+        return os.path.join(self.base_dir, "chunks", operation, sha256[:16], f"{i:05d}.json.gz")
+
+    def save(self) -> None:
+        write_atomic(self.path, json.dumps(self.data, indent=2).encode("utf-8"))
+
+
+def _iter_chunk_records(paths: list[str]):
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+def _store_chunks(checkpoint: Checkpoint, operation: str, sha256: str, estado: dict, hechos, en_curso: dict) -> int:
+    """Guarda los trozos terminados y los marca en el checkpoint; devuelve cuántos registros aportaron."""
+    total = 0
+    for fut in hechos:
+        i = en_curso.pop(fut)
+        registros, descartados = fut.result()
+        path = checkpoint.chunk_path(operation, sha256, i)
+        write_atomic(path, gzip.compress(json.dumps(registros, ensure_ascii=False).encode("utf-8"), mtime=0))
+        estado["parsed"][str(i)] = len(registros)
+        estado["dropped"] += descartados
+        total += len(registros)
+    checkpoint.save()
+    return total
+
+
+def backfill(client, operations: list[str], workers: int | None = None, max_downloads: int = MAX_DOWNLOADS,
+             base_dir: str = BACKFILL_DIR, chunk_records: int = CHUNK_RECORDS, refresh: bool = False) -> dict:
+    """Descarga, parsea en paralelo y guarda en el histórico; devuelve {operación: resumen}."""
+    no_semanales = [op for op in operations if op not in BACKFILL_OPERATIONS]
+    if no_semanales:
+        raise ValueError(f"Operaciones sin backfill semanal: {no_semanales}")
+    cache = ResponseCache()
+    checkpoint = Checkpoint(base_dir)
+    resumen = {}
+
+    t0 = time.perf_counter()
+    payloads = {}
+    with ThreadPoolExecutor(max_workers=max_downloads) as pool:
+        futures = {
+            pool.submit(cache.fetch, client, op, DOWNLOAD_TIMEOUT, force_refresh=refresh): op for op in operations
+        }
+        for fut in as_completed(futures):
+            op = futures[fut]
+            try:
+                payloads[op] = fut.result()
+            except Exception as e:
+                logger.error("%s: falló la descarga: %s", op, e)
+                resumen[op] = {"error": f"{type(e).__name__}: {e}"}
+    logger.info("Descargas listas en %.1f s", time.perf_counter() - t0)
+
+    max_pending = PENDING_PER_WORKER * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for op in operations:
+            payload = payloads.get(op)
+            if payload is None:
+                continue
+            estado = checkpoint.op(op, payload.sha256, chunk_records)
+            if estado["done"]:
+                logger.info("%s: ya completado (%s registros); se omite", op, estado["records"])
+                resumen[op] = {"records": estado["records"], "parsed": 0, "dropped": estado["dropped"], "skipped": True}
+                continue
+            if estado["parsed"]:
+                logger.info("%s: se retoma con %s trozos ya parseados", op, len(estado["parsed"]))
+
+            tp = time.perf_counter()
+            en_curso = {}
+            nuevos = 0
+            with gzip.open(payload.path, "rb") as f:
+                for i, chunk in enumerate(iter_envelope_chunks(f, chunk_records)):
+                    if str(i) in estado["parsed"]:
+                        continue
+                    en_curso[pool.submit(_parse_chunk, op, chunk)] = i
+                    if len(en_curso) >= max_pending:
+                        hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                        nuevos += _store_chunks(checkpoint, op, payload.sha256, estado, hechos, en_curso)
+            nuevos += _store_chunks(checkpoint, op, payload.sha256, estado, wait(en_curso)[0], en_curso)
+            parse_s = time.perf_counter() - tp
+
+            indices = sorted(int(i) for i in estado["parsed"])
+            paths = [checkpoint.chunk_path(op, payload.sha256, i) for i in indices]
+            hist = sync_history(_iter_chunk_records(paths), HISTORY_DIR)
+            estado["records"] = sum(estado["parsed"].values())
+            estado["done"] = True
+            checkpoint.save()
+            if estado["dropped"]:
+                logger.warning("%s: %s registros descartados por no tener plaza o fecha", op, estado["dropped"])
+            resumen[op] = {
+                "records": estado["records"],
+                "parsed": nuevos,  # solo los de esta corrida; el resto venía del checkpoint
+                "dropped": estado["dropped"],
+                "chunks": len(indices),
+                "parse_seconds": round(parse_s, 3),
+                "records_per_s": round(nuevos / parse_s) if nuevos and parse_s > 0 else None,
+                "weeks_added": hist["weeks_added"],
+            }
+    return resumen
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Backfill histórico SIPSA reanudable y en paralelo")
+    parser.add_argument("--wsdl", default=WSDL_URL, help="URL del WSDL")
+    parser.add_argument("--op", action="append", choices=BACKFILL_OPERATIONS,
+                        help="Operación a traer (repetible); por defecto las semanales del catálogo")
+    parser.add_argument("--workers", type=int, help="Procesos de parseo (por defecto, núcleos disponibles)")
+    parser.add_argument("--max-downloads", type=int, default=MAX_DOWNLOADS, help="Descargas simultáneas")
+    parser.add_argument("--chunk-records", type=int, default=CHUNK_RECORDS, help="Registros por trozo de parseo")
+    parser.add_argument("--refresh", action="store_true", help="Descargar de nuevo aunque la caché siga vigente")
+    args = parser.parse_args(argv)
+
+    try:
+        client = get_client(args.wsdl, operation_timeout=DOWNLOAD_TIMEOUT, session=build_session(args.max_downloads))
+    except Exception as e:
+        logger.error("No se pudo conectar al WSDL: %s", e)
+        return 1
+    disponibles = operation_catalog(client)["operations"]
+    operations = args.op or [op for op in BACKFILL_OPERATIONS if op in disponibles]
+    faltantes = [op for op in operations if op not in disponibles]
+    if faltantes:
+        logger.error("Operaciones no disponibles en el WSDL: %s", faltantes)
+        return 1
+    logger.info("Backfill de: %s", ", ".join(operations))
+
+    t0 = time.perf_counter()
+    resumen = backfill(client, operations, args.workers, args.max_downloads, chunk_records=args.chunk_records,
+                       refresh=args.refresh)
+    elapsed = time.perf_counter() - t0
+    total = sum(r.get("records", 0) for r in resumen.values())
+    parseados = sum(r.get("parsed", 0) for r in resumen.values())
+    for op, r in resumen.items():
+        if "error" in r:
+            print(f"  {op}: ERROR {r['error']}")
+        elif r.get("skipped"):
+            print(f"  {op}: {r['records']} registros, {r['dropped']} descartados (ya completado)")
+        else:
+            print(f"  {op}: {r['records']} registros en {r['chunks']} trozos, {r['dropped']} descartados, "
+                  f"{r['records_per_s']} reg/s de parseo, {len(r['weeks_added'])} semanas nuevas")
+    ritmo = f"{parseados / elapsed:,.0f} reg/s" if parseados and elapsed > 0 else "nada que parsear"
+    print(f"Total: {total} registros, {parseados} parseados en esta corrida, en {elapsed:.1f} s ({ritmo})")
+    return 0 if all("error" not in r for r in resumen.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
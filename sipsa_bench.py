@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de extremo a extremo del script semanal contra el servidor SOAP local.
+
+Levanta sipsa_fake_server.py en un proceso aparte (uno por escala) y mide por
+separado cada etapa de sipsa_plaza_precio_semana.main(): construcción del
+cliente (caché fría y caliente), llamada, normalización, filtro de ventana,
+deduplicación y volcado JSON. Por etapa reporta tiempo (mejor de --repeat),
+registros/s y pico de RSS del proceso; con --trace-memory también el pico de
+memoria Python (tracemalloc) de la etapa. El reporte JSON queda en out/bench/
+y --baseline compara contra uno anterior.
+
+Ejecución:
+  python sipsa_bench.py                         # escalas 1x y 10x, ruta rápida
+  python sipsa_bench.py --scale 1 --scale 100 --zeep
+  python sipsa_bench.py --baseline out/bench/bench_20260301_1200.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime
+
+from sipsa_client import get_client, serialize_response
+from sipsa_columnar import RecordTable
+from sipsa_fake_server import SERVICE_PATH
+from sipsa_normalizer import RecordNormalizer
+from sipsa_output import write_records
+from sipsa_plaza_precio_semana import READ_TIMEOUT
+from sipsa_stream import iter_operation_records
+from sipsa_views import OPERATION_PLAZA_SEMANA, registro_salida, select_ultima_semana
+
+BENCH_DIR = os.path.join("out", "bench")
+DEFAULT_SCALES = (1, 10)
+DEFAULT_REPEAT = 3
+SERVER_START_TIMEOUT = 30
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def _peak_rss_mb() -> float:
+    """Pico de RSS del proceso en MB (ru_maxrss viene en KB en Linux y en bytes en macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_server(scale: int, dump: str | None, record_dir: str | None) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "sipsa_fake_server.py"),
+           "--port", str(port), "--scale", str(scale)]
+    if dump:
+        cmd += ["--dump", dump]
+    if record_dir:
+        cmd += ["--record-dir", record_dir]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wsdl_url = f"http://127.0.0.1:{port}{SERVICE_PATH}?WSDL"
+    limite = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            with urllib.request.urlopen(wsdl_url, timeout=1):
+                return proc, wsdl_url
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > limite:
+                proc.kill()
+                raise RuntimeError(f"El servidor local no arrancó en el puerto {port}")
+            time.sleep(0.1)
+
+
+class _Stage:
+    """Cronómetro de una etapa; guarda segundos y, si trace_memory, el pico de tracemalloc."""
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.seconds = 0.0
+        self.py_peak_mb = None
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._t0
+        if self.trace_memory:
+            self.py_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        return False
+
+
+def _run_once(wsdl_url: str, usar_zeep: bool, trace_memory: bool, workdir: str) -> dict:
+    """Una corrida completa de las etapas de main(); devuelve {etapa: {seconds, records, ...}}."""
+    stages = {}
+
+    def medir(nombre, fn, registros_de=None):
+        with _Stage(trace_memory) as st:
+            resultado = fn()
+        n = registros_de(resultado) if registros_de else None
+        stages[nombre] = {
+            "seconds": st.seconds,
+            "records": n,
+            "records_per_s": (n / st.seconds) if n and st.seconds > 0 else None,
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "py_peak_mb": round(st.py_peak_mb, 1) if st.py_peak_mb is not None else None,
+        }
+        return resultado
+
+    cache_dir = os.path.join(workdir, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    medir("client_build_cold", lambda: get_client(wsdl_url, READ_TIMEOUT, cache_dir=cache_dir))
+    client = medir("client_build_warm", lambda: get_client(wsdl_url, READ_TIMEOUT, cache_dir=cache_dir))
+
+    if usar_zeep:
+        raw = medir("call", lambda: getattr(client.service, OPERATION_PLAZA_SEMANA)())
+        records = medir("serialize", lambda: serialize_response(raw), len)
+        del raw
+    else:
+        records = medir("call", lambda: list(iter_operation_records(client, OPERATION_PLAZA_SEMANA, READ_TIMEOUT)), len)
+
+    registros = medir("normalize", lambda rs=records: list(RecordNormalizer().iter_normalized(rs)), len)
+    del records
+    _, ultima_semana = medir("window_filter", lambda rs=registros: select_ultima_semana(rs), lambda r: r[0])
+    del registros
+    unicos = medir(
+        "dedup",
+        lambda: RecordTable.from_records(registro_salida(r) for r in ultima_semana).dedup(),
+        lambda _: len(ultima_semana),
+    )
+
+    out_path = os.path.join(workdir, "salida.json")
+    medir("json_dump", lambda: write_records(unicos.iter_dicts(), out_path), lambda n: n)
+    stages["json_dump"]["bytes"] = os.path.getsize(out_path)
+    return stages
+
+
+def _best_of(corridas: list[dict]) -> dict:
+    """Por etapa, la corrida de menor tiempo (menos ruido que la media)."""
+    return {nombre: min((c[nombre] for c in corridas), key=lambda s: s["seconds"]) for nombre in corridas[0]}
+
+
+def run_benchmark(scales=DEFAULT_SCALES, repeat: int = DEFAULT_REPEAT, usar_zeep: bool = False,
+                  trace_memory: bool = False, dump: str | None = None, record_dir: str | None = None) -> dict:
+    """Corre el benchmark por escala (de menor a mayor, porque el pico de RSS es acumulado) y arma el reporte."""
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "path": "zeep" if usar_zeep else "fast",
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="sipsa_bench_") as workdir:
+        for scale in sorted(scales):
+            proc, wsdl_url = _start_fake_server(scale, dump, record_dir)
+            try:
+                corridas = []
+                for i in range(repeat):
+                    logger.info("Escala %sx, corrida %s/%s", scale, i + 1, repeat)
+                    corridas.append(_run_once(wsdl_url, usar_zeep, trace_memory, workdir))
+            finally:
+                proc.terminate()
+                proc.wait()
+            stages = _best_of(corridas)
+            report["scales"][str(scale)] = {
+                "stages": stages,
+                "total_seconds": sum(s["seconds"] for s in stages.values()),
+            }
+    return report
+
+
+def _print_report(report: dict, baseline: dict | None = None) -> None:
+    print(f"=== Benchmark SIPSA ({report['path']}, mejor de {report['repeat']}) ===")
+    for scale, data in report["scales"].items():
+        base = (baseline or {}).get("scales", {}).get(scale, {}).get("stages", {})
+        print(f"\nEscala {scale}x  total {data['total_seconds']:.3f} s")
+        print(f"  {'etapa':<18} {'s':>9} {'reg/s':>12} {'RSS MB':>8}" + ("  vs base" if base else ""))
+        for nombre, s in data["stages"].items():
+            rps = f"{s['records_per_s']:,.0f}" if s["records_per_s"] else "-"
+            linea = f"  {nombre:<18} {s['seconds']:>9.4f} {rps:>12} {s['peak_rss_mb']:>8.1f}"
+            if nombre in base and base[nombre]["seconds"] > 0:
+                linea += f"  x{s['seconds'] / base[nombre]['seconds']:.2f}"
+            print(linea)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del script semanal SIPSA contra un servidor local")
+    parser.add_argument("--scale", type=int, action="append", help="Multiplicador de registros (repetible); por defecto 1 y 10")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Corridas por escala (se reporta la mejor)")
+    parser.add_argument("--zeep", action="store_true", help="Medir la ruta Zeep completa en lugar de la ruta rápida")
+    parser.add_argument("--trace-memory", action="store_true", help="Pico de memoria Python por etapa (tracemalloc, más lento)")
+    parser.add_argument("--dump", help="Volcado semanal JSON para sintetizar respuestas")
+    parser.add_argument("--record-dir", help="Directorio con envelopes grabados <operación>.xml")
+    parser.add_argument("--baseline", help="Reporte JSON anterior para comparar tiempos")
+    parser.add_argument("--out", help="Ruta del reporte JSON (por defecto out/bench/bench_<fecha>.json)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    try:
+        report = run_benchmark(
+            tuple(args.scale or DEFAULT_SCALES), args.repeat, args.zeep, args.trace_memory, args.dump, args.record_dir
+        )
+    except Exception as e:
+        logger.exception("Falló el benchmark: %s", e)
+        return 1
+
+    _print_report(report, baseline)
+
+    out_path = args.out or os.path.join(BENCH_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M')}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nReporte guardado: {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cliente SIPSA compartido por los scripts de consulta.
+
+Construye la sesión HTTP y el cliente Zeep con una caché en disco de los
+documentos WSDL/XSD (revalidación por TTL y ETag/Last-Modified) y del catálogo
+de servicios y operaciones ya resuelto. En un arranque en caliente el cliente
+se construye sin ninguna petición de red para metadatos.
+
+La sesión pide respuestas comprimidas (gzip), reutiliza las conexiones keep-alive
+de un pool dimensionado por host y lleva contadores de bytes en el cable,
+bytes descomprimidos, reintentos y cambios de endpoint (session.stats). Si
+HTTPS falla al conectar, el transport pasa a HTTP conservando el cliente ya
+construido, la sesión y sus conexiones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from urllib3.exceptions import SSLError as Urllib3SSLError
+from urllib3.util.retry import Retry
+from zeep import Client
+from zeep.helpers import serialize_object
+from zeep.transports import Transport
+
+from sipsa_util import read_json, write_atomic
+
+CONNECT_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+POOL_CONNECTIONS = 2  # hosts con pool propio: el endpoint HTTPS y su alternativa HTTP
+POOL_MAXSIZE = 10
+ACCEPT_ENCODING = "gzip, deflate"
+FALLBACK_SCHEME = "http"
+CACHE_DIR = os.path.join(".cache", "sipsa")
+WSDL_CACHE_VERSION = 1
+WSDL_CACHE_TTL = 24 * 3600  # segundos antes de revalidar con el servidor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransportStats:
+    """Contadores de red de una sesión; los bytes son de cuerpos de respuesta leídos completos."""
+
+    requests: int = 0
+    retries: int = 0
+    fallbacks: int = 0
+    bytes_sent: int = 0
+    bytes_wire: int = 0  # tal como viajaron (comprimidos si el servidor aceptó gzip)
+    bytes_decoded: int = 0
+    compressed_responses: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, response, decoded_bytes: int | None = None) -> None:
+        """Suma una respuesta ya consumida: bytes leídos del socket, descomprimidos y reintentos de urllib3."""
+        raw = response.raw
+        wire = raw.tell() if raw is not None else 0
+        history = getattr(getattr(raw, "retries", None), "history", ()) or ()
+        body = response.request.body if response.request is not None else None
+        with self._lock:
+            self.requests += 1
+            self.retries += len(history)
+            self.bytes_sent += len(body) if isinstance(body, (bytes, str)) else 0
+            self.bytes_wire += wire
+            self.bytes_decoded += decoded_bytes if decoded_bytes is not None else len(response.content)
+            if response.headers.get("Content-Encoding"):
+                self.compressed_responses += 1
+
+    def add(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return asdict(self)
+
+    def summary(self) -> str:
+        ratio = f" ({100 * self.bytes_wire / self.bytes_decoded:.0f}%)" if self.bytes_decoded else ""
+        return (
+            f"{self.requests} peticiones, {self.bytes_wire} bytes en el cable de {self.bytes_decoded} "
+            f"descomprimidos{ratio}, {self.retries} reintentos, {self.fallbacks} fallbacks"
+        )
+
+
+def build_session(pool_maxsize: int = POOL_MAXSIZE):
+    """Session con timeouts y retries (incluye POST para SOAP), gzip y pool_maxsize conexiones keep-alive por host."""
+    session = requests.Session()
+    # Un timeout de lectura no se reintenta: en POST reenviaría la consulta y descargaría todo de nuevo
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "POST", "OPTIONS"]),  # POST para SOAP
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=POOL_CONNECTIONS, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    session.stats = TransportStats()
+    return session
+
+
+def session_stats(session) -> TransportStats:
+    """Contadores de la sesión (se crean si la sesión no viene de build_session)."""
+    stats = getattr(session, "stats", None)
+    if stats is None:
+        stats = session.stats = TransportStats()
+    return stats
+
+
+def _is_connect_failure(e: requests.RequestException) -> bool:
+    """
+    True si la petición falló al conectar (TCP o TLS), antes de enviarse.
+
+    Un timeout de lectura llega como ConnectionError(MaxRetryError(ReadTimeoutError))
+    porque read=0: el servidor ya recibió la consulta y no hay que repetirla.
+    """
+    if isinstance(e, (requests.exceptions.SSLError, requests.exceptions.ConnectTimeout)):
+        return True
+    if not isinstance(e, requests.exceptions.ConnectionError):
+        return False
+    reason = e.args[0] if e.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, (NewConnectionError, Urllib3SSLError))
+
+
+def _with_scheme(url: str, scheme: str) -> str:
+    return urlsplit(url)._replace(scheme=scheme).geturl()
+
+
+def _wsdl_cache_dir(cache_dir: str) -> str:
+    return os.path.join(cache_dir, "wsdl", f"v{WSDL_CACHE_VERSION}")
+
+
+def _cache_key(url: str) -> str:
+    """Clave de caché independiente del esquema: http y https comparten documentos."""
+    parts = urlsplit(url)
+    sin_esquema = parts._replace(scheme="").geturl()
+    return hashlib.sha256(sin_esquema.encode("utf-8")).hexdigest()[:32]
+
+
+class CachingTransport(Transport):
+    """
+    Transport Zeep que sirve WSDL/XSD desde disco y revalida con el servidor al vencer el TTL.
+
+    Las peticiones a un endpoint HTTPS que fallan al conectar se repiten con
+    fallback_scheme; desde ahí todas las peticiones usan ese esquema (mismo pool).
+    """
+
+    def __init__(self, *args, cache_dir: str = CACHE_DIR, ttl: float = WSDL_CACHE_TTL,
+                 fallback_scheme: str | None = FALLBACK_SCHEME, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+        self.cache_dir = _wsdl_cache_dir(cache_dir)
+        self.ttl = ttl
+        self.fallback_scheme = fallback_scheme
+        self.scheme: str | None = None  # esquema forzado tras un fallback
+        self.network_loads = 0
+        self.document_hashes: dict[str, str] = {}
+
+    @property
+    def stats(self) -> TransportStats:
+        return session_stats(self.session)
+
+    @property
+    def operation_timeout(self):
+        return getattr(self._local, "operation_timeout", self._operation_timeout)
+
+    @operation_timeout.setter
+    def operation_timeout(self, value) -> None:
+        self._operation_timeout = value
+
+    @contextmanager
+    def operation_timeout_for(self, timeout: float):
+        """Timeout de operación solo para el hilo actual; el transport se comparte entre hilos."""
+        previo = getattr(self._local, "operation_timeout", None)
+        self._local.operation_timeout = timeout
+        try:
+            yield
+        finally:
+            if previo is None:
+                del self._local.operation_timeout
+            else:
+                self._local.operation_timeout = previo
+
+    def address(self, url: str) -> str:
+        """URL efectiva: con el esquema del fallback si ya se activó."""
+        if self.scheme and urlsplit(url).scheme in ("http", "https"):
+            return _with_scheme(url, self.scheme)
+        return url
+
+    def request(self, method: str, url: str, **kwargs):
+        """Petición por la sesión; si HTTPS no conecta, pasa a fallback_scheme y repite una vez."""
+        url = self.address(url)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            if not self.fallback_scheme or urlsplit(url).scheme != "https" or not _is_connect_failure(e):
+                raise
+            logger.warning("Falló HTTPS (%s). Intentando %s...", e, self.fallback_scheme.upper())
+            self.scheme = self.fallback_scheme
+            self.stats.add("fallbacks")
+            return self.session.request(method, self.address(url), **kwargs)
+
+    def post(self, address, message, headers):
+        self.logger.debug("HTTP Post to %s", address)
+        response = self.request("POST", address, data=message, headers=headers, timeout=self.operation_timeout)
+        self.stats.record(response)
+        return response
+
+    def _load_remote_data(self, url):
+        if urlsplit(url).scheme == "file":
+            return super()._load_remote_data(url)
+
+        key = _cache_key(url)
+        body_path = os.path.join(self.cache_dir, f"{key}.xml")
+        meta_path = os.path.join(self.cache_dir, f"{key}.json")
+        meta = read_json(meta_path)
+        body = None
+        if meta and meta.get("version") == WSDL_CACHE_VERSION:
+            try:
+                with open(body_path, "rb") as f:
+                    body = f.read()
+            except OSError:
+                body = None
+            if body is not None and hashlib.sha256(body).hexdigest() != meta.get("sha256"):
+                logger.warning("Caché WSDL corrupta para %s; se descarga de nuevo", url)
+                body = None
+
+        if body is not None and time.time() - meta.get("fetched_at", 0) < self.ttl:
+            self.document_hashes[url] = meta["sha256"]
+            return body
+
+        headers = {}
+        if body is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        self.logger.debug("Loading remote data from: %s", url)
+        try:
+            response = self.request("GET", url, headers=headers, timeout=self.load_timeout)
+            self.network_loads += 1
+        except requests.RequestException as e:
+            if body is None:
+                raise
+            logger.warning("No se pudo revalidar %s (%s); se usa la copia en caché", url, e)
+            self.document_hashes[url] = meta["sha256"]
+            return body
+
+        with closing(response):
+            if response.status_code == 304 and body is not None:
+                meta["fetched_at"] = time.time()
+                write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+                self.document_hashes[url] = meta["sha256"]
+                return body
+            response.raise_for_status()
+            content = response.content
+            self.stats.record(response)
+
+        sha = hashlib.sha256(content).hexdigest()
+        write_atomic(body_path, content)
+        meta = {
+            "version": WSDL_CACHE_VERSION,
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "sha256": sha,
+        }
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        self.document_hashes[url] = sha
+        return content
+
+
+def get_client(wsdl_url: str, operation_timeout: float, cache_dir: str = CACHE_DIR, ttl: float = WSDL_CACHE_TTL,
+               session=None, fallback_scheme: str | None = FALLBACK_SCHEME):
+    """
+    Cliente Zeep con transport cacheado (timeout connect=CONNECT_TIMEOUT, operación=operation_timeout).
+
+    Con fallback_scheme, un WSDL HTTPS inalcanzable se carga por ese esquema con el
+    mismo transport, y las operaciones siguen por él (ver CachingTransport.request).
+    """
+    transport = CachingTransport(
+        session=session or build_session(),
+        timeout=CONNECT_TIMEOUT,
+        operation_timeout=operation_timeout,
+        cache_dir=cache_dir,
+        ttl=ttl,
+        fallback_scheme=fallback_scheme,
+    )
+    client = Client(wsdl=wsdl_url, transport=transport)
+    logger.info(
+        "WSDL listo (%s documentos, %s descargas de red%s)",
+        len(transport.document_hashes),
+        transport.network_loads,
+        f", vía {transport.scheme.upper()}" if transport.scheme else "",
+    )
+    return client
+
+
+def service_address(client) -> str:
+    """Dirección efectiva del servicio SOAP del cliente (con el esquema del fallback, si aplica)."""
+    address = client.service._binding_options["address"]
+    transport = client.transport
+    return transport.address(address) if isinstance(transport, CachingTransport) else address
+
+
+def use_endpoint(client, scheme: str) -> None:
+    """Fuerza http/https para las peticiones siguientes sin reconstruir el cliente ni la sesión."""
+    if not isinstance(client.transport, CachingTransport):
+        raise TypeError("use_endpoint requiere un cliente de get_client")
+    client.transport.scheme = scheme
+
+
+def _build_catalog(client: Client) -> dict:
+    services = {}
+    for svc in client.wsdl.services.values():
+        ports = {}
+        for port in svc.ports.values():
+            if port.binding:
+                ports[port.name] = list(port.binding._operations.keys())
+        services[svc.name] = ports
+    return {
+        "services": services,
+        "operations": list(client.service._binding._operations.keys()),
+    }
+
+
+def operation_catalog(client: Client, cache_dir: str = CACHE_DIR) -> dict:
+    """
+    Catálogo {services: {servicio: {port: [ops]}}, operations: [...]} del cliente.
+
+    Se guarda en disco asociado al hash de los documentos WSDL/XSD cargados; mientras
+    esos documentos no cambien se reutiliza sin recorrer los bindings.
+    """
+    transport = client.transport
+    hashes = getattr(transport, "document_hashes", None)
+    if not hashes:
+        return _build_catalog(client)
+    digest = hashlib.sha256("\n".join(sorted(hashes.values())).encode("utf-8")).hexdigest()
+    path = os.path.join(_wsdl_cache_dir(cache_dir), f"catalog_{_cache_key(client.wsdl.location)}.json")
+    cached = read_json(path)
+    if cached and cached.get("documents_sha256") == digest:
+        return cached["catalog"]
+    catalog = _build_catalog(client)
+    write_atomic(path, json.dumps({"documents_sha256": digest, "catalog": catalog}).encode("utf-8"))
+    return catalog
+
+
+def resolve_operation(catalog: dict, candidate: str, keywords: tuple[str, ...] = ()) -> str | None:
+    """Nombre real de la operación: coincidencia exacta sin mayúsculas o la primera que contenga todas las keywords."""
+    ops = catalog.get("operations", [])
+    target = candidate.lower()
+    for name in ops:
+        if name.lower() == target:
+            return name
+    if keywords:
+        for name in ops:
+            if all(k in name.lower() for k in keywords):
+                return name
+    return None
+
+
+def serialize_response(raw_response) -> list[dict]:
+    """Convierte la respuesta Zeep a lista de dicts serializables."""
+    if raw_response is None:
+        return []
+    records = []
+    try:
+        iterable = list(raw_response) if not isinstance(raw_response, list) else raw_response
+    except TypeError:
+        iterable = [raw_response]
+    for item in iterable:
+        try:
+            records.append(serialize_object(item))
+        except Exception:
+            if hasattr(item, "__dict__"):
+                records.append(dict(item))
+            else:
+                records.append({"raw": str(item)})
+    return records
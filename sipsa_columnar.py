@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contenedor columnar compacto para registros SIPSA (producto, plaza, fecha, precios).
+
+Reemplaza list[dict] en el pipeline: producto, plaza y fecha se guardan como
+códigos enteros contra un diccionario de strings internados (hay ~80 plazas y
+~350 productos distintos frente a miles de registros) y los precios en arrays
+float64 (NaN = sin dato). Filtro, deduplicación, agrupación por plaza y orden
+son operaciones sobre arrays.
+"""
+
+from array import array
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Columnas numéricas en el orden de la salida semanal
+PRICE_COLUMNS = ("precio", "precioPromedioKg", "maximoKg", "minimoKg")
+_NONE_CODE = -1
+
+
+class StringDictionary:
+    """Strings internados -> código entero (orden de primera aparición). None usa el código -1."""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: list[str] = []
+        self._codes: dict[str, int] = {}
+        for v in values:
+            self.code(v)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: str | None) -> int:
+        if value is None:
+            return _NONE_CODE
+        c = self._codes.get(value)
+        if c is None:
+            c = len(self.values)
+            self._codes[value] = c
+            self.values.append(value)
+        return c
+
+    def lookup(self, value: str | None) -> int | None:
+        """Código de un valor ya internado, o None si no existe."""
+        if value is None:
+            return _NONE_CODE
+        return self._codes.get(value)
+
+    def decode(self, code: int) -> str | None:
+        return None if code == _NONE_CODE else self.values[code]
+
+
+def _to_float(v) -> float:
+    if v is None:
+        return np.nan
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class RecordTable:
+    """
+    Registros en columnas: códigos int32 para producto/plaza/fecha y float64 para precios.
+
+    Las operaciones devuelven índices o tablas nuevas que comparten los diccionarios.
+    """
+
+    def __init__(self, productos: StringDictionary, plazas: StringDictionary, fechas: StringDictionary,
+                 producto, plaza, fecha, prices: dict[str, np.ndarray]):
+        self.productos = productos
+        self.plazas = plazas
+        self.fechas = fechas
+        self.producto = np.asarray(producto, dtype=np.int32)
+        self.plaza = np.asarray(plaza, dtype=np.int32)
+        self.fecha = np.asarray(fecha, dtype=np.int32)
+        self.prices = {c: np.asarray(prices[c], dtype=np.float64) for c in PRICE_COLUMNS}
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "RecordTable":
+        """Construye la tabla consumiendo records (dicts con las claves de la salida semanal) de a uno."""
+        productos, plazas, fechas = StringDictionary(), StringDictionary(), StringDictionary()
+        cod_producto, cod_plaza, cod_fecha = array("i"), array("i"), array("i")
+        buffers = {c: array("d") for c in PRICE_COLUMNS}
+        for r in records:
+            cod_producto.append(productos.code(r.get("producto")))
+            cod_plaza.append(plazas.code(r.get("plaza")))
+            cod_fecha.append(fechas.code(r.get("fecha")))
+            for c in PRICE_COLUMNS:
+                buffers[c].append(_to_float(r.get(c)))
+        return cls(
+            productos, plazas, fechas,
+            np.frombuffer(cod_producto, dtype=np.int32),
+            np.frombuffer(cod_plaza, dtype=np.int32),
+            np.frombuffer(cod_fecha, dtype=np.int32),
+            {c: np.frombuffer(buffers[c], dtype=np.float64) for c in PRICE_COLUMNS},
+        )
+
+    def __len__(self) -> int:
+        return len(self.producto)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes de las columnas (sin contar los diccionarios)."""
+        return self.producto.nbytes + self.plaza.nbytes + self.fecha.nbytes + sum(a.nbytes for a in self.prices.values())
+
+    def take(self, idx) -> "RecordTable":
+        """Subtabla con las filas idx (array de índices o máscara booleana)."""
+        return RecordTable(
+            self.productos, self.plazas, self.fechas,
+            self.producto[idx], self.plaza[idx], self.fecha[idx],
+            {c: a[idx] for c, a in self.prices.items()},
+        )
+
+    def dedup(self) -> "RecordTable":
+        """Deja la primera aparición de cada (producto, plaza, fecha), conservando el orden."""
+        n_pl = len(self.plazas) + 1
+        n_fe = len(self.fechas) + 1
+        keys = ((self.producto.astype(np.int64) + 1) * n_pl + (self.plaza + 1)) * n_fe + (self.fecha + 1)
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        return self.take(first)
+
+    def plaza_counts(self) -> np.ndarray:
+        """Número de registros por código de plaza (registros sin plaza no se cuentan)."""
+        validos = self.plaza[self.plaza != _NONE_CODE]
+        return np.bincount(validos, minlength=len(self.plazas))
+
+    def group_by_plaza(self) -> dict[int, np.ndarray]:
+        """Código de plaza -> índices de sus filas, en orden original."""
+        orden = np.argsort(self.plaza, kind="stable")
+        codigos, inicios = np.unique(self.plaza[orden], return_index=True)
+        grupos = np.split(orden, inicios[1:])
+        return {int(c): g for c, g in zip(codigos, grupos)}
+
+    def argsort_by(self, column: str, descending: bool = False) -> np.ndarray:
+        """Índices ordenados por una columna de precios; NaN siempre al final."""
+        values = self.prices[column]
+        key = -values if descending else values
+        return np.argsort(key, kind="stable")
+
+    def row(self, i: int) -> dict:
+        """Fila i como dict con las claves y tipos de la salida semanal (NaN -> None)."""
+        out = {
+            "producto": self.productos.decode(int(self.producto[i])),
+            "plaza": self.plazas.decode(int(self.plaza[i])),
+        }
+        for c in ("precio", "precioPromedioKg"):
+            v = self.prices[c][i]
+            out[c] = None if np.isnan(v) else float(v)
+        out["fecha"] = self.fechas.decode(int(self.fecha[i]))
+        for c in ("maximoKg", "minimoKg"):
+            v = self.prices[c][i]
+            out[c] = None if np.isnan(v) else float(v)
+        return out
+
+    def iter_dicts(self, idx: Iterable[int] | None = None) -> Iterator[dict]:
+        """Filas como dicts (todas o las de idx), generadas de a una."""
+        for i in range(len(self)) if idx is None else idx:
+            yield self.row(int(i))
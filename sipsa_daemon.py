@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servicio local de larga duración: cliente SIPSA caliente, datos en memoria y API HTTP.
+
+Construye el cliente Zeep una sola vez y refresca los datos según la publicación
+SIPSA: la próxima actualización se programa al vencimiento de la caché de
+respuestas (sipsa_response_cache), con un mínimo de --min-interval. Si el
+contenido no cambió no se recalcula nada. En cada refresco con cambios se
+precalculan las vistas como JSON listo para enviar:
+
+  GET /v1/semana      productos por plaza de la última semana (?plaza=texto)
+  GET /v1/medellin    registros de Medellín con top baratos/caros
+  GET /v1/alerts      ProductAlert del motor de ahorro (?plaza=texto&category=FRU)
+  GET /v1/status      estado de los refrescos (sin caché)
+  POST /v1/refresh    fuerza un refresco
+
+Las respuestas se guardan en una caché LRU (por generación de datos, ruta y query)
+con ETag; If-None-Match devuelve 304 y Accept-Encoding: gzip recibe el cuerpo ya
+comprimido, con su propio ETag (sufijo -gzip).
+
+Si existe el archivo de suscripciones (sipsa_subscriptions), cada refresco con
+cambios notifica las alertas nuevas o cambiadas al sink de --notify-sink.
+
+Ejecución:
+  python sipsa_daemon.py --port 8080
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from sipsa_ahorro import AhorroState, build_alerts, state_path, update_state_from_history
+from sipsa_client import get_client
+from sipsa_columnar import RecordTable
+from sipsa_history import HISTORY_DIR, sync_history
+from sipsa_normalizer import RecordNormalizer
+from sipsa_output import json_default
+from sipsa_registry import normalize_key
+from sipsa_response_cache import ResponseCache
+from sipsa_subscriptions import NOTIFICATIONS_PATH, SUBSCRIPTIONS_PATH, AlertDispatcher, make_sink
+from sipsa_views import (
+    OPERATION_CIUDAD, OPERATION_PLAZA_SEMANA, filter_medellin, latest_fecha_captura, registro_salida,
+    select_ultima_semana, top_por_precio,
+)
+
+WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
+READ_TIMEOUT = 120
+MIN_REFRESH_INTERVAL = 15 * 60  # segundos entre refrescos aunque la caché ya haya vencido
+RETRY_INTERVAL = 5 * 60  # tras un refresco fallido
+LRU_SIZE = 256
+DEFAULT_PORT = 8080
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+
+@dataclass
+class Snapshot:
+    """Datos de un refresco; inmutable una vez publicado."""
+
+    generation: int = 0
+    refreshed_at: float | None = None
+    sources: dict[str, str] = field(default_factory=dict)  # operación -> sha256 de la respuesta
+    semana: list[dict] = field(default_factory=list)
+    medellin: dict = field(default_factory=dict)
+    alerts: list[dict] = field(default_factory=list)
+
+
+class ResponseLRU:
+    """Cuerpos JSON (y su versión gzip) por clave, con ETag; descarta los menos usados."""
+
+    def __init__(self, maxsize: int = LRU_SIZE):
+        self.maxsize = maxsize
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_or_build(self, key, build) -> tuple[bytes, str, list]:
+        """(cuerpo, etag, [gzip perezoso]) de la clave; build() genera el cuerpo si no está."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        body = build()
+        entry = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"', [None])
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return entry
+
+
+class SipsaDaemon:
+    """Cliente caliente + snapshot en memoria + programación de refrescos."""
+
+    def __init__(self, wsdl_url: str = WSDL_URL, history_dir: str = HISTORY_DIR,
+                 min_interval: float = MIN_REFRESH_INTERVAL, lru_size: int = LRU_SIZE,
+                 dispatcher: AlertDispatcher | None = None):
+        self.wsdl_url = wsdl_url
+        self.history_dir = history_dir
+        self.min_interval = min_interval
+        self.cache = ResponseCache()
+        self.lru = ResponseLRU(lru_size)
+        self.snapshot = Snapshot()
+        self.dispatcher = dispatcher
+        self.client = None
+        self.next_refresh = 0.0
+        self.last_error: str | None = None
+        self._force_next = False
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = get_client(self.wsdl_url, operation_timeout=READ_TIMEOUT)
+        return self.client
+
+    def refresh(self, force: bool = False) -> bool:
+        """Consulta las operaciones (vía caché de respuestas) y recalcula las vistas si algo cambió."""
+        with self._refresh_lock:
+            client = self._get_client()
+            semana = self.cache.fetch(client, OPERATION_PLAZA_SEMANA, READ_TIMEOUT, force_refresh=force)
+            ciudad = self.cache.fetch(client, OPERATION_CIUDAD, READ_TIMEOUT, force_refresh=force)
+            self.next_refresh = max(min(semana.expires_at, ciudad.expires_at), time.time() + self.min_interval)
+            sources = {OPERATION_PLAZA_SEMANA: semana.sha256, OPERATION_CIUDAD: ciudad.sha256}
+            if sources == self.snapshot.sources:
+                logger.info("Sin cambios en SIPSA; próximo refresco %s", time.ctime(self.next_refresh))
+                return False
+
+            t0 = time.perf_counter()
+            normalizer = RecordNormalizer()
+            _, ultima_semana = select_ultima_semana(normalizer.iter_normalized(semana.iter_records()))
+            tabla = RecordTable.from_records(registro_salida(r) for r in ultima_semana).dedup()
+            semana_view = list(tabla.iter_dicts())
+
+            medellin = filter_medellin(normalizer.iter_normalized(ciudad.iter_records(), keep_raw=True))
+            baratos, caros = top_por_precio(medellin)
+            medellin_view = {
+                "total": len(medellin),
+                "fechaCaptura": latest_fecha_captura(medellin),
+                "baratos": [r.raw for r in baratos],
+                "caros": [r.raw for r in caros],
+                "registros": [r.raw for r in medellin],
+            }
+
+            sync_history(semana_view, self.history_dir)
+            ahorro_path = state_path(self.history_dir)
+            state = AhorroState.load(ahorro_path)
+            if update_state_from_history(state, self.history_dir):
+                state.save(ahorro_path)
+            alerts = build_alerts(state)
+            self._dispatch(alerts)
+
+            self.snapshot = Snapshot(
+                generation=self.snapshot.generation + 1,
+                refreshed_at=time.time(),
+                sources=sources,
+                semana=semana_view,
+                medellin=medellin_view,
+                alerts=alerts,
+            )
+            logger.info(
+                "Datos actualizados (generación %s): %s semana, %s Medellín, %s alertas en %.2f s",
+                self.snapshot.generation, len(semana_view), len(medellin), len(alerts), time.perf_counter() - t0,
+            )
+            return True
+
+    def _dispatch(self, alerts: list[dict]) -> None:
+        """Notifica a los suscriptores; un fallo del sink no interrumpe el refresco."""
+        if self.dispatcher is None or not os.path.exists(self.dispatcher.subscriptions_path):
+            return
+        try:
+            resumen = self.dispatcher.dispatch(alerts)
+        except (OSError, ValueError) as e:
+            logger.error("Falló el envío de notificaciones: %s", e)
+            return
+        if resumen["notifications"]:
+            logger.info("%s notificaciones para %s contactos", resumen["notifications"], resumen["contacts"])
+
+    def run_scheduler(self) -> None:
+        """Bucle de refrescos hasta stop(); un fallo reintenta tras RETRY_INTERVAL."""
+        while not self._stop.is_set():
+            if time.time() >= self.next_refresh:
+                force, self._force_next = self._force_next, False
+                try:
+                    self.refresh(force=force)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    self.next_refresh = time.time() + RETRY_INTERVAL
+                    logger.error("Falló el refresco: %s; reintento en %s s", self.last_error, RETRY_INTERVAL)
+            self._wake.wait(max(1.0, self.next_refresh - time.time()))
+            self._wake.clear()
+
+    def request_refresh(self) -> None:
+        """Refresco inmediato descargando de nuevo aunque la caché de respuestas siga vigente."""
+        self._force_next = True
+        self.next_refresh = 0.0
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def status(self) -> dict:
+        snap = self.snapshot
+        return {
+            "generation": snap.generation,
+            "refreshedAt": snap.refreshed_at,
+            "nextRefresh": self.next_refresh,
+            "sources": snap.sources,
+            "lastError": self.last_error,
+            "lru": {"size": len(self.lru), "hits": self.lru.hits, "misses": self.lru.misses},
+        }
+
+    def render(self, path: str, query: dict[str, list[str]]) -> bytes | None:
+        """Cuerpo JSON de una vista del snapshot actual, o None si la ruta no existe."""
+        snap = self.snapshot
+        plazas = [normalize_key(p) for p in query.get("plaza", [])]
+        if path == "/v1/semana":
+            rows = snap.semana
+            if plazas:
+                rows = [r for r in rows if any(p in normalize_key(r["plaza"]) for p in plazas)]
+            return _dumps(rows)
+        if path == "/v1/medellin":
+            return _dumps(snap.medellin)
+        if path == "/v1/alerts":
+            rows = snap.alerts
+            if plazas:
+                rows = [a for a in rows if any(p in normalize_key(a["market"]) for p in plazas)]
+            categorias = set(query.get("category", []))
+            if categorias:
+                rows = [a for a in rows if a["category"] in categorias]
+            return _dumps(rows)
+        return None
+
+
+def _make_handler(daemon: SipsaDaemon):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: bytes = b"", headers: dict | None = None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/v1/status":
+                return self._send(200, _dumps(daemon.status()), {"Content-Type": "application/json", "Cache-Control": "no-cache"})
+            query = parse_qs(url.query)
+            snap = daemon.snapshot
+            key = (snap.generation, url.path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+            body, etag, gz = daemon.lru.get_or_build(key, lambda: daemon.render(url.path, query) or b"")
+            if not body:
+                return self._send(404, b'{"error":"not found"}', {"Content-Type": "application/json"})
+            # Cada codificación es otra representación: ETag propio y Vary siempre
+            comprimir = "gzip" in (self.headers.get("Accept-Encoding") or "")
+            if comprimir:
+                etag = etag[:-1] + '-gzip"'
+            validadores = {"ETag": etag, "Vary": "Accept-Encoding"}
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, b"", validadores)
+            headers = {"Content-Type": "application/json; charset=utf-8", "Cache-Control": "no-cache", **validadores}
+            if comprimir:
+                if gz[0] is None:
+                    gz[0] = gzip.compress(body, mtime=0)
+                headers["Content-Encoding"] = "gzip"
+                body = gz[0]
+            return self._send(200, body, headers)
+
+        do_HEAD = do_GET
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/v1/refresh":
+                return self._send(404, b'{"error":"not found"}', {"Content-Type": "application/json"})
+            daemon.request_refresh()
+            return self._send(202, b'{"refresh":"scheduled"}', {"Content-Type": "application/json"})
+
+        def log_message(self, fmt, *args):
+            logger.debug("http: " + fmt, *args)
+
+    return Handler
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Servicio local SIPSA con datos en memoria y API HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--wsdl", default=WSDL_URL, help="URL del WSDL")
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--min-interval", type=float, default=MIN_REFRESH_INTERVAL, help="Segundos mínimos entre refrescos")
+    parser.add_argument("--lru-size", type=int, default=LRU_SIZE, help="Respuestas HTTP en caché")
+    parser.add_argument("--subscriptions", default=SUBSCRIPTIONS_PATH, help="Suscripciones a alertas de precio")
+    parser.add_argument("--notify-sink", default=NOTIFICATIONS_PATH, help="Archivo NDJSON o URL http(s) de notificaciones")
+    args = parser.parse_args(argv)
+
+    dispatcher = AlertDispatcher(make_sink(args.notify_sink), args.subscriptions)
+    daemon = SipsaDaemon(args.wsdl, args.history_dir, args.min_interval, args.lru_size, dispatcher)
+    scheduler = threading.Thread(target=daemon.run_scheduler, name="sipsa-refresh", daemon=True)
+    scheduler.start()
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(daemon))
+    server.daemon_threads = True
+    logger.info("Escuchando en http://%s:%s/v1/ (pid %s)", args.host, args.port, os.getpid())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Diferencias entre dos snapshots semanales: delta en lugar de re-exportar todo.
+
+Une el snapshot nuevo con el anterior por (producto, plaza) con un hash join
+(un dict del anterior, un recorrido del nuevo, O(n + m)) y emite solo:
+
+  inserted  pares nuevos, con la fila completa
+  removed   pares que ya no aparecen
+  changed   pares con algún valor distinto (precio, máximo o mínimo), con la fila
+            nueva completa más precio anterior, delta y delta %
+
+Los pares con los mismos valores no se emiten aunque cambie la fecha; la fecha
+del snapshot nuevo va en la cabecera del delta. Si un snapshot trae varias fechas
+para un par, se toma la más reciente. apply_delta reconstruye el snapshot nuevo
+(por par) a partir del anterior y el delta: las filas insertadas y cambiadas se
+toman completas del delta; las no emitidas conservan la fila anterior, con su fecha.
+
+Ejecución:
+  python sipsa_diff.py                            # los dos volcados semanales más recientes de out/
+  python sipsa_diff.py ANTERIOR.json NUEVO.json --out out/delta.json
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from typing import Iterable
+
+from sipsa_output import iter_records
+from sipsa_util import file_sha256, write_atomic
+
+DUMP_GLOB = os.path.join("out", "sipsa_plaza_precio_semana_*")
+OUT_DIR = "out"
+DELTA_VERSION = 2
+ROW_COLUMNS = ("producto", "plaza", "fecha", "precio", "precioPromedioKg", "maximoKg", "minimoKg")
+# Columnas que, si difieren, hacen que un par se emita como cambiado (la fecha no cuenta)
+VALUE_COLUMNS = tuple(c for c in ROW_COLUMNS if c not in ("producto", "plaza", "fecha"))
+CHANGED_COLUMNS = ROW_COLUMNS + ("precioAnterior", "delta", "deltaPct")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def _precio(r: dict):
+    p = r.get("precio")
+    return p if p is not None else r.get("precioPromedioKg")
+
+
+def index_snapshot(records: Iterable[dict]) -> dict[tuple, dict]:
+    """(producto, plaza) -> fila; si el par se repite gana la fecha más reciente."""
+    index = {}
+    for r in records:
+        key = (r.get("producto"), r.get("plaza"))
+        prev = index.get(key)
+        if prev is None or (r.get("fecha") or "") >= (prev.get("fecha") or ""):
+            index[key] = r
+    return index
+
+
+def _week(index: dict[tuple, dict]) -> str | None:
+    fechas = [r["fecha"] for r in index.values() if r.get("fecha")]
+    return max(fechas)[:10] if fechas else None
+
+
+def diff_snapshots(previous: Iterable[dict], current: Iterable[dict]) -> dict:
+    """Delta de current respecto a previous (formato de cabecera + filas compactas)."""
+    anterior = index_snapshot(previous)
+    nuevo = index_snapshot(current)
+    inserted, changed = [], []
+    pendientes = dict(anterior)
+    for key, r in nuevo.items():
+        old = pendientes.pop(key, None)
+        if old is None:
+            inserted.append([r.get(c) for c in ROW_COLUMNS])
+            continue
+        if all(old.get(c) == r.get(c) for c in VALUE_COLUMNS):
+            continue
+        p_old, p_new = _precio(old), _precio(r)
+        delta = pct = None
+        if p_old is not None and p_new is not None:
+            delta = round(p_new - p_old, 4)
+            pct = round(delta / p_old * 100, 2) if p_old else None
+        changed.append([r.get(c) for c in ROW_COLUMNS] + [p_old, delta, pct])
+    removed = [list(key) for key in pendientes]
+    return {
+        "version": DELTA_VERSION,
+        "from": {"week": _week(anterior), "records": len(anterior)},
+        "to": {"week": _week(nuevo), "records": len(nuevo)},
+        "rowColumns": list(ROW_COLUMNS),
+        "changedColumns": list(CHANGED_COLUMNS),
+        "inserted": inserted,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def apply_delta(previous: Iterable[dict], delta: dict) -> dict[tuple, dict]:
+    """Aplica el delta al snapshot anterior; devuelve (producto, plaza) -> fila."""
+    index = index_snapshot(previous)
+    for producto, plaza in delta["removed"]:
+        index.pop((producto, plaza), None)
+    for columnas, seccion in (("rowColumns", "inserted"), ("changedColumns", "changed")):
+        for values in delta[seccion]:
+            r = dict(zip(delta[columnas], values))
+            index[(r["producto"], r["plaza"])] = {c: r.get(c) for c in delta["rowColumns"]}
+    return index
+
+
+def latest_dumps(dump_glob: str = DUMP_GLOB) -> list[str]:
+    """Volcados semanales de out/, del más antiguo al más reciente (el nombre lleva la fecha)."""
+    paths = [p for p in glob.glob(dump_glob) if ".tmp" not in os.path.basename(p)]
+    return sorted(paths, key=lambda p: (os.path.basename(p).split(".", 1)[0], p))
+
+
+def read_snapshot(path: str) -> dict:
+    """Volcado indexado por par con su nombre y sha256; sirve para leerlo antes de que un volcado nuevo lo reemplace."""
+    return {"file": os.path.basename(path), "sha256": file_sha256(path), "index": index_snapshot(iter_records(path))}
+
+
+def write_delta(previous: str | dict, current: Iterable[dict], out_path: str | None = None,
+                current_path: str | None = None) -> tuple[str, dict]:
+    """Calcula el delta contra el volcado previous (ruta o read_snapshot) y lo escribe; devuelve (ruta, delta)."""
+    if isinstance(previous, str):
+        previous = read_snapshot(previous)
+    delta = diff_snapshots(previous["index"].values(), current)
+    delta["from"].update(file=previous["file"], sha256=previous["sha256"])
+    if current_path is not None:
+        delta["to"].update(file=os.path.basename(current_path), sha256=file_sha256(current_path))
+    if out_path is None:
+        out_path = os.path.join(OUT_DIR, f"sipsa_delta_{delta['from']['week']}_{delta['to']['week']}.json")
+    write_atomic(out_path, json.dumps(delta, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return out_path, delta
+
+
+def summary(delta: dict) -> str:
+    return (
+        f"{len(delta['inserted'])} nuevos, {len(delta['removed'])} eliminados, "
+        f"{len(delta['changed'])} con cambios ({delta['from']['records']} -> {delta['to']['records']} pares)"
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Delta entre dos snapshots semanales SIPSA")
+    parser.add_argument("previous", nargs="?", help="Snapshot anterior (por defecto el penúltimo volcado de out/)")
+    parser.add_argument("current", nargs="?", help="Snapshot nuevo (por defecto el último volcado de out/)")
+    parser.add_argument("--out", help="Archivo del delta (por defecto out/sipsa_delta_<desde>_<hasta>.json)")
+    args = parser.parse_args(argv)
+
+    if bool(args.previous) != bool(args.current):
+        parser.error("indique ambos snapshots o ninguno")
+    if args.previous:
+        previous, current = args.previous, args.current
+    else:
+        dumps = latest_dumps()
+        if len(dumps) < 2:
+            logger.error("Se necesitan al menos dos volcados en %s", DUMP_GLOB)
+            return 1
+        previous, current = dumps[-2], dumps[-1]
+    logger.info("Delta %s -> %s", previous, current)
+
+    out_path, delta = write_delta(previous, iter_records(current), args.out, current_path=current)
+    print(f"Delta: {summary(delta)}")
+    print(f"Delta guardado: {out_path} ({os.path.getsize(out_path)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
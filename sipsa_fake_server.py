@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor SOAP local que imita SrvSipsaUpraBeanService para pruebas y benchmarks.
+
+Publica un WSDL con la forma del servicio DANE (WSDL en ?WSDL, esquema en ?xsd=1,
+endpoint /sipsaWS/SrvSipsaUpraBeanService) con las operaciones
+promediosSipsaSemanaMadr y promediosSipsaCiudad. Para cada operación responde:
+
+  - el envelope grabado <record-dir>/<operación>.xml, si existe, tal cual; o
+  - un envelope sintetizado desde un volcado semanal de out/, repetido --scale
+    veces (cada copia corre las fechas una semana hacia atrás, como un histórico).
+
+Si el cliente envía Accept-Encoding: gzip, el cuerpo viaja comprimido.
+
+Ejecución:
+  python sipsa_fake_server.py --port 8765 --scale 10
+  # WSDL: http://127.0.0.1:8765/sipsaWS/SrvSipsaUpraBeanService?WSDL
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+SERVICE_PATH = "/sipsaWS/SrvSipsaUpraBeanService"
+NAMESPACE = "http://servicios.sipsa.co.gov.dane/"
+DEFAULT_DUMP_GLOB = os.path.join("out", "sipsa_plaza_precio_semana_*.json")
+GZIP_LEVEL = 1  # nivel rápido, como un servidor que comprime al vuelo
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# Campos (nombre, tipo XSD) de cada elemento <return>, en el orden del servicio
+OPERATION_FIELDS = {
+    "promediosSipsaSemanaMadr": (
+        ("artiId", "xs:long"),
+        ("artiNombre", "xs:string"),
+        ("fechaIni", "xs:dateTime"),
+        ("fuenId", "xs:long"),
+        ("fuenNombre", "xs:string"),
+        ("futiId", "xs:long"),
+        ("maximoKg", "xs:double"),
+        ("minimoKg", "xs:double"),
+        ("promedioKg", "xs:double"),
+    ),
+    "promediosSipsaCiudad": (
+        ("ciudad", "xs:string"),
+        ("codProducto", "xs:long"),
+        ("fechaCaptura", "xs:dateTime"),
+        ("fechaCreacion", "xs:dateTime"),
+        ("precioPromedio", "xs:double"),
+        ("producto", "xs:string"),
+        ("regId", "xs:long"),
+    ),
+}
+
+_ENVELOPE_HEAD = (
+    '<?xml version="1.0" ?><S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<S:Body><ns2:{op}Response xmlns:ns2="' + NAMESPACE + '">'
+)
+_ENVELOPE_TAIL = "</ns2:{op}Response></S:Body></S:Envelope>"
+# Primer elemento dentro de <Body> del request: el nombre de la operación
+_BODY_OPERATION = re.compile(rb"<(?:[\w-]+:)?Body[^>]*>\s*<(?:[\w-]+:)?(\w+)")
+
+
+def build_xsd() -> str:
+    partes = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<xs:schema xmlns:tns="{NAMESPACE}" xmlns:xs="http://www.w3.org/2001/XMLSchema" version="1.0" targetNamespace="{NAMESPACE}">',
+    ]
+    for op, fields in OPERATION_FIELDS.items():
+        partes.append(f'<xs:element name="{op}" type="tns:{op}"/>')
+        partes.append(f'<xs:element name="{op}Response" type="tns:{op}Response"/>')
+        partes.append(f'<xs:complexType name="{op}"><xs:sequence/></xs:complexType>')
+        partes.append(
+            f'<xs:complexType name="{op}Response"><xs:sequence>'
+            f'<xs:element name="return" type="tns:{op}Item" minOccurs="0" maxOccurs="unbounded"/>'
+            "</xs:sequence></xs:complexType>"
+        )
+        campos = "".join(f'<xs:element name="{n}" type="{t}" minOccurs="0"/>' for n, t in fields)
+        partes.append(f'<xs:complexType name="{op}Item"><xs:sequence>{campos}</xs:sequence></xs:complexType>')
+    partes.append("</xs:schema>")
+    return "\n".join(partes)
+
+
+def build_wsdl(base_url: str) -> str:
+    ops = list(OPERATION_FIELDS)
+    messages = "".join(
+        f'<message name="{op}"><part name="parameters" element="tns:{op}"/></message>'
+        f'<message name="{op}Response"><part name="parameters" element="tns:{op}Response"/></message>'
+        for op in ops
+    )
+    port_ops = "".join(
+        f'<operation name="{op}"><input message="tns:{op}"/><output message="tns:{op}Response"/></operation>'
+        for op in ops
+    )
+    binding_ops = "".join(
+        f'<operation name="{op}"><soap:operation soapAction=""/>'
+        '<input><soap:body use="literal"/></input><output><soap:body use="literal"/></output></operation>'
+        for op in ops
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<definitions xmlns="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+        f'xmlns:tns="{NAMESPACE}" xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+        f'targetNamespace="{NAMESPACE}" name="SrvSipsaUpraBeanService">'
+        f'<types><xsd:schema><xsd:import namespace="{NAMESPACE}" schemaLocation="{base_url}{SERVICE_PATH}?xsd=1"/></xsd:schema></types>'
+        f"{messages}"
+        f'<portType name="SrvSipsaUpraBean">{port_ops}</portType>'
+        '<binding name="SrvSipsaUpraBeanPortBinding" type="tns:SrvSipsaUpraBean">'
+        '<soap:binding transport="http://schemas.xmlsoap.org/soap/http" style="document"/>'
+        f"{binding_ops}</binding>"
+        '<service name="SrvSipsaUpraBeanService"><port name="SrvSipsaUpraBeanPort" binding="tns:SrvSipsaUpraBeanPortBinding">'
+        f'<soap:address location="{base_url}{SERVICE_PATH}"/></port></service>'
+        "</definitions>"
+    )
+
+
+def _ciudad(plaza: str) -> str:
+    """Ciudad de un nombre de plaza SIPSA ("Medellín, Central Mayorista" -> "MEDELLÍN")."""
+    return re.split(r"[,(]", plaza, maxsplit=1)[0].strip().upper()
+
+
+def _valor(v) -> str:
+    return "" if v is None else escape(str(v))
+
+
+def synthesize_envelope(operation: str, records: list[dict], scale: int = 1) -> bytes:
+    """
+    Envelope SOAP de la operación a partir de registros de la salida semanal.
+
+    Cada una de las `scale` copias desplaza la fecha 7 días hacia atrás.
+    """
+    if operation not in OPERATION_FIELDS:
+        raise KeyError(operation)
+    art_ids: dict[str, int] = {}
+    fuen_ids: dict[str, int] = {}
+    partes = [_ENVELOPE_HEAD.format(op=operation)]
+    reg_id = 0
+    for copia in range(scale):
+        for r in records:
+            fecha = r.get("fecha")
+            if fecha and copia:
+                fecha = (datetime.fromisoformat(fecha) - timedelta(days=7 * copia)).isoformat()
+            producto, plaza = r.get("producto") or "", r.get("plaza") or ""
+            art_id = art_ids.setdefault(producto, len(art_ids) + 1)
+            reg_id += 1
+            if operation == "promediosSipsaSemanaMadr":
+                campos = {
+                    "artiId": art_id,
+                    "artiNombre": producto,
+                    "fechaIni": fecha,
+                    "fuenId": fuen_ids.setdefault(plaza, len(fuen_ids) + 1),
+                    "fuenNombre": plaza,
+                    "futiId": 1,
+                    "maximoKg": r.get("maximoKg"),
+                    "minimoKg": r.get("minimoKg"),
+                    "promedioKg": r.get("precioPromedioKg", r.get("precio")),
+                }
+            else:
+                campos = {
+                    "ciudad": _ciudad(plaza),
+                    "codProducto": art_id,
+                    "fechaCaptura": fecha,
+                    "fechaCreacion": fecha,
+                    "precioPromedio": r.get("precio"),
+                    "producto": producto,
+                    "regId": reg_id,
+                }
+            partes.append(
+                "<return>"
+                + "".join(f"<{k}>{_valor(v)}</{k}>" for k, v in campos.items() if v is not None)
+                + "</return>"
+            )
+    partes.append(_ENVELOPE_TAIL.format(op=operation))
+    return "".join(partes).encode("utf-8")
+
+
+def _default_dump() -> str | None:
+    dumps = sorted(glob.glob(DEFAULT_DUMP_GLOB))
+    return dumps[-1] if dumps else None
+
+
+class FakeSipsa:
+    """Respuestas por operación: grabadas (record_dir) o sintetizadas desde un volcado, generadas una vez."""
+
+    def __init__(self, dump_path: str | None = None, scale: int = 1, record_dir: str | None = None):
+        self.dump_path = dump_path or _default_dump()
+        self.scale = scale
+        self.record_dir = record_dir
+        self._records: list[dict] | None = None
+        self._bodies: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+
+    def body(self, operation: str) -> bytes:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if operation not in self._bodies:
+                self._bodies[operation] = self._load(operation)
+            return self._bodies[operation]
+
+    def _load(self, operation: str) -> bytes:
+        if self.record_dir:
+            path = os.path.join(self.record_dir, f"{operation}.xml")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read()
+        if self._records is None:
+            if not self.dump_path:
+                raise FileNotFoundError("No hay volcado en out/ para sintetizar respuestas")
+            with open(self.dump_path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+        return synthesize_envelope(operation, self._records, self.scale)
+
+
+def _make_handler(fake: FakeSipsa):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: bytes, content_type: str = "text/xml;charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path != SERVICE_PATH:
+                return self._send(404, b"not found", "text/plain")
+            base_url = f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+            if query.lower() == "wsdl":
+                return self._send(200, build_wsdl(base_url).encode("utf-8"))
+            if query == "xsd=1":
+                return self._send(200, build_xsd().encode("utf-8"))
+            return self._send(404, b"not found", "text/plain")
+
+        def do_POST(self):
+            payload = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            match = _BODY_OPERATION.search(payload)
+            operation = match.group(1).decode() if match else ""
+            try:
+                body = fake.body(operation)
+            except KeyError:
+                fault = (
+                    '<?xml version="1.0" ?><S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"><S:Body>'
+                    f"<S:Fault><faultcode>S:Client</faultcode><faultstring>Operación desconocida: {escape(operation)}</faultstring>"
+                    "</S:Fault></S:Body></S:Envelope>"
+                ).encode("utf-8")
+                return self._send(500, fault)
+            return self._send(200, body)
+
+        def log_message(self, fmt, *args):
+            logger.debug("fake-sipsa: " + fmt, *args)
+
+    return Handler
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> tuple[ThreadingHTTPServer, str]:
+    """Arranca el servidor en un hilo daemon; devuelve (server, URL del WSDL). kwargs van a FakeSipsa."""
+    fake = FakeSipsa(**kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    real_host, real_port = server.server_address[:2]
+    return server, f"http://{real_host}:{real_port}{SERVICE_PATH}?WSDL"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor SOAP local que imita SIPSA")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dump", help="Volcado semanal JSON de out/ (por defecto el más reciente)")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplicador de registros sintetizados")
+    parser.add_argument("--record-dir", help="Directorio con <operación>.xml grabados para reproducir tal cual")
+    args = parser.parse_args(argv)
+
+    fake = FakeSipsa(args.dump, args.scale, args.record_dir)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(fake))
+    server.daemon_threads = True
+    print(f"WSDL: http://{args.host}:{args.port}{SERVICE_PATH}?WSDL", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Histórico SIPSA semanal: almacén append-only particionado por semana.
+
+Cada semana publicada se guarda una sola vez en out/history/weeks/<fecha>.json.gz
+(columnas + filas, gzip determinista) y el manifest.json registra las semanas
+presentes con su número de registros y hash de contenido. Los registros se
+identifican por (producto, plaza, fecha), la misma clave con la que main()
+deduplica.
+
+Una sincronización cuyo contenido coincide con la anterior (mismo hash) termina
+sin escribir nada; si no, solo se escriben las semanas que aún no existen.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, Iterator
+
+from sipsa_util import write_atomic
+
+HISTORY_DIR = os.path.join("out", "history")
+HISTORY_VERSION = 1
+COLUMNS = ("producto", "plaza", "fecha", "precio", "precioPromedioKg", "maximoKg", "minimoKg")
+
+logger = logging.getLogger(__name__)
+
+
+def _week_key(fecha: str | None) -> str | None:
+    """Semana de un registro: la parte fecha (YYYY-MM-DD) de su fecha ISO."""
+    if not fecha:
+        return None
+    return str(fecha)[:10]
+
+
+def _canonical(rows: list[list]) -> bytes:
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _rows(records: Iterable[dict]) -> list[list]:
+    """Filas deduplicadas por (producto, plaza, fecha) y ordenadas para un hash estable."""
+    seen = set()
+    rows = []
+    for r in records:
+        key = (r.get("producto"), r.get("plaza"), r.get("fecha"))
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append([r.get(c) for c in COLUMNS])
+    rows.sort(key=lambda row: (row[2] or "", row[1] or "", row[0] or ""))
+    return rows
+
+
+def load_manifest(history_dir: str = HISTORY_DIR) -> dict:
+    """Manifest del histórico; vacío si aún no existe."""
+    path = os.path.join(history_dir, "manifest.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": HISTORY_VERSION, "last_sync_sha256": None, "weeks": {}}
+    if manifest.get("version") != HISTORY_VERSION:
+        raise ValueError(f"Versión de histórico no soportada: {manifest.get('version')}")
+    return manifest
+
+
+def sync_history(records: Iterable[dict], history_dir: str = HISTORY_DIR) -> dict:
+    """
+    Agrega al histórico las semanas de records que aún no estén guardadas.
+
+    Devuelve un resumen {"changed": bool, "weeks_added": [...], "weeks_skipped": [...]}.
+    """
+    rows = _rows(records)
+    digest = hashlib.sha256(_canonical(rows)).hexdigest()
+    manifest = load_manifest(history_dir)
+    if manifest.get("last_sync_sha256") == digest:
+        logger.info("Histórico sin cambios (hash %s); no se escribe nada", digest[:12])
+        return {"changed": False, "weeks_added": [], "weeks_skipped": []}
+
+    por_semana: dict[str, list[list]] = {}
+    for row in rows:
+        week = _week_key(row[2])
+        if week is not None:
+            por_semana.setdefault(week, []).append(row)
+
+    added, skipped = [], []
+    for week, week_rows in sorted(por_semana.items()):
+        week_sha = hashlib.sha256(_canonical(week_rows)).hexdigest()
+        existing = manifest["weeks"].get(week)
+        if existing is not None:
+            if existing["sha256"] != week_sha:
+                logger.warning("Semana %s ya guardada con otro contenido; se conserva la versión existente", week)
+            skipped.append(week)
+            continue
+        rel_path = f"weeks/{week}.json.gz"
+        payload = json.dumps({"week": week, "columns": list(COLUMNS), "rows": week_rows}, ensure_ascii=False, separators=(",", ":"))
+        write_atomic(os.path.join(history_dir, rel_path), gzip.compress(payload.encode("utf-8"), mtime=0))
+        manifest["weeks"][week] = {"file": rel_path, "records": len(week_rows), "sha256": week_sha}
+        added.append(week)
+
+    manifest["last_sync_sha256"] = digest
+    manifest["weeks"] = dict(sorted(manifest["weeks"].items()))
+    write_atomic(
+        os.path.join(history_dir, "manifest.json"),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"),
+    )
+    logger.info("Histórico: %s semanas nuevas, %s ya existentes", len(added), len(skipped))
+    return {"changed": True, "weeks_added": added, "weeks_skipped": skipped}
+
+
+def iter_history(history_dir: str = HISTORY_DIR, weeks: Iterable[str] | None = None) -> Iterator[dict]:
+    """Registros del histórico (mismas claves que la salida semanal), semana por semana en orden."""
+    manifest = load_manifest(history_dir)
+    wanted = set(weeks) if weeks is not None else None
+    for week, info in manifest["weeks"].items():
+        if wanted is not None and week not in wanted:
+            continue
+        with gzip.open(os.path.join(history_dir, info["file"]), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        columns = data["columns"]
+        for row in data["rows"]:
+            yield dict(zip(columns, row))
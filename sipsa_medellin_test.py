@@ -1,29 +1,47 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-MVP: Consulta WebService SIPSA (DANE) para Medellín.
+MVP: Consulta WebService SIPSA (DANE) para Medellín (u otras ciudades).
+
+Con --ciudad (repetible, o "all") la respuesta de promediosSipsaCiudad se reparte
+por ciudad en una sola pasada: cada registro cae en su balde con una búsqueda en
+dict por la clave normalizada de su ciudad (sipsa_registry), así que el costo es
+una consulta y un recorrido sin importar cuántas ciudades se pidan. Cada ciudad
+escribe su salida (ordenada por precio) en paralelo y, con más de una ciudad,
+un resumen conjunto en out/sipsa_ciudades_<fecha>.json.
 
 Instrucciones de ejecución:
   python -m venv .venv && source .venv/bin/activate   # Windows: .venv\Scripts\activate
   pip install -r requirements.txt
   python sipsa_medellin_test.py
+  python sipsa_medellin_test.py --format ndjson --gzip   # salida NDJSON comprimida
+  python sipsa_medellin_test.py --profile                 # cProfile/tracemalloc por etapa
+  python sipsa_medellin_test.py --input out/sipsa_medellin_20260207_1224.json   # sin conexión
+  python sipsa_medellin_test.py --ciudad Bogotá --ciudad Cali --ciudad Cúcuta
+  python sipsa_medellin_test.py --ciudad all
+
+Tiempos por etapa y contadores quedan en out/metrics/ (ver sipsa_metrics).
 """
 
+import argparse
 import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from decimal import Decimal
-from unicodedata import normalize as unicode_normalize
+from typing import TYPE_CHECKING
+
+from sipsa_metrics import METRICS_DIR, RunMetrics
+from sipsa_normalizer import RecordNormalizer, Registro
+from sipsa_output import FORMATS, iter_saved_records, output_path, write_records
+from sipsa_views import (
+    MEDELLIN_NORMALIZED, TODAS_LAS_CIUDADES, TOP_N, city_slug, latest_fecha_captura, partition_by_city, print_top,
+    top_por_precio,
+)
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from zeep import Client
-from zeep.exceptions import Fault as ZeepFault
-from zeep.helpers import serialize_object
-from zeep.transports import Transport
+if TYPE_CHECKING:
+    from zeep import Client
 
 # -----------------------------------------------------------------------------
 # Constantes
@@ -31,16 +49,11 @@ from zeep.transports import Transport
 # WSDL oficial DANE (documentación: servicio web para consulta de la base de datos de SIPSA)
 # Si falla, obtener URL en: https://www.dane.gov.co/index.php/estadisticas-por-tema/agropecuario/sistema-de-informacion-de-precios-sipsa/servicio-web-para-consulta-de-la-base-de-datos-de-sipsa
 WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
-# Fallback HTTP por si HTTPS no está disponible
-WSDL_URL_HTTP = "http://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
 
 OPERATION_CANDIDATE = "promediosSipsaCiudad"
-CONNECT_TIMEOUT = 10
 READ_TIMEOUT = 30
-MAX_RETRIES = 3
-BACKOFF_FACTOR = 0.5
 OUT_DIR = "out"
-MEDELLIN_NORMALIZED = "medellin"  # comparación sin acento y case-insensitive
+MAX_WRITERS = 8
 
 # -----------------------------------------------------------------------------
 # Logging
@@ -53,122 +66,38 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def _normalize_ciudad(s: str) -> str:
-    """Normaliza string para comparación case-insensitive y sin acentos."""
-    if s is None:
-        return ""
-    s = str(s).strip()
-    # NFD y quitar marcas de combinación para comparar sin acentos
-    nfd = unicode_normalize("NFD", s)
-    ascii_only = "".join(c for c in nfd if ord(c) < 0x80 or not (0x0300 <= ord(c) <= 0x036F))
-    return ascii_only.lower()
-
-
-def _is_medellin(ciudad_value) -> bool:
-    """True si el valor del campo ciudad corresponde a Medellín (case-insensitive, con/sin acento)."""
-    return _normalize_ciudad(ciudad_value) == MEDELLIN_NORMALIZED
-
-
-def _get_ciudad_key(record: dict) -> str | None:
-    """Obtiene el valor del campo ciudad del registro (prueba varias claves)."""
-    for key in ("ciudad", "Ciudad", "CIUDAD"):
-        if key in record and record[key] is not None:
-            return record[key]
-    return None
-
-
-def _safe_float(value, default=None):
-    """Convierte a float; si falla devuelve default."""
-    if value is None:
-        return default
-    try:
-        if isinstance(value, (int, float)):
-            return float(value)
-        s = str(value).strip().replace(",", ".")
-        return float(s) if s else default
-    except (ValueError, TypeError):
-        return default
-
-
-def _parse_fecha_captura(value) -> str | None:
-    """Devuelve el valor como string para comparación; si es datetime, ISO string."""
-    if value is None:
-        return None
-    if hasattr(value, "isoformat"):
-        return value.isoformat()
-    return str(value).strip() or None
-
-
-def _json_serializable(obj):
-    """Convierte recursivamente obj a tipos serializables por json (Decimal -> float, datetime -> str)."""
-    if obj is None:
-        return None
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if hasattr(obj, "isoformat") and hasattr(obj, "year"):
-        return obj.isoformat()
-    if isinstance(obj, dict):
-        return {k: _json_serializable(v) for k, v in obj.items()}
-    if isinstance(obj, (list, tuple)):
-        return [_json_serializable(v) for v in obj]
-    return obj
-
-
-def _build_session():
-    """Session con timeouts y retries (incluye POST para SOAP)."""
-    session = requests.Session()
-    retry = Retry(
-        total=MAX_RETRIES,
-        connect=MAX_RETRIES,
-        backoff_factor=BACKOFF_FACTOR,
-        status_forcelist=(500, 502, 503, 504),
-        allowed_methods=frozenset(["GET", "HEAD", "POST", "OPTIONS"]),  # POST para SOAP
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-
 def _get_client(wsdl_url: str):
-    """Cliente Zeep con transport (timeout connect=10s, operation=30s). Servicio DANE documentado como SOAP 1.2; binding se toma del WSDL."""
-    session = _build_session()
-    transport = Transport(
-        session=session,
-        timeout=CONNECT_TIMEOUT,
-        operation_timeout=READ_TIMEOUT,
-    )
-    return Client(wsdl=wsdl_url, transport=transport)
+    """Cliente Zeep con transport (timeout connect=10s, operation=30s) y WSDL/XSD cacheados en disco. Servicio DANE documentado como SOAP 1.2; binding se toma del WSDL."""
+    from sipsa_client import get_client
+
+    return get_client(wsdl_url, operation_timeout=READ_TIMEOUT)
 
 
-def _resolve_operation_name(client: Client) -> str:
+def _resolve_operation_name(client: "Client") -> str:
     """Encuentra el nombre real de la operación promediosSipsaCiudad (o el más cercano)."""
-    binding = client.service._binding
-    ops = list(binding._operations.keys())
-    target = OPERATION_CANDIDATE.lower()
-    for name in ops:
-        if name.lower() == target:
-            return name
-    for name in ops:
-        if "promedios" in name.lower() and "ciudad" in name.lower():
-            return name
-    if ops:
-        logger.warning("Operación '%s' no encontrada; operaciones disponibles: %s", OPERATION_CANDIDATE, ops)
+    from sipsa_client import operation_catalog, resolve_operation
+
+    catalog = operation_catalog(client)
+    name = resolve_operation(catalog, OPERATION_CANDIDATE, keywords=("promedios", "ciudad"))
+    if name:
+        return name
+    if catalog["operations"]:
+        logger.warning("Operación '%s' no encontrada; operaciones disponibles: %s", OPERATION_CANDIDATE, catalog["operations"])
     return OPERATION_CANDIDATE
 
 
-def _list_services_and_operations(client: Client) -> None:
-    """Imprime servicios y operaciones del WSDL."""
-    logger.info("WSDL cargado. Servicios: %s", client.wsdl.services)
-    for svc in client.wsdl.services.values():
-        for port in svc.ports.values():
-            binding = port.binding
-            if binding:
-                ops = list(binding._operations.keys())
-                logger.info("Port %s -> operaciones: %s", port.name, ops)
+def _list_services_and_operations(client: "Client") -> None:
+    """Imprime servicios y operaciones del WSDL (desde el catálogo cacheado)."""
+    from sipsa_client import operation_catalog
 
+    catalog = operation_catalog(client)
+    logger.info("WSDL cargado. Servicios: %s", list(catalog["services"]))
+    for ports in catalog["services"].values():
+        for port_name, ops in ports.items():
+            logger.info("Port %s -> operaciones: %s", port_name, ops)
 
-def _print_operation_signature(client: Client, operation_name: str) -> None:
+
+def _print_operation_signature(client: "Client", operation_name: str) -> None:
     """Imprime la firma (signature) del método si existe."""
     try:
         binding = client.service._binding
@@ -181,151 +110,188 @@ def _print_operation_signature(client: Client, operation_name: str) -> None:
         logger.warning("No se pudo obtener firma de '%s': %s", operation_name, e)
 
 
-def _normalize_records(raw_response) -> list[dict]:
-    """Convierte la respuesta Zeep a lista de dicts serializables."""
-    if raw_response is None:
-        return []
-    records = []
-    try:
-        iterable = list(raw_response) if not isinstance(raw_response, list) else raw_response
-    except TypeError:
-        iterable = [raw_response]
-    for item in iterable:
-        try:
-            records.append(serialize_object(item))
-        except Exception:
-            if hasattr(item, "__dict__"):
-                records.append(dict(item))
-            else:
-                records.append({"raw": str(item)})
-    return records
-
-
-def _filter_medellin(records: list[dict]) -> list[dict]:
-    """Filtra registros donde ciudad sea Medellín (case-insensitive, con/sin acento)."""
-    out = []
-    for r in records:
-        if not isinstance(r, dict):
-            continue
-        ciudad = _get_ciudad_key(r)
-        if _is_medellin(ciudad):
-            out.append(r)
-    return out
-
-
-def _sort_by_precio(records: list[dict], key_precio: str = "precioPromedio") -> list[dict]:
-    """Ordena por precioPromedio ascendente; valores no numéricos al final."""
-    def sort_key(r):
-        v = r.get(key_precio) or r.get("precioPromedio") or r.get("PrecioPromedio")
-        f = _safe_float(v)
-        if f is None:
-            return (1, 0.0)  # al final
-        return (0, f)
-
-    return sorted(records, key=sort_key)
-
-
-def _latest_fecha_captura(records: list[dict]) -> str | None:
-    """Obtiene la fechaCaptura más reciente (como string)."""
-    fechas = []
-    for r in records:
-        v = r.get("fechaCaptura") or r.get("FechaCaptura") or r.get("FECHACAPTURA")
-        s = _parse_fecha_captura(v)
-        if s:
-            fechas.append(s)
-    return max(fechas) if fechas else None
-
-
-def main() -> int:
+def _process_city(clave: str, registros: list[Registro], args: argparse.Namespace, timestamp: str) -> dict:
+    """
+    Ranking y salida de una ciudad; devuelve su resumen.
+
+    Sin --ciudad (solo Medellín) la salida conserva el orden de la respuesta y se
+    escribe aunque quede vacía, como siempre. Con --ciudad va ordenada por precio
+    y las ciudades sin registros no generan archivo.
+    """
+    baratos, caros = top_por_precio(registros)
+    por_ciudad = args.ciudad is not None
+    salida = sorted(registros, key=lambda r: (r.precio is None, r.precio or 0.0)) if por_ciudad else registros
+    out_path = n = None
+    if registros or not por_ciudad:
+        out_path = output_path(OUT_DIR, f"sipsa_{city_slug(clave)}_{timestamp}", args.format, args.gzip)
+        n = write_records((r.raw for r in salida), out_path, args.format)
+    return {
+        "ciudad": next((r.ciudad for r in registros if r.ciudad), clave),
+        "clave": clave,
+        "total": n or 0,
+        "fechaCaptura": latest_fecha_captura(registros),
+        "baratos": [{"producto": r.producto, "precio": r.precio} for r in baratos],
+        "caros": [{"producto": r.producto, "precio": r.precio} for r in caros],
+        "archivo": out_path,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="SIPSA Medellín: precios promedio por producto")
+    parser.add_argument("--format", choices=FORMATS, default="json", help="JSON compacto o NDJSON (un registro por línea)")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida con gzip")
+    parser.add_argument(
+        "--ciudad",
+        action="append",
+        help=f"Ciudad a extraer (repetible) o '{TODAS_LAS_CIUDADES}'; por defecto Medellín. Con --ciudad la salida va ordenada por precio",
+    )
+    parser.add_argument(
+        "--input",
+        help="Reprocesar sin conexión un volcado de out/ (.json/.ndjson[.gz]) o un payload SOAP guardado (.xml[.gz])",
+    )
+    parser.add_argument("--metrics-dir", default=METRICS_DIR, help="Directorio del reporte de métricas por etapa")
+    parser.add_argument("--profile", action="store_true", help="cProfile y tracemalloc por etapa (más lento)")
+    args = parser.parse_args(argv)
+
+    metrics = RunMetrics("medellin", args.metrics_dir, profile=args.profile)
+    code = _run(args, metrics)
+    report_path = metrics.write(success=code == 0)
+    logger.info("Etapas: %s", metrics.summary())
+    logger.info("Métricas guardadas: %s", report_path)
+    return code
+
+
+def _fetch_records(metrics: RunMetrics) -> list[dict] | None:
+    """Consulta el servicio y devuelve los registros como list[dict]; None si falla."""
+    import requests
+    from zeep.exceptions import Fault as ZeepFault
+
+    from sipsa_client import serialize_response, service_address, session_stats
+
     logger.info("Inicio MVP SIPSA Medellín. WSDL: %s", WSDL_URL)
 
-    # Resolver WSDL: intentar HTTPS primero, luego HTTP
-    wsdl_to_use = WSDL_URL
-    try:
-        client = _get_client(wsdl_to_use)
-    except Exception as e:
-        logger.warning("Falló HTTPS (%s). Intentando HTTP...", e)
-        wsdl_to_use = WSDL_URL_HTTP
+    # Si HTTPS no conecta, el transport pasa a HTTP conservando cliente y sesión
+    with metrics.stage("wsdl"):
         try:
-            client = _get_client(wsdl_to_use)
-        except Exception as e2:
+            client = _get_client(WSDL_URL)
+        except Exception as e:
             logger.error(
                 "No se pudo conectar al WSDL. Verifique red y URL. "
                 "Obtener WSDL en: https://www.dane.gov.co/index.php/estadisticas-por-tema/agropecuario/sistema-de-informacion-de-precios-sipsa/servicio-web-para-consulta-de-la-base-de-datos-de-sipsa "
                 "La dirección del WSDL es: http://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
             )
-            logger.error("Error: %s", e2)
-            return 1
+            logger.error("Error: %s", e)
+            return None
 
-    logger.info("Cliente Zeep creado con WSDL: %s", wsdl_to_use)
+        logger.info("Cliente Zeep creado con WSDL: %s (servicio: %s)", WSDL_URL, service_address(client))
 
-    # Introspección
-    _list_services_and_operations(client)
-    operation_name = _resolve_operation_name(client)
-    _print_operation_signature(client, operation_name)
+        # Introspección
+        _list_services_and_operations(client)
+        operation_name = _resolve_operation_name(client)
+        _print_operation_signature(client, operation_name)
 
     # Llamada al servicio
     try:
         logger.info("Llamando a %s()...", operation_name)
         method = getattr(client.service, operation_name)
-        raw_response = method()
+        with metrics.stage("call"):
+            raw_response = method()
     except ZeepFault as e:
         logger.error("SOAPFault del servicio: %s", e.message)
         logger.error("Código: %s. Detalle: %s", getattr(e, "code", ""), getattr(e, "detail", ""))
-        return 1
+        return None
     except (requests.RequestException, requests.Timeout) as e:
         logger.error("Error de conexión o timeout: %s. Verifique URL y red.", e)
-        return 1
+        return None
     except Exception as e:
         logger.exception("Error inesperado al llamar al servicio: %s", e)
-        return 1
+        return None
+    finally:
+        stats = session_stats(client.transport.session)
+        for name, n in stats.as_dict().items():
+            metrics.set(f"http_{name}", n)
+        logger.info("Red: %s", stats.summary())
 
     # Normalizar respuesta a list[dict]
-    all_records = _normalize_records(raw_response)
-    logger.info("Total registros recibidos (todas las ciudades): %s", len(all_records))
+    with metrics.stage("serialize"):
+        return serialize_response(raw_response)
 
-    # Filtrar por Medellín
-    medellin_records = _filter_medellin(all_records)
-    logger.info("Registros filtrados para Medellín: %s", len(medellin_records))
 
-    # Ordenar por precio
-    sorted_by_precio = _sort_by_precio(medellin_records)
-    top_20_baratos = sorted_by_precio[:20]
-    top_20_caros = sorted_by_precio[-20:][::-1]
+def _run(args: argparse.Namespace, metrics: RunMetrics) -> int:
+    if args.input:
+        logger.info("Inicio MVP SIPSA Medellín. Sin conexión: %s", args.input)
+        try:
+            with metrics.stage("load"):
+                all_records = list(iter_saved_records(args.input, OPERATION_CANDIDATE))
+        except Exception as e:  # archivo ausente, JSON o XML inválido
+            logger.error("No se pudo leer %s: %s", args.input, e)
+            return 1
+    else:
+        all_records = _fetch_records(metrics)
+        if all_records is None:
+            return 1
+    logger.info("Total registros recibidos (todas las ciudades): %s", len(all_records))
 
-    # Fecha más reciente
-    latest_fecha = _latest_fecha_captura(medellin_records)
+    ciudades = args.ciudad or [MEDELLIN_NORMALIZED]
+    pedidas = None if TODAS_LAS_CIUDADES in ciudades else ciudades
+
+    # Repartir por ciudad en una pasada
+    normalizer = RecordNormalizer()
+    with metrics.stage("normalize_filter"):
+        por_ciudad = partition_by_city(normalizer.iter_normalized(all_records, keep_raw=True), pedidas)
+    en_ciudades = sum(len(b) for b in por_ciudad.values())
+    logger.info("Registros en %s ciudades: %s", len(por_ciudad), en_ciudades)
+    for clave, balde in por_ciudad.items():
+        if not balde:
+            logger.warning("Sin registros para la ciudad '%s'", clave)
+    metrics.set("received", len(all_records))
+    metrics.set("in_window", en_ciudades)
+    metrics.set("cities", len(por_ciudad))
+    for campo, n in normalizer.parse_failures.items():
+        metrics.set(f"parse_failures_{campo}", n)
+
+    # Ranking y salida de cada ciudad en paralelo (Decimal y fechas se convierten al escribir)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    with metrics.stage("rank_write"), ThreadPoolExecutor(max_workers=min(MAX_WRITERS, len(por_ciudad) or 1)) as pool:
+        futures = [pool.submit(_process_city, c, b, args, timestamp) for c, b in por_ciudad.items()]
+        resumenes = [f.result() for f in futures]
+    metrics.set("written", sum(r["total"] for r in resumenes))
 
     # Salida consola
-    print()
-    print("=== SIPSA Medellín ===")
-    print(f"Total registros para Medellín: {len(medellin_records)}")
-    print()
-    print("Top 20 productos más baratos (precioPromedio):")
-    for i, r in enumerate(top_20_baratos, 1):
-        precio = r.get("precioPromedio") or r.get("PrecioPromedio") or r.get("precio_promedio", "N/A")
-        producto = r.get("producto") or r.get("Producto") or r.get("producto", "N/A")
-        print(f"  {i:2}. {producto}: {precio}")
-    print()
-    print("Top 20 productos más caros (precioPromedio):")
-    for i, r in enumerate(top_20_caros, 1):
-        precio = r.get("precioPromedio") or r.get("PrecioPromedio") or r.get("precio_promedio", "N/A")
-        producto = r.get("producto") or r.get("Producto") or r.get("producto", "N/A")
-        print(f"  {i:2}. {producto}: {precio}")
-    print()
-    print(f"fechaCaptura más reciente: {latest_fecha or 'N/A'}")
-    print()
+    if len(resumenes) == 1:
+        r = resumenes[0]
+        nombre = "Medellín" if r["clave"] == MEDELLIN_NORMALIZED else r["ciudad"]
+        print()
+        print(f"=== SIPSA {nombre} ===")
+        print(f"Total registros para {nombre}: {r['total']}")
+        print()
+        print_top(f"Top {TOP_N} productos más baratos (precioPromedio):", r["baratos"])
+        print_top(f"Top {TOP_N} productos más caros (precioPromedio):", r["caros"])
+        print(f"fechaCaptura más reciente: {r['fechaCaptura'] or 'N/A'}")
+        print()
+        if r["archivo"] is None:
+            return 1
+        logger.info("JSON guardado en: %s", r["archivo"])
+        print(f"JSON guardado en: {r['archivo']}")
+        return 0
 
-    # Crear out/ y guardar JSON
+    print()
+    print(f"=== SIPSA por ciudad ({len(resumenes)} ciudades, {en_ciudades} registros) ===")
+    for r in sorted(resumenes, key=lambda r: -r["total"]):
+        barato = r["baratos"][0] if r["baratos"] else None
+        caro = r["caros"][0] if r["caros"] else None
+        print(
+            f"  {r['ciudad']}: {r['total']} registros, fechaCaptura {r['fechaCaptura'] or 'N/A'}"
+            + (f", más barato {barato['producto']} ({barato['precio']})" if barato else "")
+            + (f", más caro {caro['producto']} ({caro['precio']})" if caro else "")
+        )
+    resumen_path = os.path.join(OUT_DIR, f"sipsa_ciudades_{timestamp}.json")
     os.makedirs(OUT_DIR, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-    out_path = os.path.join(OUT_DIR, f"sipsa_medellin_{timestamp}.json")
-    serializable = _json_serializable(medellin_records)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, ensure_ascii=False, indent=2)
-    logger.info("JSON guardado en: %s", out_path)
-    print(f"JSON guardado en: {out_path}")
-
+    with open(resumen_path, "w", encoding="utf-8") as f:
+        json.dump(resumenes, f, ensure_ascii=False, indent=2)
+    print()
+    logger.info("Resumen guardado en: %s", resumen_path)
+    print(f"Salidas por ciudad en {OUT_DIR}/sipsa_<ciudad>_{timestamp}.*; resumen: {resumen_path}")
     return 0
 
 
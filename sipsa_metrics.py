@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentación liviana por etapa para los scripts SIPSA.
+
+Cada etapa (carga del WSDL, llamada, serialización, normalización, ventana,
+dedup, volcado...) registra tiempo de pared, tiempo de CPU del hilo que la
+ejecuta (time.thread_time, para que etapas en paralelo no se sumen entre sí; el
+total de la corrida sí es de todo el proceso) y el pico de RSS del proceso al
+terminar; los contadores (recibidos, en ventana, deduplicados, fallos
+de parseo) se suman aparte. Al final de la corrida se escribe:
+
+  out/metrics/<script>_<timestamp>.json   reporte completo de la corrida
+  out/metrics/<script>.prom               textfile para el collector de node_exporter
+
+Con profile=True (flag --profile de los scripts) cada etapa además corre bajo
+cProfile y tracemalloc: se guardan <etapa>.prof (abrible con pstats/snakeviz) y
+<etapa>.tracemalloc.txt con las líneas que más memoria asignaron, y el reporte
+incluye el pico de memoria Python de la etapa.
+"""
+
+import cProfile
+import json
+import os
+import platform
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sipsa_util import write_atomic
+
+METRICS_DIR = os.path.join("out", "metrics")
+METRICS_PREFIX = "sipsa"
+TRACEMALLOC_TOP = 25
+# Contadores que no son de registros: prefijo -> (métrica propia en el .prom, etiqueta, ayuda).
+# El resto va a <prefijo>_records{counter=...}.
+COUNTER_FAMILIES = {
+    "http_": ("http", "counter", "Contadores del transporte HTTP (peticiones, bytes, fallbacks)."),
+    "stages_": ("pipeline_stages", "status", "Etapas del pipeline por resultado (hit, run, source)."),
+    "cache_": ("cache", "counter", "Contadores de caché (aciertos, desalojos)."),
+}
+
+
+def peak_rss_mb() -> float:
+    """Pico de RSS del proceso en MB (ru_maxrss viene en KB en Linux y en bytes en macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Etapas y contadores de una corrida de un script."""
+
+    def __init__(self, script: str, metrics_dir: str = METRICS_DIR, profile: bool = False):
+        self.script = script
+        self.metrics_dir = metrics_dir
+        self.profile = profile
+        self.started_at = datetime.now(timezone.utc)
+        self.stages: dict[str, dict] = {}
+        self.counters: dict[str, int] = {}
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        stamp = self.started_at.strftime("%Y%m%d_%H%M%S")
+        self.profile_dir = os.path.join(metrics_dir, f"{script}_{stamp}_profile") if profile else None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mide el bloque como etapa name; si la etapa se repite, los tiempos se acumulan."""
+        profiler = None
+        if self.profile:
+            tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        t0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - t0, time.thread_time() - cpu0
+            st = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+            st["wall_seconds"] += wall
+            st["cpu_seconds"] += cpu
+            st["calls"] += 1
+            st["peak_rss_mb"] = round(peak_rss_mb(), 1)
+            if profiler is not None:
+                profiler.disable()
+                st["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self._dump_profile(name, profiler, snapshot)
+
+    def _dump_profile(self, name: str, profiler: cProfile.Profile, snapshot) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        lines = [str(s) for s in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]]
+        with open(os.path.join(self.profile_dir, f"{name}.tracemalloc.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, n: int) -> None:
+        self.counters[name] = n
+
+    def report(self, success: bool = True) -> dict:
+        return {
+            "script": self.script,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "success": success,
+            "wall_seconds": round(time.perf_counter() - self._t0, 6),
+            "cpu_seconds": round(time.process_time() - self._cpu0, 6),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": {
+                n: {**st, "wall_seconds": round(st["wall_seconds"], 6), "cpu_seconds": round(st["cpu_seconds"], 6)}
+                for n, st in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "profile_dir": self.profile_dir,
+        }
+
+    def prometheus(self, report: dict) -> str:
+        """Formato de exposición de texto de Prometheus (gauges con etiquetas script/stage/counter/status)."""
+        p, script = METRICS_PREFIX, _label(self.script)
+        lines = []
+
+        def gauge(metric: str, help_text: str, samples: list[tuple[str, float]]) -> None:
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} gauge")
+            for labels, value in samples:
+                lines.append(f'{p}_{metric}{{script="{script}"{labels}}} {value}')
+
+        stages = report["stages"].items()
+        gauge("stage_wall_seconds", "Tiempo de pared por etapa.",
+              [(f',stage="{_label(n)}"', st["wall_seconds"]) for n, st in stages])
+        gauge("stage_cpu_seconds", "Tiempo de CPU por etapa.",
+              [(f',stage="{_label(n)}"', st["cpu_seconds"]) for n, st in stages])
+        gauge("stage_peak_rss_bytes", "Pico de RSS del proceso al terminar la etapa.",
+              [(f',stage="{_label(n)}"', int(st["peak_rss_mb"] * 1024 * 1024)) for n, st in stages])
+        records, familias = [], {prefijo: [] for prefijo in COUNTER_FAMILIES}
+        for n, v in report["counters"].items():
+            prefijo = next((f for f in COUNTER_FAMILIES if n.startswith(f)), None)
+            if prefijo is None:
+                records.append((f',counter="{_label(n)}"', v))
+            else:
+                familias[prefijo].append((f',{COUNTER_FAMILIES[prefijo][1]}="{_label(n[len(prefijo):])}"', v))
+        gauge("records", "Contadores de registros de la corrida.", records)
+        for prefijo, samples in familias.items():
+            if samples:
+                metric, _, help_text = COUNTER_FAMILIES[prefijo]
+                gauge(metric, help_text, samples)
+        gauge("run_wall_seconds", "Duración total de la corrida.", [("", report["wall_seconds"])])
+        gauge("run_success", "1 si la corrida terminó bien.", [("", int(report["success"]))])
+        gauge("run_timestamp_seconds", "Inicio de la corrida (epoch).", [("", int(self.started_at.timestamp()))])
+        return "\n".join(lines) + "\n"
+
+    def write(self, success: bool = True) -> str:
+        """Escribe el reporte JSON y el textfile .prom; devuelve la ruta del JSON."""
+        report = self.report(success)
+        stamp = self.started_at.strftime("%Y%m%d_%H%M%S")
+        json_path = os.path.join(self.metrics_dir, f"{self.script}_{stamp}.json")
+        write_atomic(json_path, json.dumps(report, ensure_ascii=False, indent=2))
+        write_atomic(os.path.join(self.metrics_dir, f"{self.script}.prom"), self.prometheus(report))
+        return json_path
+
+    def summary(self) -> str:
+        """Una línea por etapa para el log."""
+        return "; ".join(
+            f"{n} {st['wall_seconds']:.3f}s (cpu {st['cpu_seconds']:.3f}s)" for n, st in self.stages.items()
+        )
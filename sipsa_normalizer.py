@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Normalizador de registros SIPSA compartido por los scripts de consulta.
+
+Las operaciones SIPSA nombran distinto los mismos campos (fuenNombre/plaza,
+artiNombre/producto, promedioKg/precioPromedio, fechaIni/fechaCaptura...). En vez
+de probar claves candidatas en cada registro, el mapeo se resuelve una vez por
+esquema de respuesta (conjunto de claves) y las fechas se parsean una sola vez
+por valor distinto con un parser memoizado. Cada registro sale en una pasada
+como un Registro tipado, etiquetado con el mercado del PRD y la categoría del
+producto según sipsa_registry.
+"""
+
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple
+
+from sipsa_registry import EntityRegistry, registry as default_registry
+
+# Claves candidatas por campo, en orden de preferencia
+FIELD_CANDIDATES = {
+    "plaza": ("fuenNombre", "fuenNombre_", "plaza", "Plaza", "fuente"),
+    "producto": ("artiNombre", "producto", "Producto", "artiNombre_"),
+    "precio": ("precioPromedio", "precio_promedio", "promedioKg", "promedio_kg", "PrecioPromedio", "precio", "precioPromedioKg"),
+    "fecha": ("fechaIni", "enmaFecha", "fechaCaptura", "FechaCaptura", "FECHACAPTURA", "fechaCreacion", "fecha"),
+    "ciudad": ("ciudad", "Ciudad", "CIUDAD"),
+    # Respuesta SOAP o volcado de la salida semanal (precioPromedioKg)
+    "promedioKg": ("promedioKg", "precioPromedioKg"),
+}
+_FECHA_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d", "%d/%m/%Y")
+
+
+class Registro(NamedTuple):
+    """Registro SIPSA normalizado. Los campos *Kg conservan el valor original del servicio."""
+
+    producto: str
+    plaza: str
+    ciudad: str | None
+    precio: float | None
+    fecha: datetime | None
+    fecha_iso: str | None
+    promedioKg: object
+    maximoKg: object
+    minimoKg: object
+    raw: dict | None
+    market: str | None = None  # Market.id del PRD
+    category: str | None = None  # FRU/GRN/TUB/VER
+
+
+def _parse_fecha_uncached(value) -> datetime | None:
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    s = str(value).strip()
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    part = s[:19] if "T" in s else s[:10]
+    for fmt in _FECHA_FORMATS:
+        try:
+            return datetime.strptime(part, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _parse_fecha_cached(value) -> tuple[datetime | None, str | None]:
+    dt = _parse_fecha_uncached(value)
+    if dt is None:
+        return None, (str(value) if value else None)
+    iso = dt.isoformat()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt, iso
+
+
+def parse_fecha(value) -> tuple[datetime | None, str | None]:
+    """
+    (datetime con zona horaria, texto ISO) de un valor de fecha SIPSA; memoizado por valor.
+
+    Sin zona horaria se asume UTC. Si no se puede interpretar, datetime es None y el
+    texto es el valor original.
+    """
+    if value is None:
+        return None, None
+    try:
+        return _parse_fecha_cached(value)
+    except TypeError:  # valor no hashable
+        return _parse_fecha_cached.__wrapped__(value)
+
+
+def _to_float(value) -> float | None:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        s = str(value).strip().replace(",", ".")
+        return float(s) if s else None
+    except (ValueError, TypeError):
+        return None
+
+
+class _Schema(NamedTuple):
+    plaza: tuple[str, ...]
+    producto: tuple[str, ...]
+    precio: tuple[str, ...]
+    fecha: str | None
+    ciudad: tuple[str, ...]
+    promedio_kg: str | None
+
+
+def _first_value(record: dict, keys: tuple[str, ...]):
+    for k in keys:
+        v = record[k]
+        if v is not None:
+            return v
+    return None
+
+
+class RecordNormalizer:
+    """Normaliza registros resolviendo las claves de cada campo una vez por esquema."""
+
+    def __init__(self, registry: EntityRegistry | None = None):
+        self._schemas: dict[tuple, _Schema] = {}
+        self.registry = registry or default_registry
+        # Valores presentes que no se pudieron interpretar, y elementos que no son dict
+        self.parse_failures = {"fecha": 0, "precio": 0, "no_dict": 0}
+
+    def _schema(self, record: dict) -> _Schema:
+        keys = tuple(record)
+        schema = self._schemas.get(keys)
+        if schema is None:
+            presentes = set(keys)
+
+            def cands(field):
+                return tuple(k for k in FIELD_CANDIDATES[field] if k in presentes)
+
+            fechas = cands("fecha")
+            promedio_kg = cands("promedioKg")
+            schema = _Schema(
+                plaza=cands("plaza"),
+                producto=cands("producto"),
+                precio=cands("precio"),
+                fecha=fechas[0] if fechas else None,
+                ciudad=cands("ciudad"),
+                promedio_kg=promedio_kg[0] if promedio_kg else None,
+            )
+            self._schemas[keys] = schema
+        return schema
+
+    def normalize(self, record: dict, keep_raw: bool = False) -> Registro:
+        s = self._schema(record)
+        plaza = _first_value(record, s.plaza)
+        producto = _first_value(record, s.producto)
+        precio = None
+        precio_presente = False
+        for k in s.precio:
+            v = record[k]
+            if v is not None:
+                precio_presente = True
+                precio = _to_float(v)
+                if precio is not None:
+                    break
+        if precio is None and precio_presente:
+            self.parse_failures["precio"] += 1
+        fecha, fecha_iso = parse_fecha(record[s.fecha]) if s.fecha else (None, None)
+        if fecha is None and fecha_iso:
+            self.parse_failures["fecha"] += 1
+        producto = str(producto).strip() if producto is not None else ""
+        plaza = str(plaza).strip() if plaza is not None else ""
+        return Registro(
+            producto=producto,
+            plaza=plaza,
+            ciudad=_first_value(record, s.ciudad),
+            precio=precio,
+            fecha=fecha,
+            fecha_iso=fecha_iso,
+            promedioKg=record[s.promedio_kg] if s.promedio_kg else None,
+            maximoKg=record.get("maximoKg"),
+            minimoKg=record.get("minimoKg"),
+            raw=record if keep_raw else None,
+            market=self.registry.plaza(plaza).market if plaza else None,
+            category=self.registry.producto(producto).category if producto else None,
+        )
+
+    def iter_normalized(self, records: Iterable, keep_raw: bool = False) -> Iterator[Registro]:
+        """Normaliza en una pasada; ignora (y cuenta) elementos que no son dict."""
+        for r in records:
+            if isinstance(r, dict):
+                yield self.normalize(r, keep_raw=keep_raw)
+            else:
+                self.parse_failures["no_dict"] += 1
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Escritura en streaming de registros SIPSA a disco (JSON compacto o NDJSON, opcional gzip).
+
+Los registros se escriben de a uno a medida que llegan del pipeline, sin armar
+la lista completa ni una copia convertida: Decimal y fechas se convierten al
+serializar cada registro. El JSON compacto lleva un registro por línea dentro
+del arreglo; NDJSON (un objeto por línea) se puede leer incrementalmente con
+iter_records; iter_saved_records también acepta payloads SOAP crudos (.xml o
+.xml.gz de la caché de respuestas) para reprocesar sin conexión.
+"""
+
+import gzip
+import io
+import json
+import os
+from decimal import Decimal
+from typing import IO, Iterable, Iterator
+
+from sipsa_util import atomic_path
+
+FORMATS = ("json", "ndjson")
+_SEPARATORS = (",", ":")
+
+
+def json_default(obj):
+    """Conversión de tipos no nativos de json: Decimal -> float, datetime/date -> ISO."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "isoformat") and hasattr(obj, "year"):
+        return obj.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+def output_path(out_dir: str, stem: str, fmt: str = "json", compress: bool = False) -> str:
+    """Ruta <out_dir>/<stem>.<json|ndjson>[.gz]."""
+    return os.path.join(out_dir, f"{stem}.{fmt}" + (".gz" if compress else ""))
+
+
+def _open_text(path: str, mode: str, compress: bool) -> IO[str]:
+    """Archivo de texto UTF-8 ("r" o "w"), a través de gzip si compress."""
+    if compress:
+        # mtime=0: el mismo contenido produce los mismos bytes
+        return io.TextIOWrapper(gzip.GzipFile(path, mode=mode + "b", mtime=0), encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def write_records(records: Iterable[dict], path: str, fmt: str = "json") -> int:
+    """
+    Escribe records en path consumiéndolos de a uno; devuelve cuántos se escribieron.
+
+    fmt "json": arreglo JSON compacto, un registro por línea. fmt "ndjson": un objeto por
+    línea. Si path termina en .gz se comprime con gzip. Se escribe en un temporal y se
+    renombra al terminar.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt} (use {', '.join(FORMATS)})")
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=_SEPARATORS, default=json_default)
+    n = 0
+    with atomic_path(path) as tmp, _open_text(tmp, "w", path.endswith(".gz")) as f:
+        if fmt == "json":
+            f.write("[")
+        for r in records:
+            if fmt == "json":
+                f.write(",\n" if n else "\n")
+            f.write(encoder.encode(r))
+            if fmt == "ndjson":
+                f.write("\n")
+            n += 1
+        if fmt == "json":
+            f.write("\n]\n" if n else "]\n")
+    return n
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """Lee una salida NDJSON (o JSON, completo en memoria), con o sin gzip, registro por registro."""
+    with _open_text(path, "r", path.endswith(".gz")) as f:
+        if ".ndjson" in os.path.basename(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def iter_saved_records(path: str, operation: str | None = None) -> Iterator[dict]:
+    """
+    Registros de un volcado de out/ o de un payload SOAP guardado (.xml / .xml.gz).
+
+    El payload se parsea con la ruta rápida de sipsa_stream usando el esquema de
+    operation; lxml solo se importa en ese caso y zeep/requests nunca.
+    """
+    nombre = os.path.basename(path)
+    if not (nombre.endswith(".xml") or nombre.endswith(".xml.gz")):
+        yield from iter_records(path)
+        return
+    from sipsa_stream import FAST_PATH_SCHEMAS, iter_soap_records
+
+    with (gzip.open(path, "rb") if nombre.endswith(".gz") else open(path, "rb")) as f:
+        yield from iter_soap_records(f, FAST_PATH_SCHEMAS.get(operation))
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline SIPSA como grafo de etapas con resultados memoizados en disco.
+
+Cada etapa declara sus dependencias y parámetros. Su clave es el hash de nombre,
+versión, parámetros y huellas de contenido de sus entradas, y su salida se
+guarda en .cache/sipsa/stages/v1/<clave>.pkl. Una etapa cuya clave ya está en
+caché no se ejecuta, y su valor solo se carga si alguna etapa posterior lo
+necesita. Como la clave usa la huella de la salida de las entradas (no su
+clave), una etapa recalculada que produce lo mismo no invalida lo que sigue.
+
+Las fuentes (respuestas SOAP vía sipsa_response_cache o archivos guardados)
+siempre se consultan; su huella es el sha256 del contenido. Las etapas cuyas
+dependencias ya están listas corren en paralelo en un pool de hilos, de modo
+que las ramas independientes avanzan a la vez:
+
+  semana_fuente -> semana_ventana -> semana_tabla -> semana_vista
+                                                  -> semana_salida
+                                                  -> alertas (histórico + motor de ahorro)
+  ciudad_fuente -> ciudades_vista -> ciudades_salida
+
+Cambiar solo --format recalcula las salidas. Cambiar --dias, o que cambie el día
+(UTC, el mismo reloj de la ventana), recalcula desde la ventana. Las alertas
+leen estado fuera del grafo (histórico y estado del motor de ahorro), así que su
+clave incluye la huella de ambos. La caché se recorta por LRU (fecha de último uso) hasta --cache-max-mb.
+
+Ejecución:
+  python sipsa_pipeline.py
+  python sipsa_pipeline.py --format ndjson --gzip      # solo reescribe las salidas
+  python sipsa_pipeline.py --dias 14 --only semana
+  python sipsa_pipeline.py --input-semana out/sipsa_plaza_precio_semana_X.json --input-ciudad ciudad.xml.gz
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator
+
+from sipsa_ahorro import OUT_PATH as ALERTS_PATH
+from sipsa_ahorro import AhorroState, build_alerts, state_path, update_state_from_history
+from sipsa_columnar import RecordTable
+from sipsa_history import HISTORY_DIR, sync_history
+from sipsa_metrics import METRICS_DIR, RunMetrics
+from sipsa_normalizer import RecordNormalizer
+from sipsa_output import FORMATS, iter_saved_records, output_path, write_records
+from sipsa_snapshot import history_digest
+from sipsa_topk import top_k
+from sipsa_util import file_sha256, write_atomic
+from sipsa_views import (
+    DIAS_ULTIMA_SEMANA, MEDELLIN_NORMALIZED, OPERATION_CIUDAD, OPERATION_PLAZA_SEMANA, TODAS_LAS_CIUDADES, TOP_N,
+    city_slug, latest_fecha_captura, partition_by_city, print_top, registro_salida, select_ultima_semana,
+    top_por_precio,
+)
+
+WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
+READ_TIMEOUT = 120
+OUT_DIR = "out"
+STAGE_CACHE_VERSION = 1
+STAGE_CACHE_DIR = os.path.join(".cache", "sipsa", "stages", f"v{STAGE_CACHE_VERSION}")
+STAGE_CACHE_MAX_MB = 512
+DEFAULT_WORKERS = 4
+TOP_PLAZAS = 15
+BRANCHES = {
+    "semana": ("semana_vista", "semana_salida"),
+    "ciudades": ("ciudades_vista", "ciudades_salida"),
+    "alertas": ("alertas",),
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """Etapa del grafo: fn(*valores de deps, **params)."""
+
+    name: str
+    fn: Callable
+    deps: tuple[str, ...] = ()
+    params: dict = field(default_factory=dict)
+    version: int = 1  # subir al cambiar la lógica de fn para invalidar su caché
+    memo: bool = True  # False: se ejecuta siempre (fuentes) y su huella es fingerprint(valor)
+    fingerprint: Callable[[object], str] | None = None
+    valid: Callable[[object], bool] | None = None  # el valor en caché sigue sirviendo (p. ej. el archivo existe)
+
+
+@dataclass
+class StageRun:
+    name: str
+    status: str  # "hit" | "run" | "source"
+    seconds: float
+    key: str | None
+    digest: str
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class StageCache:
+    """Salidas de etapas en <dir>/<clave>.pkl con su meta en <clave>.json; LRU por mtime del .pkl."""
+
+    def __init__(self, cache_dir: str = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.dir, f"{key}.pkl"), os.path.join(self.dir, f"{key}.json")
+
+    def lookup(self, key: str) -> dict | None:
+        """Meta de la entrada (digest, bytes) y la marca como usada; None si no está."""
+        pkl_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(pkl_path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def load(self, key: str):
+        with open(self._paths(key)[0], "rb") as f:
+            return pickle.load(f)
+
+    def store(self, key: str, stage: str, value) -> str:
+        """Guarda el valor; devuelve la huella (sha256) de su serialización."""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = _digest(data)
+        pkl_path, meta_path = self._paths(key)
+        write_atomic(pkl_path, data)
+        meta = {"stage": stage, "digest": digest, "bytes": len(data), "created_at": time.time()}
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        return digest
+
+    def evict(self) -> tuple[int, int]:
+        """Borra las entradas menos usadas hasta quedar bajo max_bytes; devuelve (entradas, bytes) borrados."""
+        entradas = []
+        for path in glob.glob(os.path.join(self.dir, "*.pkl")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entradas.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entradas)
+        borradas = liberados = 0
+        for _, size, path in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            for p in (path, path[:-len(".pkl")] + ".json"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(p)
+            total -= size
+            borradas += 1
+            liberados += size
+        return borradas, liberados
+
+
+class Pipeline:
+    """Ejecuta un grafo de etapas con memoización por contenido y ramas en paralelo."""
+
+    def __init__(self, stages: Iterable[Stage], cache: StageCache | None = None, workers: int = DEFAULT_WORKERS,
+                 metrics: RunMetrics | None = None):
+        self.stages = {s.name: s for s in stages}
+        for s in self.stages.values():
+            faltantes = [d for d in s.deps if d not in self.stages]
+            if faltantes:
+                raise ValueError(f"La etapa {s.name} depende de etapas inexistentes: {faltantes}")
+        self.cache = cache or StageCache()
+        self.workers = workers
+        self.metrics = metrics
+        self.runs: dict[str, StageRun] = {}
+        self._values: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _needed(self, targets: Iterable[str]) -> list[str]:
+        """Etapas objetivo y sus ancestros, en orden topológico."""
+        orden, visitando = [], set()
+
+        def visitar(name: str) -> None:
+            if name in orden:
+                return
+            if name in visitando:
+                raise ValueError(f"Ciclo en el grafo de etapas en {name}")
+            visitando.add(name)
+            for d in self.stages[name].deps:
+                visitar(d)
+            visitando.discard(name)
+            orden.append(name)
+
+        for t in targets:
+            visitar(t)
+        return orden
+
+    def key(self, stage: Stage) -> str:
+        base = json.dumps(
+            {
+                "stage": stage.name,
+                "version": stage.version,
+                "params": stage.params,
+                "inputs": [self.runs[d].digest for d in stage.deps],
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return _digest(base.encode("utf-8"))
+
+    def value(self, name: str, key: str | None = None):
+        """Valor de una etapa ya resuelta; las que acertaron en caché se cargan aquí, una sola vez."""
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = self.cache.load(key or self.runs[name].key)
+            return self._values[name]
+
+    def _call(self, stage: Stage):
+        medir = self.metrics.stage(stage.name) if self.metrics is not None else contextlib.nullcontext()
+        inputs = [self.value(d) for d in stage.deps]
+        with medir:
+            return stage.fn(*inputs, **stage.params)
+
+    def _execute(self, name: str) -> StageRun:
+        stage = self.stages[name]
+        t0 = time.perf_counter()
+        if not stage.memo:
+            value = self._call(stage)
+            digest = stage.fingerprint(value) if stage.fingerprint else _digest(pickle.dumps(value))
+            with self._lock:
+                self._values[name] = value
+            return StageRun(name, "source", time.perf_counter() - t0, None, digest)
+
+        key = self.key(stage)
+        meta = self.cache.lookup(key)
+        if meta is not None:
+            try:
+                ok = stage.valid is None or stage.valid(self.value(name, key))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                ok = False
+            if ok:
+                return StageRun(name, "hit", time.perf_counter() - t0, key, meta["digest"])
+        value = self._call(stage)
+        digest = self.cache.store(key, name, value)
+        with self._lock:
+            self._values[name] = value
+        return StageRun(name, "run", time.perf_counter() - t0, key, digest)
+
+    def run(self, targets: Iterable[str] | None = None) -> dict[str, StageRun]:
+        """Resuelve las etapas objetivo (por defecto todas); devuelve el resultado de cada etapa resuelta."""
+        pendientes = {n: set(self.stages[n].deps) for n in self._needed(targets or list(self.stages))}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            en_curso = {}
+            while pendientes or en_curso:
+                for name in [n for n, deps in pendientes.items() if deps <= self.runs.keys()]:
+                    del pendientes[name]
+                    en_curso[pool.submit(self._execute, name)] = name
+                hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for f in hechos:
+                    name = en_curso.pop(f)
+                    self.runs[name] = f.result()
+        return self.runs
+
+
+# --- Etapas SIPSA ---
+
+def _fuente_soap(client, operation: str, refresh: bool):
+    from sipsa_response_cache import ResponseCache
+
+    return ResponseCache().fetch(client, operation, READ_TIMEOUT, force_refresh=refresh)
+
+
+def _iter_fuente(fuente, operation: str) -> Iterator[dict]:
+    """Registros de una fuente: ruta de un archivo guardado o CachedPayload."""
+    if isinstance(fuente, str):
+        return iter_saved_records(fuente, operation)
+    return fuente.iter_records()
+
+
+def _huella_fuente(fuente) -> str:
+    return file_sha256(fuente) if isinstance(fuente, str) else fuente.sha256
+
+
+def _semana_ventana(fuente, dias: int, hoy: str) -> dict:
+    """Normaliza y toma la ventana de la última semana. hoy solo entra en la clave: la ventana depende de la fecha."""
+    normalizer = RecordNormalizer()
+    total, registros = select_ultima_semana(normalizer.iter_normalized(_iter_fuente(fuente, OPERATION_PLAZA_SEMANA)), dias)
+    return {
+        "total": total,
+        "registros": [registro_salida(r) for r in registros],
+        "parse_failures": dict(normalizer.parse_failures),
+    }
+
+
+def _semana_tabla(ventana: dict) -> list[dict]:
+    return list(RecordTable.from_records(ventana["registros"]).dedup().iter_dicts())
+
+
+def _semana_vista(filas: list[dict], top: int) -> dict:
+    """Plazas con más registros y una muestra de cada una (lo que imprime el script semanal)."""
+    tabla = RecordTable.from_records(filas)
+    por_plaza = tabla.group_by_plaza()
+    plazas = []
+    for codigo, idx in top_k(por_plaza.items(), top, score=lambda x: len(x[1]), largest=True):
+        muestra = [
+            {"producto": r.get("producto"), "precio": r.get("precio") or r.get("precioPromedioKg")}
+            for r in tabla.iter_dicts(idx[:5])
+        ]
+        plazas.append({"plaza": tabla.plazas.decode(codigo) or "Sin plaza", "registros": len(idx), "muestra": muestra})
+    return {"total": len(filas), "plazasConDatos": len(por_plaza), "plazas": plazas}
+
+
+def _semana_salida(filas: list[dict], formato: str, comprimir: bool) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    path = output_path(OUT_DIR, f"sipsa_plaza_precio_semana_{timestamp}", formato, comprimir)
+    write_records(filas, path, formato)
+    return path
+
+
+def _huella_alertas(history_dir: str) -> dict:
+    """Estado externo que leen las alertas: contenido del histórico y del estado de ahorro."""
+    path = state_path(history_dir)
+    ahorro = file_sha256(path) if os.path.exists(path) else None
+    return {"historico": history_digest(history_dir), "ahorro": ahorro}
+
+
+def _alertas(filas: list[dict], history_dir: str, out: str, estado: dict) -> dict:
+    """Sincroniza el histórico, actualiza el estado de ahorro y escribe las ProductAlert. estado solo entra en la clave."""
+    resumen = sync_history(filas, history_dir)
+    path = state_path(history_dir)
+    state = AhorroState.load(path)
+    if update_state_from_history(state, history_dir):
+        state.save(path)
+    alerts = build_alerts(state)
+    write_atomic(out, json.dumps(alerts, ensure_ascii=False, indent=2).encode("utf-8"))
+    return {"path": out, "alerts": len(alerts), "weeksAdded": resumen["weeks_added"]}
+
+
+def _ciudades_vista(fuente, ciudades: list[str] | None, top: int) -> dict[str, dict]:
+    """Por ciudad: ranking de precios y registros ordenados por precio."""
+    normalizer = RecordNormalizer()
+    por_ciudad = partition_by_city(normalizer.iter_normalized(_iter_fuente(fuente, OPERATION_CIUDAD), keep_raw=True), ciudades)
+    vista = {}
+    for clave, registros in por_ciudad.items():
+        baratos, caros = top_por_precio(registros, top)
+        ordenados = sorted(registros, key=lambda r: (r.precio is None, r.precio or 0.0))
+        vista[clave] = {
+            "ciudad": next((r.ciudad for r in registros if r.ciudad), clave),
+            "total": len(registros),
+            "fechaCaptura": latest_fecha_captura(registros),
+            "baratos": [{"producto": r.producto, "precio": r.precio} for r in baratos],
+            "caros": [{"producto": r.producto, "precio": r.precio} for r in caros],
+            "registros": [r.raw for r in ordenados],
+        }
+    return vista
+
+
+def _ciudades_salida(vista: dict[str, dict], formato: str, comprimir: bool) -> dict[str, str]:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    archivos = {}
+    for clave, v in vista.items():
+        if v["registros"]:
+            path = output_path(OUT_DIR, f"sipsa_{city_slug(clave)}_{timestamp}", formato, comprimir)
+            write_records(v["registros"], path, formato)
+            archivos[clave] = path
+    return archivos
+
+
+def build_stages(args: argparse.Namespace, client=None) -> list[Stage]:
+    """Grafo SIPSA según los argumentos; client solo hace falta para fuentes sin --input-*."""
+    def fuente(name: str, path: str | None, operation: str) -> Stage:
+        if path:
+            return Stage(name, lambda p: p, params={"p": path}, memo=False, fingerprint=_huella_fuente)
+        return Stage(name, _fuente_soap, params={"client": client, "operation": operation, "refresh": args.refresh},
+                     memo=False, fingerprint=_huella_fuente)
+
+    ciudades = args.ciudad or [MEDELLIN_NORMALIZED]
+    salida = {"formato": args.format, "comprimir": args.gzip}
+    return [
+        fuente("semana_fuente", args.input_semana, OPERATION_PLAZA_SEMANA),
+        Stage("semana_ventana", _semana_ventana, ("semana_fuente",),
+              {"dias": args.dias, "hoy": datetime.now(timezone.utc).date().isoformat()}),
+        Stage("semana_tabla", _semana_tabla, ("semana_ventana",)),
+        Stage("semana_vista", _semana_vista, ("semana_tabla",), {"top": TOP_PLAZAS}),
+        Stage("semana_salida", _semana_salida, ("semana_tabla",), salida, valid=os.path.exists),
+        Stage("alertas", _alertas, ("semana_tabla",),
+              {"history_dir": args.history_dir, "out": ALERTS_PATH, "estado": _huella_alertas(args.history_dir)},
+              valid=lambda v: os.path.exists(v["path"])),
+        fuente("ciudad_fuente", args.input_ciudad, OPERATION_CIUDAD),
+        Stage("ciudades_vista", _ciudades_vista, ("ciudad_fuente",),
+              {"ciudades": None if TODAS_LAS_CIUDADES in ciudades else ciudades, "top": TOP_N}),
+        Stage("ciudades_salida", _ciudades_salida, ("ciudades_vista",), salida,
+              valid=lambda v: all(os.path.exists(p) for p in v.values())),
+    ]
+
+
+def _print_semana(vista: dict, archivo: str | None) -> None:
+    print()
+    print("=== SIPSA: Productos por plaza y precio (última semana) ===")
+    print(f"Total registros: {vista['total']}")
+    print()
+    for p in vista["plazas"]:
+        print(f"  Plaza: {p['plaza']} ({p['registros']} registros)")
+        for r in p["muestra"]:
+            print(f"    - {r['producto']}: {r['precio'] or 'N/A'}")
+        if p["registros"] > 5:
+            print(f"    ... y {p['registros'] - 5} más")
+        print()
+    print(f"Plazas con datos: {vista['plazasConDatos']}")
+    if archivo:
+        print(f"JSON guardado: {archivo}")
+
+
+def _print_ciudades(vista: dict[str, dict], archivos: dict[str, str]) -> None:
+    print()
+    if len(vista) == 1:
+        clave, v = next(iter(vista.items()))
+        nombre = "Medellín" if clave == MEDELLIN_NORMALIZED else v["ciudad"]
+        print(f"=== SIPSA {nombre} ===")
+        print(f"Total registros para {nombre}: {v['total']}")
+        print()
+        print_top(f"Top {TOP_N} productos más baratos (precioPromedio):", v["baratos"])
+        print_top(f"Top {TOP_N} productos más caros (precioPromedio):", v["caros"])
+        print(f"fechaCaptura más reciente: {v['fechaCaptura'] or 'N/A'}")
+    else:
+        print(f"=== SIPSA por ciudad ({len(vista)} ciudades) ===")
+        for clave, v in sorted(vista.items(), key=lambda kv: -kv[1]["total"]):
+            print(f"  {v['ciudad']}: {v['total']} registros, fechaCaptura {v['fechaCaptura'] or 'N/A'}")
+    if len(archivos) == 1:
+        print(f"Guardado: {next(iter(archivos.values()))}")
+    elif archivos:
+        print(f"Guardados: {len(archivos)} archivos en {OUT_DIR}/")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Pipeline SIPSA por etapas con caché de resultados intermedios")
+    parser.add_argument("--only", action="append", choices=sorted(BRANCHES), help="Ramas a resolver (repetible; por defecto todas)")
+    parser.add_argument("--dias", type=int, default=DIAS_ULTIMA_SEMANA, help="Días de la ventana de última semana")
+    parser.add_argument("--ciudad", action="append", help=f"Ciudad de la vista por ciudad (repetible, '{TODAS_LAS_CIUDADES}' = todas)")
+    parser.add_argument("--format", choices=FORMATS, default="json", help="JSON compacto o NDJSON")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir las salidas con gzip")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="Directorio del histórico semanal")
+    parser.add_argument("--input-semana", help="Volcado o payload guardado de promediosSipsaSemanaMadr (sin conexión)")
+    parser.add_argument("--input-ciudad", help="Volcado o payload guardado de promediosSipsaCiudad (sin conexión)")
+    parser.add_argument("--refresh", action="store_true", help="Descargar las respuestas SOAP aunque la caché esté vigente")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Etapas en paralelo")
+    parser.add_argument("--cache-max-mb", type=float, default=STAGE_CACHE_MAX_MB, help="Tamaño máximo de la caché de etapas")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR, help="Directorio del reporte de métricas por etapa")
+    args = parser.parse_args(argv)
+
+    ramas = args.only or sorted(BRANCHES)
+    targets = [t for r in ramas for t in BRANCHES[r]]
+    necesita_red = ("semana" in ramas or "alertas" in ramas) and not args.input_semana
+    necesita_red |= "ciudades" in ramas and not args.input_ciudad
+    client = None
+    if necesita_red:
+        from sipsa_client import get_client
+
+        try:
+            client = get_client(WSDL_URL, operation_timeout=READ_TIMEOUT)
+        except Exception as e:
+            logger.error("No se pudo conectar al WSDL: %s", e)
+            return 1
+
+    metrics = RunMetrics("pipeline", args.metrics_dir)
+    cache = StageCache(max_bytes=int(args.cache_max_mb * 1024 * 1024))
+    pipeline = Pipeline(build_stages(args, client), cache, max(args.workers, 1), metrics)
+    t0 = time.perf_counter()
+    try:
+        runs = pipeline.run(targets)
+    except Exception as e:
+        logger.exception("Falló el pipeline: %s", e)
+        metrics.write(success=False)
+        return 1
+    elapsed = time.perf_counter() - t0
+
+    if "semana" in ramas:
+        _print_semana(pipeline.value("semana_vista"), pipeline.value("semana_salida"))
+    if "ciudades" in ramas:
+        _print_ciudades(pipeline.value("ciudades_vista"), pipeline.value("ciudades_salida"))
+    if "alertas" in ramas:
+        alertas = pipeline.value("alertas")
+        print()
+        print(f"Alertas: {alertas['alerts']} en {alertas['path']}")
+
+    print()
+    print(f"=== Etapas ({elapsed:.2f} s) ===")
+    for r in runs.values():
+        print(f"  {r.name:16} {r.status:6} {r.seconds:8.3f} s")
+
+    # Después de imprimir: las vistas en caché se cargan al leerlas
+    borradas, liberados = cache.evict()
+    for status in ("hit", "run", "source"):
+        metrics.set(f"stages_{status}", sum(r.status == status for r in runs.values()))
+    metrics.set("cache_evicted", borradas)
+    report_path = metrics.write(success=True)
+    if borradas:
+        logger.info("Caché de etapas: %s entradas desalojadas (%.1f MB)", borradas, liberados / 1e6)
+    logger.info("Métricas guardadas: %s", report_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,33 +9,42 @@ Filtra registros de los últimos 7 días y devuelve producto, plaza y precio
 
 Ejecución:
   source .venv/bin/activate
-  python sipsa_plaza_precio_semana.py
+  python sipsa_plaza_precio_semana.py          # parseo incremental (ruta rápida)
+  python sipsa_plaza_precio_semana.py --zeep   # objetos Zeep + serialize_object
+  python sipsa_plaza_precio_semana.py --sync   # solo semanas nuevas al histórico (out/history) y a out/sipsa.sqlite
+  python sipsa_plaza_precio_semana.py --refresh  # ignorar la caché de respuestas y volver a descargar
+  python sipsa_plaza_precio_semana.py --format ndjson --gzip   # salida NDJSON comprimida
+  python sipsa_plaza_precio_semana.py --delta    # además, delta contra el volcado anterior (sipsa_diff)
+  python sipsa_plaza_precio_semana.py --profile  # cProfile/tracemalloc por etapa en out/metrics/
+  python sipsa_plaza_precio_semana.py --input out/sipsa_plaza_precio_semana_20260207_1240.json   # sin conexión
+
+Cada corrida deja tiempos por etapa y contadores en out/metrics/ (JSON y textfile
+de Prometheus, ver sipsa_metrics).
+
+La respuesta de la ruta rápida se guarda en la caché de sipsa_response_cache; si
+su contenido no cambió desde la última corrida no se procesa nada.
+
+Con --input se reprocesa un volcado de out/ o un payload crudo de la caché
+(.xml.gz) sin red: zeep, requests y lxml (este último salvo para payloads) solo
+se importan cuando hay que consultar el servicio.
 """
 
-import json
+import argparse
 import logging
-import os
 import sys
-from datetime import datetime, timedelta, timezone
-from decimal import Decimal
+from datetime import datetime
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from zeep import Client
-from zeep.exceptions import Fault as ZeepFault
-from zeep.helpers import serialize_object
-from zeep.transports import Transport
+from sipsa_columnar import RecordTable
+from sipsa_history import HISTORY_DIR, sync_history
+from sipsa_metrics import METRICS_DIR, RunMetrics
+from sipsa_normalizer import RecordNormalizer, Registro
+from sipsa_output import FORMATS, iter_saved_records, output_path, write_records
+from sipsa_topk import top_k
+from sipsa_views import OPERATION_PLAZA_SEMANA, registro_salida, select_ultima_semana
 
 WSDL_URL = "https://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
-WSDL_URL_HTTP = "http://appweb.dane.gov.co/sipsaWS/SrvSipsaUpraBeanService?WSDL"
-OPERATION_PLAZA_SEMANA = "promediosSipsaSemanaMadr"
-CONNECT_TIMEOUT = 10
 READ_TIMEOUT = 120
-MAX_RETRIES = 3
-BACKOFF_FACTOR = 0.5
 OUT_DIR = "out"
-DIAS_ULTIMA_SEMANA = 7
 
 logging.basicConfig(
     level=logging.INFO,
@@ -45,249 +54,267 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def _json_serializable(obj):
-    if obj is None:
-        return None
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if hasattr(obj, "isoformat") and hasattr(obj, "year"):
-        return obj.isoformat()
-    if isinstance(obj, dict):
-        return {k: _json_serializable(v) for k, v in obj.items()}
-    if isinstance(obj, (list, tuple)):
-        return [_json_serializable(v) for v in obj]
-    return obj
-
-
-def _build_session():
-    session = requests.Session()
-    retry = Retry(
-        total=MAX_RETRIES,
-        connect=MAX_RETRIES,
-        backoff_factor=BACKOFF_FACTOR,
-        status_forcelist=(500, 502, 503, 504),
-        allowed_methods=frozenset(["GET", "HEAD", "POST", "OPTIONS"]),
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+def _get_client(wsdl_url: str):
+    from sipsa_client import get_client
 
+    return get_client(wsdl_url, operation_timeout=READ_TIMEOUT)
 
-def _get_client(wsdl_url: str):
-    session = _build_session()
-    transport = Transport(
-        session=session,
-        timeout=CONNECT_TIMEOUT,
-        operation_timeout=READ_TIMEOUT,
+
+def _log_fetch_error(e: Exception) -> int:
+    """Registra un error de la consulta al servicio; devuelve el código de salida."""
+    import requests
+    from zeep.exceptions import Fault as ZeepFault
+
+    if isinstance(e, ZeepFault):
+        logger.error("SOAPFault: %s", e.message)
+    elif isinstance(e, requests.RequestException):
+        logger.error("Error de conexión: %s", e)
+    else:
+        logger.exception("Error: %s", e)
+    return 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="SIPSA: productos por plaza y precio (última semana)")
+    parser.add_argument(
+        "--zeep",
+        action="store_true",
+        help="Usar la ruta Zeep completa (serialize_object) en lugar del parseo incremental",
     )
-    return Client(wsdl=wsdl_url, transport=transport)
-
-
-def _parse_fecha(value) -> datetime | None:
-    """Convierte valor a datetime para comparación; devuelve None si no se puede."""
-    if value is None:
-        return None
-    if hasattr(value, "year") and hasattr(value, "month"):
-        dt = value
-        if getattr(dt, "tzinfo", None) is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt
-    s = str(value).strip()
-    if not s:
-        return None
-    try:
-        return datetime.fromisoformat(s.replace("Z", "+00:00"))
-    except ValueError:
-        pass
-    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d", "%d/%m/%Y"):
-        try:
-            part = s[:19] if "T" in s else s[:10]
-            return datetime.strptime(part, fmt).replace(tzinfo=timezone.utc)
-        except ValueError:
-            continue
-    return None
-
-
-def _dentro_ultima_semana(fecha_val) -> bool:
-    """True si la fecha cae dentro de los últimos DIAS_ULTIMA_SEMANA días."""
-    dt = _parse_fecha(fecha_val)
-    if dt is None:
-        return False
-    if getattr(dt, "tzinfo", None) is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    ahora = datetime.now(timezone.utc)
-    limite = ahora - timedelta(days=DIAS_ULTIMA_SEMANA)
-    return limite <= dt <= ahora + timedelta(days=1)
-
-
-def _normalize_records(raw_response) -> list[dict]:
-    if raw_response is None:
-        return []
-    records = []
-    try:
-        iterable = list(raw_response) if not isinstance(raw_response, list) else raw_response
-    except TypeError:
-        iterable = [raw_response]
-    for item in iterable:
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=f"Agregar las semanas nuevas al histórico en {HISTORY_DIR} en lugar de escribir un volcado completo",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Descargar de nuevo y procesar aunque la respuesta en caché siga vigente o no haya cambiado",
+    )
+    parser.add_argument(
+        "--stale-ok",
+        action="store_true",
+        help="Si la caché venció, usarla ya y revalidar en segundo plano para la próxima corrida",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="No usar la caché de respuestas")
+    parser.add_argument(
+        "--input",
+        help="Reprocesar sin conexión un volcado de out/ (.json/.ndjson[.gz]) o un payload SOAP guardado (.xml[.gz])",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="json", help="JSON compacto o NDJSON (un registro por línea)")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida con gzip")
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Escribir también el delta (nuevos/eliminados/cambios de precio) contra el volcado anterior de out/",
+    )
+    parser.add_argument("--metrics-dir", default=METRICS_DIR, help="Directorio del reporte de métricas por etapa")
+    parser.add_argument("--profile", action="store_true", help="cProfile y tracemalloc por etapa (más lento)")
+    args = parser.parse_args(argv)
+
+    metrics = RunMetrics("plaza_precio_semana", args.metrics_dir, profile=args.profile)
+    code = _run(args, metrics)
+    report_path = metrics.write(success=code == 0)
+    logger.info("Etapas: %s", metrics.summary())
+    logger.info("Métricas guardadas: %s", report_path)
+    return code
+
+
+def _run(args: argparse.Namespace, metrics: RunMetrics) -> int:
+    usar_zeep = args.zeep
+    consumidor = "sync" if args.sync else f"dump.{args.format}" + (".gz" if args.gzip else "")
+    normalizer = RecordNormalizer()
+
+    if args.input:
+        logger.info("SIPSA productos por plaza y precio - última semana. Sin conexión: %s", args.input)
         try:
-            records.append(serialize_object(item))
-        except Exception:
-            if hasattr(item, "__dict__"):
-                records.append(dict(item))
-            else:
-                records.append({"raw": str(item)})
-    return records
-
-
-def _get_plaza(record: dict) -> str:
-    for k in ("fuenNombre", "fuenNombre_", "plaza", "Plaza", "fuente"):
-        if k in record and record[k] is not None:
-            return str(record[k]).strip()
-    return ""
-
-
-def _get_producto(record: dict) -> str:
-    for k in ("artiNombre", "producto", "Producto", "artiNombre_"):
-        if k in record and record[k] is not None:
-            return str(record[k]).strip()
-    return ""
-
-
-def _get_precio_o_valor(record: dict) -> float | None:
-    """Precio o valor numérico: precioPromedio, promedioKg, etc."""
-    for k in ("precioPromedio", "precio_promedio", "promedioKg", "promedio_kg", "PrecioPromedio"):
-        if k in record and record[k] is not None:
-            try:
-                v = record[k]
-                if isinstance(v, (int, float)):
-                    return float(v)
-                return float(str(v).strip().replace(",", "."))
-            except (ValueError, TypeError):
-                pass
-    return None
-
-
-def _get_fecha_registro(record: dict):
-    for k in ("fechaIni", "enmaFecha", "fechaCaptura", "fechaCreacion", "fecha"):
-        if k in record:
-            return record[k]
-    return None
-
-
-def main() -> int:
+            with metrics.stage("parse_window"):
+                total, ultima_semana = select_ultima_semana(
+                    normalizer.iter_normalized(iter_saved_records(args.input, OPERATION_PLAZA_SEMANA))
+                )
+        except Exception as e:  # archivo ausente, JSON o XML inválido
+            logger.error("No se pudo leer %s: %s", args.input, e)
+            return 1
+        return _report(args, metrics, normalizer, total, ultima_semana)
+
+    from sipsa_client import operation_catalog, resolve_operation
+
     logger.info("SIPSA productos por plaza y precio - última semana. WSDL: %s", WSDL_URL)
 
-    try:
-        client = _get_client(WSDL_URL)
-    except Exception as e:
-        logger.warning("Falló HTTPS. Intentando HTTP... %s", e)
+    with metrics.stage("wsdl"):
+        # Si HTTPS no conecta, el transport pasa a HTTP sin reconstruir el cliente
         try:
-            client = _get_client(WSDL_URL_HTTP)
-        except Exception as e2:
-            logger.error("No se pudo conectar al WSDL: %s", e2)
+            client = _get_client(WSDL_URL)
+        except Exception as e:
+            logger.error("No se pudo conectar al WSDL: %s", e)
             return 1
-
-    if not hasattr(client.service, OPERATION_PLAZA_SEMANA):
-        logger.error("Operación '%s' no encontrada. Disponibles: %s", OPERATION_PLAZA_SEMANA, dir(client.service))
+        catalog = operation_catalog(client)
+    if resolve_operation(catalog, OPERATION_PLAZA_SEMANA) != OPERATION_PLAZA_SEMANA:
+        logger.error("Operación '%s' no encontrada. Disponibles: %s", OPERATION_PLAZA_SEMANA, catalog["operations"])
         return 1
 
     try:
         logger.info("Llamando a %s()...", OPERATION_PLAZA_SEMANA)
-        method = getattr(client.service, OPERATION_PLAZA_SEMANA)
-        raw_response = method()
-    except ZeepFault as e:
-        logger.error("SOAPFault: %s", e.message)
-        return 1
-    except (requests.RequestException, requests.Timeout) as e:
-        logger.error("Error de conexión: %s", e)
-        return 1
-    except Exception as e:
-        logger.exception("Error: %s", e)
-        return 1
+        return _fetch_and_report(args, metrics, client, normalizer, usar_zeep, consumidor)
+    finally:
+        _transport_metrics(metrics, client)
+
+
+def _transport_metrics(metrics: RunMetrics, client) -> None:
+    """Copia los contadores de red de la sesión (bytes en el cable, reintentos, fallback) a las métricas."""
+    from sipsa_client import session_stats
+
+    stats = session_stats(client.transport.session)
+    for name, n in stats.as_dict().items():
+        metrics.set(f"http_{name}", n)
+    logger.info("Red: %s", stats.summary())
+
 
-    all_records = _normalize_records(raw_response)
-    logger.info("Total registros recibidos: %s", len(all_records))
-
-    # Filtrar por última semana (por fechaIni, enmaFecha o equivalente)
-    ultima_semana = [r for r in all_records if _dentro_ultima_semana(_get_fecha_registro(r))]
-    # Si ningún registro tiene fecha en los últimos 7 días, usar los más recientes del set (p. ej. última semana en el servicio)
-    if not ultima_semana and all_records:
-        fechas_parseadas = []
-        for r in all_records:
-            f = _parse_fecha(_get_fecha_registro(r))
-            if f is not None:
-                fechas_parseadas.append((f, r))
-        if fechas_parseadas:
-            fechas_parseadas.sort(key=lambda x: x[0], reverse=True)
-            fecha_mas_reciente = fechas_parseadas[0][0]
-            ultima_semana = [r for f, r in fechas_parseadas if (fecha_mas_reciente - f).days <= DIAS_ULTIMA_SEMANA]
+def _fetch_and_report(args: argparse.Namespace, metrics: RunMetrics, client, normalizer: RecordNormalizer,
+                      usar_zeep: bool, consumidor: str) -> int:
+    from sipsa_client import serialize_response
+    from sipsa_response_cache import ResponseCache
+    from sipsa_stream import iter_operation_records, supports_fast_path
+
+    cache = payload = None
+    try:
+        if usar_zeep or not supports_fast_path(OPERATION_PLAZA_SEMANA):
+            method = getattr(client.service, OPERATION_PLAZA_SEMANA)
+            with metrics.stage("call"):
+                raw_response = method()
+            with metrics.stage("serialize"):
+                records = serialize_response(raw_response)
+            del raw_response
+        elif args.no_cache:
+            # La descarga ocurre mientras se parsea: queda dentro de la etapa parse_window
+            logger.info("Ruta rápida: parseo incremental de la respuesta SOAP")
+            records = iter_operation_records(client, OPERATION_PLAZA_SEMANA, READ_TIMEOUT)
         else:
-            ultima_semana = all_records[:5000]
-    elif not ultima_semana:
-        ultima_semana = []
+            cache = ResponseCache()
+            with metrics.stage("call"):
+                payload = cache.fetch(
+                    client,
+                    OPERATION_PLAZA_SEMANA,
+                    READ_TIMEOUT,
+                    force_refresh=args.refresh,
+                    stale_while_revalidate=args.stale_ok,
+                )
+            metrics.set("cache_hits", int(payload.from_cache))
+            if not args.refresh and cache.is_processed(payload, consumidor):
+                logger.info("Respuesta sin cambios (sha256 %s…); nada que procesar", payload.sha256[:12])
+                print("Sin cambios desde la última corrida.")
+                return 0
+            records = payload.iter_records()
+        with metrics.stage("parse_window"):
+            total, ultima_semana = select_ultima_semana(normalizer.iter_normalized(records))
+    except Exception as e:
+        return _log_fetch_error(e)
 
-    logger.info("Registros en ventana de última semana: %s", len(ultima_semana))
+    code = _report(args, metrics, normalizer, total, ultima_semana)
+    if code == 0 and payload is not None:
+        cache.mark_processed(payload, consumidor)
+    return code
 
-    # Estructura de salida: producto, plaza, precio (o promedioKg), fecha
-    resultado = []
-    for r in ultima_semana:
-        plaza = _get_plaza(r)
-        producto = _get_producto(r)
-        precio = _get_precio_o_valor(r)
-        fecha = _get_fecha_registro(r)
-        fecha_str = _parse_fecha(fecha)
-        fecha_str = fecha_str.isoformat() if fecha_str and hasattr(fecha_str, "isoformat") else str(fecha) if fecha else None
-        resultado.append({
-            "producto": producto,
-            "plaza": plaza,
-            "precio": precio,
-            "precioPromedioKg": r.get("promedioKg"),  # por si el servicio devuelve kg
-            "fecha": fecha_str,
-            "maximoKg": r.get("maximoKg"),
-            "minimoKg": r.get("minimoKg"),
-        })
-
-    # Quitar duplicados opcionales: mismo producto+plaza+fecha (dejar uno)
-    seen = set()
-    unicos = []
-    for r in resultado:
-        key = (r.get("producto"), r.get("plaza"), r.get("fecha"))
-        if key not in seen:
-            seen.add(key)
-            unicos.append(r)
+
+def _report(args: argparse.Namespace, metrics: RunMetrics, normalizer: RecordNormalizer, total: int,
+            ultima_semana: list[Registro]) -> int:
+    """Dedup, salida por consola y volcado o sincronización del histórico."""
+    logger.info("Total registros recibidos: %s", total)
+    logger.info("Registros en ventana de última semana: %s", len(ultima_semana))
+    metrics.set("received", total)
+    metrics.set("in_window", len(ultima_semana))
+    for campo, n in normalizer.parse_failures.items():
+        metrics.set(f"parse_failures_{campo}", n)
+
+    previo = None
+    if args.delta:
+        from sipsa_diff import latest_dumps, read_snapshot
+
+        # Se lee antes de escribir el volcado nuevo: si cae en el mismo minuto, el nombre coincide y lo reemplazaría
+        previos = latest_dumps()
+        previo = read_snapshot(previos[-1]) if previos else None
+
+    with metrics.stage("dedup"):
+        # Estructura de salida: producto, plaza, precio (o promedioKg), fecha, en tabla columnar
+        tabla = RecordTable.from_records(registro_salida(r) for r in ultima_semana)
+        del ultima_semana
+        # Quitar duplicados opcionales: mismo producto+plaza+fecha (dejar uno)
+        unicos = tabla.dedup()
+    metrics.set("deduped", len(unicos))
+    metrics.set("duplicates_removed", len(tabla) - len(unicos))
 
     # Salida consola
     print()
     print("=== SIPSA: Productos por plaza y precio (última semana) ===")
     print(f"Total registros: {len(unicos)}")
     print()
-    # Agrupar por plaza para mostrar
-    por_plaza = {}
-    for r in unicos:
-        p = r.get("plaza") or "Sin plaza"
-        por_plaza.setdefault(p, []).append(r)
-    for plaza, regs in sorted(por_plaza.items(), key=lambda x: -len(x[1]))[:15]:
-        print(f"  Plaza: {plaza} ({len(regs)} registros)")
-        for r in regs[:5]:
+    # Agrupar por plaza para mostrar (mayor número de registros primero)
+    por_plaza = unicos.group_by_plaza()
+    for codigo, idx in top_k(por_plaza.items(), 15, score=lambda x: len(x[1]), largest=True):
+        plaza = unicos.plazas.decode(codigo) or "Sin plaza"
+        print(f"  Plaza: {plaza} ({len(idx)} registros)")
+        for r in unicos.iter_dicts(idx[:5]):
             precio = r.get("precio") or r.get("precioPromedioKg") or "N/A"
             print(f"    - {r.get('producto')}: {precio}")
-        if len(regs) > 5:
-            print(f"    ... y {len(regs) - 5} más")
+        if len(idx) > 5:
+            print(f"    ... y {len(idx) - 5} más")
         print()
     print(f"Plazas con datos: {len(por_plaza)}")
 
-    # JSON
-    os.makedirs(OUT_DIR, exist_ok=True)
+    if args.sync:
+        with metrics.stage("sync_history"):
+            resumen = sync_history(unicos.iter_dicts())
+        if resumen["changed"]:
+            print(f"Histórico actualizado: {len(resumen['weeks_added'])} semanas nuevas ({', '.join(resumen['weeks_added']) or '-'})")
+        else:
+            print("Histórico sin cambios.")
+        _import_sqlite(metrics)
+        if args.delta:
+            _write_delta(previo, unicos, metrics)
+        return 0
+
+    # JSON / NDJSON en streaming desde la tabla
     timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-    out_path = os.path.join(OUT_DIR, f"sipsa_plaza_precio_semana_{timestamp}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(_json_serializable(unicos), f, ensure_ascii=False, indent=2)
+    out_path = output_path(OUT_DIR, f"sipsa_plaza_precio_semana_{timestamp}", args.format, args.gzip)
+    with metrics.stage("write_output"):
+        write_records(unicos.iter_dicts(), out_path, args.format)
     logger.info("JSON guardado: %s", out_path)
     print(f"JSON guardado: {out_path}")
-
+    if args.delta:
+        _write_delta(previo, unicos, metrics, out_path)
     return 0
 
 
+def _import_sqlite(metrics: RunMetrics) -> None:
+    """Carga en la base de sipsa_query las semanas del histórico y los volcados que falten."""
+    from sipsa_query import DB_PATH, connect, import_all
+
+    with metrics.stage("import_sqlite"):
+        conn = connect()
+        try:
+            importadas = import_all(conn)
+        finally:
+            conn.close()
+    metrics.set("sqlite_sources_imported", len(importadas))
+    if importadas:
+        print(f"Base de consultas: {len(importadas)} fuentes nuevas, {sum(importadas.values())} registros en {DB_PATH}")
+
+
+def _write_delta(previo: dict | None, unicos: RecordTable, metrics: RunMetrics, out_path: str | None = None) -> None:
+    """Delta del resultado contra el volcado previo, ya leído con read_snapshot (si existe)."""
+    from sipsa_diff import summary, write_delta
+
+    if previo is None:
+        logger.info("No hay volcado previo en %s; no se genera delta", OUT_DIR)
+        return
+    with metrics.stage("diff"):
+        delta_path, delta = write_delta(previo, unicos.iter_dicts(), current_path=out_path)
+    metrics.set("delta_inserted", len(delta["inserted"]))
+    metrics.set("delta_removed", len(delta["removed"]))
+    metrics.set("delta_changed", len(delta["changed"]))
+    print(f"Delta contra {previo['file']}: {summary(delta)}")
+    print(f"Delta guardado: {delta_path}")
+
+
 if __name__ == "__main__":
     sys.exit(main())
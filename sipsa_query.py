@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consultas locales sobre el histórico SIPSA en una base SQLite indexada.
+
+  import  carga el histórico semanal (out/history) y los volcados semanales de out/
+          (JSON, NDJSON, con o sin gzip). Cada fuente se registra con su hash y no se
+          vuelve a cargar si no cambió.
+  query   filtra por plaza, producto (texto contenido, sin tildes ni mayúsculas) y
+          rango de fechas, con agregados opcionales por producto y plaza.
+
+La tabla precios tiene clave (producto_id, plaza_id, fecha) e índices por
+(plaza_id, fecha) y fecha, así que las búsquedas por producto, plaza o rango son
+escaneos de índice. Plazas y productos viven en tablas propias: los filtros por
+texto se resuelven contra ellas (unos cientos de nombres) y la consulta usa ids.
+
+Ejecución:
+  python sipsa_query.py import
+  python sipsa_query.py query --producto "papa capira" --plaza minorista --semanas 8
+  python sipsa_query.py query --producto tomate --desde 2026-01-01 --agg
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+from typing import Iterable
+
+from sipsa_history import HISTORY_DIR, iter_history, load_manifest
+from sipsa_output import iter_records
+from sipsa_registry import normalize_key
+from sipsa_util import file_sha256
+
+DB_PATH = os.path.join("out", "sipsa.sqlite")
+DUMP_GLOB = os.path.join("out", "sipsa_plaza_precio_semana_*")
+DB_SCHEMA_VERSION = 1
+DEFAULT_LIMIT = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plazas (id INTEGER PRIMARY KEY, nombre TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS productos (id INTEGER PRIMARY KEY, nombre TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS precios (
+    producto_id INTEGER NOT NULL REFERENCES productos(id),
+    plaza_id INTEGER NOT NULL REFERENCES plazas(id),
+    fecha TEXT NOT NULL,
+    precio REAL,
+    maximo_kg REAL,
+    minimo_kg REAL,
+    PRIMARY KEY (producto_id, plaza_id, fecha)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_precios_plaza_fecha ON precios (plaza_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_precios_fecha ON precios (fecha);
+CREATE TABLE IF NOT EXISTS fuentes (
+    fuente TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    importado_en REAL NOT NULL
+);
+"""
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Conexión con el esquema creado (WAL, una escritura concurrente con lecturas)."""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, DB_SCHEMA_VERSION):
+        conn.close()
+        raise RuntimeError(f"{db_path}: versión de esquema {version} no soportada (se espera {DB_SCHEMA_VERSION})")
+    conn.executescript(_SCHEMA)
+    conn.execute(f"PRAGMA user_version={DB_SCHEMA_VERSION}")
+    return conn
+
+
+class _Ids:
+    """Ids de plazas/productos en memoria para no consultar la tabla por cada registro."""
+
+    def __init__(self, conn: sqlite3.Connection, table: str):
+        self.conn = conn
+        self.table = table
+        self.ids = {nombre: i for i, nombre in conn.execute(f"SELECT id, nombre FROM {table}")}
+
+    def get(self, nombre: str) -> int:
+        i = self.ids.get(nombre)
+        if i is None:
+            i = self.conn.execute(f"INSERT INTO {self.table} (nombre) VALUES (?)", (nombre,)).lastrowid
+            self.ids[nombre] = i
+        return i
+
+
+def _float(v) -> float | None:
+    try:
+        return None if v is None else float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_records(conn: sqlite3.Connection, records: Iterable[dict], fuente: str, sha256: str) -> int:
+    """
+    Carga registros con las claves de la salida semanal en una sola transacción.
+
+    Un mismo (producto, plaza, fecha) se reemplaza; la fuente queda registrada con su hash.
+    """
+    n = 0
+    with conn:
+        plazas, productos = _Ids(conn, "plazas"), _Ids(conn, "productos")
+
+        def filas():
+            nonlocal n
+            for r in records:
+                producto, plaza, fecha = r.get("producto"), r.get("plaza"), r.get("fecha")
+                if not producto or not plaza or not fecha:
+                    continue
+                precio = _float(r.get("precio"))
+                if precio is None:
+                    precio = _float(r.get("precioPromedioKg"))
+                n += 1
+                yield (
+                    productos.get(producto), plazas.get(plaza), str(fecha)[:10],
+                    precio, _float(r.get("maximoKg")), _float(r.get("minimoKg")),
+                )
+
+        conn.executemany("INSERT OR REPLACE INTO precios VALUES (?, ?, ?, ?, ?, ?)", filas())
+        conn.execute("INSERT OR REPLACE INTO fuentes VALUES (?, ?, ?, ?)", (fuente, sha256, n, time.time()))
+    return n
+
+
+def _ya_importada(conn: sqlite3.Connection, fuente: str, sha256: str) -> bool:
+    row = conn.execute("SELECT sha256 FROM fuentes WHERE fuente = ?", (fuente,)).fetchone()
+    return row is not None and row[0] == sha256
+
+
+def import_all(conn: sqlite3.Connection, history_dir: str = HISTORY_DIR, dump_glob: str = DUMP_GLOB) -> dict:
+    """Importa las semanas del histórico y los volcados que falten; devuelve {fuente: registros}."""
+    importadas = {}
+    for week, info in load_manifest(history_dir)["weeks"].items():
+        fuente = f"history:{week}"
+        if not _ya_importada(conn, fuente, info["sha256"]):
+            importadas[fuente] = load_records(conn, iter_history(history_dir, [week]), fuente, info["sha256"])
+    for path in sorted(glob.glob(dump_glob)):
+        if ".tmp" in os.path.basename(path):
+            continue
+        sha = file_sha256(path)
+        fuente = os.path.basename(path)
+        if not _ya_importada(conn, fuente, sha):
+            importadas[fuente] = load_records(conn, iter_records(path), fuente, sha)
+    if importadas:
+        conn.execute("ANALYZE")
+    return importadas
+
+
+def _ids_matching(conn: sqlite3.Connection, table: str, textos: list[str] | None) -> list[int] | None:
+    """Ids cuyo nombre contiene alguno de los textos (sin tildes ni mayúsculas); None = sin filtro."""
+    if not textos:
+        return None
+    filtros = [normalize_key(t) for t in textos]
+    return [i for i, nombre in conn.execute(f"SELECT id, nombre FROM {table}")
+            if any(f in normalize_key(nombre) for f in filtros)]
+
+
+def query(conn: sqlite3.Connection, plazas: list[str] | None = None, productos: list[str] | None = None,
+          desde: str | None = None, hasta: str | None = None, semanas: int | None = None,
+          agregado: bool = False, limit: int | None = DEFAULT_LIMIT) -> list[dict]:
+    """
+    Precios filtrados (o agregados por producto y plaza si agregado).
+
+    semanas: últimas N semanas contadas desde la fecha más reciente de la base.
+    """
+    where, params = [], []
+    for table, columna, textos in (("plazas", "plaza_id", plazas), ("productos", "producto_id", productos)):
+        ids = _ids_matching(conn, table, textos)
+        if ids is None:
+            continue
+        if not ids:
+            return []
+        where.append(f"p.{columna} IN ({','.join('?' * len(ids))})")
+        params.extend(ids)
+    if semanas:
+        ultima = conn.execute("SELECT MAX(fecha) FROM precios").fetchone()[0]
+        if ultima is None:
+            return []
+        inicio = (date.fromisoformat(ultima) - timedelta(weeks=semanas - 1, days=6)).isoformat()
+        desde = max(desde, inicio) if desde else inicio
+    if desde:
+        where.append("p.fecha >= ?")
+        params.append(desde)
+    if hasta:
+        where.append("p.fecha <= ?")
+        params.append(hasta)
+    filtro = f"WHERE {' AND '.join(where)}" if where else ""
+
+    if agregado:
+        sql = f"""
+            SELECT pr.nombre, pl.nombre, COUNT(*), AVG(p.precio), MIN(p.precio), MAX(p.precio),
+                   MIN(p.fecha), MAX(p.fecha)
+            FROM precios p JOIN productos pr ON pr.id = p.producto_id JOIN plazas pl ON pl.id = p.plaza_id
+            {filtro}
+            GROUP BY p.producto_id, p.plaza_id
+            ORDER BY pr.nombre, pl.nombre
+        """
+        claves = ("producto", "plaza", "semanas", "promedio", "minimo", "maximo", "desde", "hasta")
+    else:
+        sql = f"""
+            SELECT pr.nombre, pl.nombre, p.fecha, p.precio, p.minimo_kg, p.maximo_kg
+            FROM precios p JOIN productos pr ON pr.id = p.producto_id JOIN plazas pl ON pl.id = p.plaza_id
+            {filtro}
+            ORDER BY p.fecha DESC, pr.nombre, pl.nombre
+        """
+        claves = ("producto", "plaza", "fecha", "precio", "minimoKg", "maximoKg")
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(zip(claves, row)) for row in conn.execute(sql, params)]
+
+
+def _print_rows(rows: list[dict]) -> None:
+    if not rows:
+        print("Sin resultados.")
+        return
+    claves = list(rows[0])
+    celdas = [[_fmt(r[k]) for k in claves] for r in rows]
+    anchos = [min(48, max(len(k), *(len(c[i]) for c in celdas))) for i, k in enumerate(claves)]
+    print("  ".join(k.ljust(a) for k, a in zip(claves, anchos)))
+    for c in celdas:
+        print("  ".join(v[:a].ljust(a) for v, a in zip(c, anchos)))
+
+
+def _fmt(v) -> str:
+    if v is None:
+        return "-"
+    if isinstance(v, float):
+        return f"{v:,.0f}" if v >= 100 else f"{v:.2f}"
+    return str(v)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Consultas locales sobre el histórico SIPSA (SQLite)")
+    parser.add_argument("--db", default=DB_PATH, help="Archivo SQLite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="Cargar histórico y volcados de out/")
+    p_import.add_argument("--history-dir", default=HISTORY_DIR)
+    p_import.add_argument("--dumps", default=DUMP_GLOB, help="Patrón glob de volcados semanales")
+
+    p_query = sub.add_parser("query", help="Consultar precios")
+    p_query.add_argument("--plaza", action="append", help="Texto contenido en la plaza (repetible)")
+    p_query.add_argument("--producto", action="append", help="Texto contenido en el producto (repetible)")
+    p_query.add_argument("--desde", help="Fecha inicial YYYY-MM-DD")
+    p_query.add_argument("--hasta", help="Fecha final YYYY-MM-DD")
+    p_query.add_argument("--semanas", type=int, help="Últimas N semanas de la base")
+    p_query.add_argument("--agg", action="store_true", help="Agregar por producto y plaza (semanas, promedio, mín, máx)")
+    p_query.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Máximo de filas (0 = sin límite)")
+    p_query.add_argument("--json", action="store_true", help="Salida JSON")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        if args.command == "import":
+            t0 = time.perf_counter()
+            importadas = import_all(conn, args.history_dir, args.dumps)
+            total = conn.execute("SELECT COUNT(*) FROM precios").fetchone()[0]
+            for fuente, n in importadas.items():
+                print(f"  {fuente}: {n} registros")
+            print(f"{len(importadas)} fuentes nuevas en {time.perf_counter() - t0:.2f} s; {total} precios en {args.db}")
+            return 0
+
+        t0 = time.perf_counter()
+        rows = query(conn, args.plaza, args.producto, args.desde, args.hasta, args.semanas, args.agg, args.limit)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            _print_rows(rows)
+            print(f"\n{len(rows)} filas en {elapsed_ms:.1f} ms")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro de entidades SIPSA: plazas -> ciudad y mercado del PRD, productos -> categoría.
+
+Los nombres que devuelve el servicio (p. ej. 'Medellín, Plaza Minorista "José María
+Villa"') se resuelven una sola vez: la primera vez que aparece una grafía se
+calcula su clave normalizada (minúsculas, sin tildes ni puntuación), se asigna un
+id canónico por clave y se aplican las reglas de mercado/categoría; las siguientes
+apariciones son una búsqueda en dict por el string tal cual llegó. Grafías nuevas
+de una entidad conocida (mayúsculas, tildes, espacios) caen en la misma clave y
+comparten id.
+
+Mercados del PRD (project.md §2) y taxonomía FRU/GRN/TUB/VER (project.md §3.2).
+"""
+
+import re
+from typing import NamedTuple
+from unicodedata import normalize as unicode_normalize
+
+CATEGORIES = ("FRU", "GRN", "TUB", "VER")
+
+
+class Market(NamedTuple):
+    """Mercado del PRD: id estable, nombre completo, nombre corto del frontend y claves de búsqueda."""
+
+    id: str
+    nombre: str
+    corto: str
+    ciudad: str  # clave normalizada de la ciudad
+    clave: str  # texto normalizado contenido en el nombre de la plaza SIPSA
+
+
+MARKETS = (
+    Market("mayorista", "Central Mayorista de Antioquia", "Mayorista", "medellin", "central mayorista de antioquia"),
+    Market("minorista", 'Plaza Minorista "José María Villa"', "Minorista", "medellin", "plaza minorista"),
+    Market("florez", "Placita de Flórez", "Placita de Flórez", "medellin", "placita de florez"),
+)
+
+# Prefijos sobre el nombre normalizado; gana la primera regla que coincide, así que
+# las más específicas van primero. None excluye el producto (procesados, enlatados).
+PRODUCT_CATEGORY_RULES = (
+    ("tomate de arbol", "FRU"),
+    ("frijol verde", "VER"),
+    ("frijol enlatado", None),
+    ("arveja verde en vaina", "VER"),
+    ("arveja enlatada", None),
+    ("maiz enlatado", None),
+    ("frijol", "GRN"),
+    ("arveja", "GRN"),
+    ("arroz", "GRN"),
+    ("lenteja", "GRN"),
+    ("garbanzo", "GRN"),
+    ("maiz", "GRN"),
+    ("papa ", "TUB"),
+    ("yuca", "TUB"),
+    ("platano", "TUB"),
+    ("name", "TUB"),
+    ("arracacha", "TUB"),
+    ("ulluco", "TUB"),
+    ("aguacate", "FRU"), ("badea", "FRU"), ("banano", "FRU"), ("borojo", "FRU"),
+    ("breva", "FRU"), ("ciruela", "FRU"), ("coco", "FRU"), ("curuba", "FRU"),
+    ("durazno", "FRU"), ("feijoa", "FRU"), ("fresa", "FRU"), ("granadilla", "FRU"),
+    ("guanabana", "FRU"), ("guayaba", "FRU"), ("gulupa", "FRU"), ("higo", "FRU"),
+    ("kiwi", "FRU"), ("limon", "FRU"), ("lulo", "FRU"), ("mandarina", "FRU"),
+    ("mango", "FRU"), ("manzana", "FRU"), ("maracuya", "FRU"), ("melon", "FRU"),
+    ("mora", "FRU"), ("naranja", "FRU"), ("papaya", "FRU"), ("patilla", "FRU"),
+    ("pera ", "FRU"), ("pitahaya", "FRU"), ("pina", "FRU"), ("tangelo", "FRU"),
+    ("uchuva", "FRU"), ("uva", "FRU"), ("zapote", "FRU"),
+    ("acelga", "VER"), ("ahuyama", "VER"), ("ajo", "VER"), ("aji ", "VER"),
+    ("apio", "VER"), ("berenjena", "VER"), ("brocoli", "VER"), ("calabacin", "VER"),
+    ("calabaza", "VER"), ("cebolla", "VER"), ("cebollin", "VER"), ("chocolo", "VER"),
+    ("cidra", "VER"), ("cilantro", "VER"), ("coles", "VER"), ("coliflor", "VER"),
+    ("espinaca", "VER"), ("haba verde", "VER"), ("habichuela", "VER"), ("lechuga", "VER"),
+    ("pepino", "VER"), ("perejil", "VER"), ("pimenton", "VER"), ("rabano", "VER"),
+    ("remolacha", "VER"), ("repollo", "VER"), ("tomate", "VER"), ("zanahoria", "VER"),
+)
+
+_PUNTUACION = re.compile(r"[\"'“”‘’.()]+")
+_ESPACIOS = re.compile(r"\s+")
+
+
+def normalize_key(s) -> str:
+    """Clave de comparación: minúsculas, sin tildes, sin comillas/puntos/paréntesis y espacios simples."""
+    if s is None:
+        return ""
+    nfd = unicode_normalize("NFD", str(s))
+    sin_tildes = "".join(c for c in nfd if not (0x0300 <= ord(c) <= 0x036F)).lower()
+    return _ESPACIOS.sub(" ", _PUNTUACION.sub("", sin_tildes)).strip()
+
+
+class Plaza(NamedTuple):
+    id: int
+    nombre: str  # primera grafía vista
+    ciudad: str  # clave normalizada de la ciudad ("medellin")
+    market: str | None  # Market.id si es un mercado del PRD
+
+
+class Producto(NamedTuple):
+    id: int
+    nombre: str
+    category: str | None  # FRU/GRN/TUB/VER, o None si queda fuera de la taxonomía
+
+
+class EntityRegistry:
+    """Resolución de plazas, productos y ciudades con caché por grafía y por clave normalizada."""
+
+    def __init__(self, markets=MARKETS, category_rules=PRODUCT_CATEGORY_RULES):
+        self.markets = {m.id: m for m in markets}
+        self._category_rules = tuple(category_rules)
+        self._plazas: dict[str, Plaza] = {}
+        self._plazas_por_clave: dict[str, Plaza] = {}
+        self._productos: dict[str, Producto] = {}
+        self._productos_por_clave: dict[str, Producto] = {}
+        self._ciudades: dict[str, str] = {}
+
+    def plaza(self, nombre: str) -> Plaza:
+        p = self._plazas.get(nombre)
+        if p is None:
+            clave = normalize_key(nombre)
+            p = self._plazas_por_clave.get(clave)
+            if p is None:
+                ciudad = clave.split(",", 1)[0].strip()
+                p = Plaza(len(self._plazas_por_clave), nombre, ciudad, self._match_market(ciudad, clave))
+                self._plazas_por_clave[clave] = p
+            self._plazas[nombre] = p
+        return p
+
+    def producto(self, nombre: str) -> Producto:
+        p = self._productos.get(nombre)
+        if p is None:
+            clave = normalize_key(nombre)
+            p = self._productos_por_clave.get(clave)
+            if p is None:
+                p = Producto(len(self._productos_por_clave), nombre, self._match_category(clave))
+                self._productos_por_clave[clave] = p
+            self._productos[nombre] = p
+        return p
+
+    def city_key(self, ciudad) -> str:
+        """Clave normalizada de un valor de ciudad ("MEDELLÍN" -> "medellin")."""
+        if ciudad is None:
+            return ""
+        c = self._ciudades.get(ciudad)
+        if c is None:
+            c = self._ciudades[ciudad] = normalize_key(ciudad)
+        return c
+
+    def market(self, plaza: str) -> str | None:
+        return self.plaza(plaza).market
+
+    def category(self, producto: str) -> str | None:
+        return self.producto(producto).category
+
+    def _match_market(self, ciudad: str, clave: str) -> str | None:
+        for m in self.markets.values():
+            if m.ciudad == ciudad and m.clave in clave:
+                return m.id
+        return None
+
+    def _match_category(self, clave: str) -> str | None:
+        nombre = clave + " "
+        for prefijo, categoria in self._category_rules:
+            if nombre.startswith(prefijo):
+                return categoria
+        return None
+
+
+# Registro compartido por los scripts del proceso
+registry = EntityRegistry()
+
+
+def product_category(producto: str) -> str | None:
+    """Categoría FRU/GRN/TUB/VER del producto SIPSA, o None si queda fuera de la taxonomía."""
+    return registry.producto(producto).category
+
+
+def market_id(plaza: str) -> str | None:
+    """Id del mercado del PRD de la plaza SIPSA, o None."""
+    return registry.plaza(plaza).market
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caché en disco de respuestas SOAP SIPSA con vencimiento según la publicación.
+
+Cada entrada guarda el envelope crudo comprimido (gzip) y su sha256, con clave
+por operación y parámetros. La entrada vence en la siguiente publicación de la
+operación (semanal para promediosSipsaSemanaMadr, diaria para
+promediosSipsaCiudad) o tras max_age si se indica. Mientras está vigente no se
+llama al servicio; al vencer se descarga de nuevo y, si el hash no cambió, el
+consumidor puede saltarse todo el procesamiento (is_processed/mark_processed).
+
+Con stale_while_revalidate una entrada vencida se devuelve de inmediato y se
+refresca en un hilo aparte para la siguiente corrida. Las lecturas y escrituras
+del .json de cada clave van bajo un lock por clave, para que la revalidación y
+mark_processed no se pisen las marcas de procesado.
+
+Solo aplica a operaciones con ruta rápida (sipsa_stream), que parsean el envelope crudo.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from sipsa_client import CACHE_DIR, session_stats
+from sipsa_stream import FAST_PATH_SCHEMAS, iter_soap_records, post_operation
+from sipsa_util import read_json, write_atomic
+
+RESPONSE_CACHE_VERSION = 1
+# Cadencia de publicación de cada operación; las no listadas usan DEFAULT_MAX_AGE
+OPERATION_CADENCE = {
+    "promediosSipsaSemanaMadr": "weekly",
+    "promediosSipsaCiudad": "daily",
+}
+PUBLICATION_WEEKDAY = 0  # lunes
+PUBLICATION_HOUR = 6  # hora de Bogotá a partir de la cual se considera publicada
+BOGOTA_TZ = timezone(timedelta(hours=-5))
+DEFAULT_MAX_AGE = 24 * 3600
+_CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def next_publication(ts: float, cadence: str) -> float:
+    """Timestamp de la primera publicación posterior a ts para la cadencia dada ("weekly" o "daily")."""
+    local = datetime.fromtimestamp(ts, BOGOTA_TZ)
+    corte = local.replace(hour=PUBLICATION_HOUR, minute=0, second=0, microsecond=0)
+    if cadence == "weekly":
+        corte += timedelta(days=(PUBLICATION_WEEKDAY - corte.weekday()) % 7)
+        if corte <= local:
+            corte += timedelta(days=7)
+    elif corte <= local:
+        corte += timedelta(days=1)
+    return corte.timestamp()
+
+
+@dataclass
+class CachedPayload:
+    """Envelope SOAP cacheado: ruta del .xml.gz, hash del contenido sin comprimir y vigencia."""
+
+    operation: str
+    key: str
+    path: str
+    sha256: str
+    fetched_at: float
+    expires_at: float
+    from_cache: bool
+    changed: bool  # el hash difiere de la entrada anterior (o no había entrada)
+
+    @property
+    def stale(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def iter_records(self) -> Iterator[dict]:
+        """Registros del envelope como dicts planos (mismo formato que la ruta rápida en vivo)."""
+        with gzip.open(self.path, "rb") as f:
+            yield from iter_soap_records(f, FAST_PATH_SCHEMAS.get(self.operation))
+
+
+class ResponseCache:
+    """Caché de envelopes por (operación, parámetros) en <cache_dir>/responses/v<versión>/."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_age: float | None = None):
+        self.dir = os.path.join(cache_dir, "responses", f"v{RESPONSE_CACHE_VERSION}")
+        self.max_age = max_age
+        self._refreshing: dict[str, threading.Thread] = {}
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(operation: str, params: dict | None = None) -> str:
+        base = json.dumps({"op": operation, "params": params or {}}, sort_keys=True, default=str)
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()[:32]
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.dir, f"{key}.xml.gz"), os.path.join(self.dir, f"{key}.json")
+
+    def _expires_at(self, operation: str, fetched_at: float) -> float:
+        if self.max_age is not None:
+            return fetched_at + self.max_age
+        cadence = OPERATION_CADENCE.get(operation)
+        if cadence is None:
+            return fetched_at + DEFAULT_MAX_AGE
+        return next_publication(fetched_at, cadence)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        """Lock de la entrada: serializa leer-modificar-escribir de su .json y el reemplazo del .xml.gz."""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load_meta(self, key: str) -> dict | None:
+        payload_path, meta_path = self._paths(key)
+        meta = read_json(meta_path)
+        if not meta or meta.get("version") != RESPONSE_CACHE_VERSION or not os.path.exists(payload_path):
+            return None
+        return meta
+
+    def _entry(self, meta: dict, from_cache: bool, changed: bool) -> CachedPayload:
+        payload_path, _ = self._paths(meta["key"])
+        return CachedPayload(
+            operation=meta["operation"],
+            key=meta["key"],
+            path=payload_path,
+            sha256=meta["sha256"],
+            fetched_at=meta["fetched_at"],
+            expires_at=self._expires_at(meta["operation"], meta["fetched_at"]),
+            from_cache=from_cache,
+            changed=changed,
+        )
+
+    def fetch(self, client, operation: str, operation_timeout: float, params: dict | None = None,
+              force_refresh: bool = False, stale_while_revalidate: bool = False) -> CachedPayload:
+        """
+        Envelope de la operación: desde disco si está vigente, si no descargado y guardado.
+
+        force_refresh descarga siempre. Con stale_while_revalidate una entrada vencida se
+        devuelve tal cual y la descarga corre en segundo plano (ver wait()).
+        """
+        key = self.key(operation, params)
+        meta = self._load_meta(key)
+        if meta and not force_refresh:
+            entry = self._entry(meta, from_cache=True, changed=False)
+            if not entry.stale:
+                logger.info("%s: respuesta en caché vigente hasta %s", operation,
+                            datetime.fromtimestamp(entry.expires_at, BOGOTA_TZ).isoformat(timespec="minutes"))
+                return entry
+            if stale_while_revalidate:
+                logger.info("%s: respuesta en caché vencida; se revalida en segundo plano", operation)
+                self._refresh_in_background(client, operation, operation_timeout, params, key)
+                return entry
+        return self._download(client, operation, operation_timeout, params, key, meta)
+
+    def _download(self, client, operation: str, operation_timeout: float, params: dict | None,
+                  key: str, previous: dict | None) -> CachedPayload:
+        payload_path, meta_path = self._paths(key)
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = f"{payload_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        sha = hashlib.sha256()
+        size = 0
+        response = post_operation(client, operation, operation_timeout, **(params or {}))
+        try:
+            if response.status_code != 200:
+                # SOAP Fault con cuerpo XML: iter_soap_records lanza el Fault; si no, error HTTP
+                list(iter_soap_records(io.BytesIO(response.content)))
+                response.raise_for_status()
+            with open(tmp, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+                for chunk in response.raw.stream(_CHUNK_SIZE, decode_content=True):
+                    sha.update(chunk)
+                    gz.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            session_stats(client.transport.session).record(response, decoded_bytes=size)
+            response.close()
+
+        digest = sha.hexdigest()
+        changed = previous is None or previous.get("sha256") != digest
+        with self._key_lock(key):
+            # Se relee el .json: mientras se descargaba, otro hilo pudo marcar consumidores
+            actual = self._load_meta(key)
+            if actual is None or actual.get("sha256") != digest:
+                os.replace(tmp, payload_path)
+            else:
+                os.remove(tmp)
+            processed = (actual or {}).get("processed", {})
+            meta = {
+                "version": RESPONSE_CACHE_VERSION,
+                "key": key,
+                "operation": operation,
+                "params": params or {},
+                "sha256": digest,
+                "bytes": size,
+                "fetched_at": time.time(),
+                "processed": {c: h for c, h in processed.items() if h == digest},
+            }
+            write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        logger.info("%s: %s bytes descargados (%s)", operation, size, "contenido nuevo" if changed else "sin cambios")
+        return self._entry(meta, from_cache=False, changed=changed)
+
+    def _refresh_in_background(self, client, operation, operation_timeout, params, key) -> None:
+        with self._lock:
+            hilo = self._refreshing.get(key)
+            if hilo is not None and hilo.is_alive():
+                return
+
+            def refrescar():
+                try:
+                    self._download(client, operation, operation_timeout, params, key, self._load_meta(key))
+                except Exception as e:
+                    logger.warning("%s: no se pudo revalidar la caché: %s", operation, e)
+
+            # No daemon: el proceso espera a que termine la revalidación antes de salir
+            hilo = threading.Thread(target=refrescar, name=f"revalidate-{operation}")
+            self._refreshing[key] = hilo
+            hilo.start()
+
+    def wait(self, timeout: float | None = None) -> None:
+        """Espera las revalidaciones en segundo plano pendientes."""
+        for hilo in list(self._refreshing.values()):
+            hilo.join(timeout)
+
+    def is_processed(self, entry: CachedPayload, consumer: str) -> bool:
+        """True si consumer ya procesó este mismo contenido (mismo sha256)."""
+        meta = self._load_meta(entry.key)
+        return bool(meta) and meta.get("processed", {}).get(consumer) == entry.sha256
+
+    def mark_processed(self, entry: CachedPayload, consumer: str) -> None:
+        """Registra que consumer procesó el contenido de la entrada."""
+        with self._key_lock(entry.key):
+            meta = self._load_meta(entry.key)
+            if not meta or meta.get("sha256") != entry.sha256:
+                return
+            meta.setdefault("processed", {})[consumer] = entry.sha256
+            _, meta_path = self._paths(entry.key)
+            write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Datos estáticos pre-particionados para sabor-de-plaza (public/data/).
+
+A partir de las alertas ProductAlert del motor de ahorro (out/product_alerts.json,
+o calculadas desde el estado si no existe) genera archivos pequeños:
+
+  elegidos.<hash>.json          los "16 Elegidos": top 4 por categoría en los mercados de Medellín
+  markets/<mercado>.<hash>.json alertas de cada mercado del PRD
+  categories/<CAT>.<hash>.json  alertas de cada categoría en los mercados del PRD
+  manifest.json                 nombre lógico -> archivo, sha256, bytes y registros
+
+Los nombres llevan el hash del contenido, así que se pueden cachear indefinidamente;
+solo manifest.json cambia entre publicaciones. Cada archivo tiene variantes .gz y,
+si está instalado el paquete brotli, .br. Los shards de builds anteriores que el
+manifest nuevo ya no referencia se eliminan.
+
+Ejecución:
+  python sipsa_ahorro.py && python sipsa_shards.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+from sipsa_ahorro import OUT_PATH as ALERTS_PATH
+from sipsa_ahorro import AhorroState, build_alerts
+from sipsa_registry import CATEGORIES, MARKETS, registry
+from sipsa_topk import GroupedTopK, top_k
+from sipsa_util import write_atomic
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se generan variantes .gz
+    brotli = None
+
+PUBLIC_DIR = os.path.join("sabor-de-plaza", "public")
+DATA_SUBDIR = "data"
+SHARD_VERSION = 1
+TOP_PER_CATEGORY = 4
+_HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.json(\.gz|\.br)?$")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def _market_alerts(alerts: list[dict]) -> dict[str, list[dict]]:
+    """Alertas de los mercados del PRD con market = nombre corto, en el orden recibido (ahorro desc)."""
+    por_mercado: dict[str, list[dict]] = {m.id: [] for m in MARKETS}
+    for a in alerts:
+        market = registry.market(a["market"])
+        if market is not None:
+            por_mercado[market].append({**a, "market": registry.markets[market].corto})
+    return por_mercado
+
+
+def select_elegidos(alerts: list[dict], per_category: int = TOP_PER_CATEGORY) -> list[dict]:
+    """Top per_category por categoría (sin repetir producto), ordenado por ahorro descendente."""
+    # Mejor alerta de cada producto (entre mercados) y luego heap acotado por categoría
+    por_producto = GroupedTopK(1, largest=True).extend(
+        alerts, score=lambda a: a["savingsPercentage"], group=lambda a: (a["category"], a["name"])
+    )
+    ranking = GroupedTopK(per_category, largest=True)
+    for (categoria, _), (mejor,) in por_producto.result().items():
+        ranking.push(categoria, mejor["savingsPercentage"], mejor)
+    elegidos = [a for categoria in CATEGORIES for a in ranking.get(categoria)]
+    return top_k(elegidos, len(elegidos), score=lambda a: a["savingsPercentage"], largest=True)
+
+
+def _by_savings(alerts: list[dict]) -> list[dict]:
+    return sorted(alerts, key=lambda a: -a["savingsPercentage"])
+
+
+def _write_if_changed(path: str, data: bytes) -> None:
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return
+    except OSError:
+        pass
+    write_atomic(path, data)
+
+
+def _write_shard(data_dir: str, logical: str, records: list[dict]) -> dict:
+    """Escribe <logical>.<hash>.json con sus variantes comprimidas; devuelve la entrada del manifest."""
+    body = json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    sha = hashlib.sha256(body).hexdigest()
+    rel = f"{logical}.{sha[:12]}.json"
+    path = os.path.join(data_dir, rel)
+    _write_if_changed(path, body)
+    entry = {"file": rel, "sha256": sha, "bytes": len(body), "records": len(records)}
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    _write_if_changed(path + ".gz", gz)
+    entry["gzipBytes"] = len(gz)
+    if brotli is not None:
+        br = brotli.compress(body, quality=11)
+        _write_if_changed(path + ".br", br)
+        entry["brotliBytes"] = len(br)
+    return entry
+
+
+def _remove_unreferenced(data_dir: str, referenced: set[str]) -> int:
+    """Borra shards con hash que el manifest nuevo no referencia."""
+    borrados = 0
+    for raiz, _, archivos in os.walk(data_dir):
+        for nombre in archivos:
+            rel = os.path.relpath(os.path.join(raiz, nombre), data_dir).replace(os.sep, "/")
+            if _HASHED_NAME.search(nombre) and re.sub(r"\.(gz|br)$", "", rel) not in referenced:
+                os.remove(os.path.join(raiz, nombre))
+                borrados += 1
+    return borrados
+
+
+def build_shards(alerts: list[dict], public_dir: str = PUBLIC_DIR) -> dict:
+    """Genera los shards y manifest.json en <public_dir>/data; devuelve el manifest."""
+    data_dir = os.path.join(public_dir, DATA_SUBDIR)
+    por_mercado = _market_alerts(alerts)
+    medellin = _by_savings([a for lista in por_mercado.values() for a in lista])
+
+    shards = {"elegidos": _write_shard(data_dir, "elegidos", select_elegidos(medellin))}
+    for slug, lista in por_mercado.items():
+        shards[f"markets/{slug}"] = _write_shard(data_dir, f"markets/{slug}", lista)
+    for categoria in CATEGORIES:
+        shards[f"categories/{categoria}"] = _write_shard(
+            data_dir, f"categories/{categoria}", [a for a in medellin if a["category"] == categoria]
+        )
+
+    manifest = {
+        "version": SHARD_VERSION,
+        "generatedAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "markets": {m.id: m.corto for m in MARKETS},
+        "shards": shards,
+    }
+    anterior = None
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            anterior = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if anterior and anterior.get("shards") == shards and anterior.get("version") == SHARD_VERSION:
+        manifest["generatedAt"] = anterior.get("generatedAt", manifest["generatedAt"])
+    _write_if_changed(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    borrados = _remove_unreferenced(data_dir, {s["file"] for s in shards.values()})
+    if borrados:
+        logger.info("Shards obsoletos eliminados: %s", borrados)
+    return manifest
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Shards estáticos por mercado/categoría para sabor-de-plaza")
+    parser.add_argument("--alerts", default=ALERTS_PATH, help="ProductAlert JSON del motor de ahorro")
+    parser.add_argument("--public-dir", default=PUBLIC_DIR, help="Directorio public/ del frontend")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.alerts):
+        with open(args.alerts, "r", encoding="utf-8") as f:
+            alerts = json.load(f)
+    else:
+        logger.info("No existe %s; se calculan las alertas desde el estado de ahorro", args.alerts)
+        alerts = build_alerts(AhorroState.load())
+    if not alerts:
+        logger.error("No hay alertas. Ejecute: python sipsa_plaza_precio_semana.py --sync && python sipsa_ahorro.py")
+        return 1
+
+    manifest = build_shards(alerts, args.public_dir)
+    for nombre, s in manifest["shards"].items():
+        comprimido = s.get("brotliBytes", s["gzipBytes"])
+        print(f"  {nombre:<18} {s['records']:>5} registros  {s['bytes']:>7} B  ({comprimido} B comprimido)")
+    print(f"Manifest: {os.path.join(args.public_dir, DATA_SUBDIR, 'manifest.json')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Snapshot binario columnar del histórico SIPSA para abrir con mmap, sin copia.
+
+El histórico semanal (sipsa_history) se exporta a un solo archivo con columnas
+de ancho fijo: plaza y producto como códigos int32 contra un diccionario de
+strings, semana como int32 (días desde 1970-01-01) y promedioKg/minimoKg/
+maximoKg como float64 (NaN = sin dato). Las filas van ordenadas por semana,
+plaza y producto, y la cabecera trae el rango de filas de cada semana.
+
+Formato (little-endian):
+
+  0   8 bytes  magic b"SIPSACOL"
+  8   uint32   versión del formato (SNAPSHOT_VERSION)
+  12  uint32   largo N de la cabecera JSON
+  16  N bytes  cabecera JSON: filas, columnas {dtype, offset}, diccionarios,
+               semanas {YYYY-MM-DD: [inicio, fin]} y hash del histórico de origen
+  D            columnas desde D = 16 + N redondeado a ALIGN; cada offset es relativo
+               a D y está alineado a ALIGN bytes
+
+SipsaSnapshot(path) mapea el archivo en modo lectura y las columnas son vistas
+numpy sobre el mapa: abrir un año de semanas no lee ni copia los datos, y varios
+procesos que abren el mismo archivo comparten las páginas del caché del sistema.
+
+Ejecución:
+  python sipsa_snapshot.py              # exporta out/history -> out/sipsa_snapshot.bin (si cambió)
+  python sipsa_snapshot.py --info       # abre el snapshot y muestra semanas y tiempo de carga
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from sipsa_columnar import RecordTable
+from sipsa_history import HISTORY_DIR, iter_history, load_manifest
+from sipsa_util import atomic_path
+
+SNAPSHOT_PATH = os.path.join("out", "sipsa_snapshot.bin")
+SNAPSHOT_VERSION = 1
+MAGIC = b"SIPSACOL"
+ALIGN = 64
+_PREFIX = struct.Struct("<8sII")
+COLUMN_DTYPES = {
+    "plaza": "<i4",
+    "producto": "<i4",
+    "week": "<i4",
+    "promedioKg": "<f8",
+    "minimoKg": "<f8",
+    "maximoKg": "<f8",
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def history_digest(history_dir: str = HISTORY_DIR) -> str:
+    """Hash del contenido del histórico (hashes de sus semanas)."""
+    weeks = load_manifest(history_dir)["weeks"]
+    return hashlib.sha256("\n".join(f"{w}:{i['sha256']}" for w, i in weeks.items()).encode("utf-8")).hexdigest()
+
+
+def _align(n: int) -> int:
+    return n + (-n % ALIGN)
+
+
+def _columns_from_table(table: RecordTable) -> dict[str, np.ndarray]:
+    """Columnas del snapshot, sin ordenar; se descartan filas sin semana, plaza o producto."""
+    semana_de_fecha = np.array(
+        [np.datetime64(f[:10], "D").astype(np.int64) if f else -1 for f in table.fechas.values] + [-1],
+        dtype=np.int64,
+    )
+    week = semana_de_fecha[table.fecha]
+    precio = table.prices["precio"]
+    promedio = np.where(np.isnan(precio), table.prices["precioPromedioKg"], precio)
+    ok = (week >= 0) & (table.plaza >= 0) & (table.producto >= 0)
+    return {
+        "plaza": table.plaza[ok],
+        "producto": table.producto[ok],
+        "week": week[ok],
+        "promedioKg": promedio[ok],
+        "minimoKg": table.prices["minimoKg"][ok],
+        "maximoKg": table.prices["maximoKg"][ok],
+    }
+
+
+def write_snapshot(table: RecordTable, path: str = SNAPSHOT_PATH, source_sha256: str | None = None) -> dict:
+    """Escribe la tabla como snapshot binario; devuelve la cabecera."""
+    columns = _columns_from_table(table)
+    orden = np.lexsort((columns["producto"], columns["plaza"], columns["week"]))
+    columns = {name: np.ascontiguousarray(col[orden], dtype=COLUMN_DTYPES[name]) for name, col in columns.items()}
+    n = len(orden)
+
+    week = columns["week"]
+    distintas, inicios = np.unique(week, return_index=True)
+    fines = np.append(inicios[1:], n)
+    semanas = {
+        str(np.datetime64(int(d), "D")): [int(a), int(b)] for d, a, b in zip(distintas, inicios, fines)
+    }
+
+    offsets, offset = {}, 0
+    for name, col in columns.items():
+        offsets[name] = offset
+        offset = _align(offset + col.nbytes)
+    header = {
+        "rows": n,
+        "columns": {name: {"dtype": COLUMN_DTYPES[name], "offset": offsets[name]} for name in columns},
+        "plazas": list(table.plazas.values),
+        "productos": list(table.productos.values),
+        "weeks": semanas,
+        "source_sha256": source_sha256,
+    }
+    body = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    data_start = _align(_PREFIX.size + len(body))
+
+    with atomic_path(path) as tmp, open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, SNAPSHOT_VERSION, len(body)))
+        f.write(body)
+        for name, col in columns.items():
+            f.write(b"\0" * (data_start + offsets[name] - f.tell()))
+            f.write(col.tobytes())
+    return header
+
+
+class SipsaSnapshot:
+    """Snapshot abierto con mmap; las columnas son arrays numpy de solo lectura sobre el mapa."""
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, header_len = _PREFIX.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} no es un snapshot SIPSA")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Versión de snapshot no soportada: {version}")
+            self.header = json.loads(bytes(self._mmap[_PREFIX.size:_PREFIX.size + header_len]))
+        except BaseException:
+            self._mmap.close()
+            raise
+        self.rows = self.header["rows"]
+        self.plazas: list[str] = self.header["plazas"]
+        self.productos: list[str] = self.header["productos"]
+        self.weeks: dict[str, list[int]] = self.header["weeks"]
+        data_start = _align(_PREFIX.size + header_len)
+        self.columns = {
+            name: np.frombuffer(self._mmap, dtype=info["dtype"], count=self.rows, offset=data_start + info["offset"])
+            for name, info in self.header["columns"].items()
+        }
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def week_range(self, week: str) -> slice:
+        """Filas de una semana (YYYY-MM-DD) como slice sobre las columnas."""
+        inicio, fin = self.weeks.get(week, (0, 0))
+        return slice(inicio, fin)
+
+    def week_dates(self) -> np.ndarray:
+        """Columna week como datetime64[D] (copia)."""
+        return self.columns["week"].astype("datetime64[D]")
+
+    def close(self) -> None:
+        # Las vistas numpy mantienen referencias al buffer: se sueltan antes de cerrar
+        self.columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:  # alguien más conserva una vista; el mapa se libera con ella
+            pass
+
+    def __enter__(self) -> "SipsaSnapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def export_history(history_dir: str = HISTORY_DIR, path: str = SNAPSHOT_PATH, force: bool = False) -> dict | None:
+    """Exporta el histórico al snapshot si cambió; devuelve la cabecera escrita o None si no hizo falta."""
+    digest = history_digest(history_dir)
+    if not force and os.path.exists(path):
+        try:
+            with SipsaSnapshot(path) as snap:
+                if snap.header.get("source_sha256") == digest:
+                    return None
+        except (ValueError, OSError, struct.error):
+            pass
+    table = RecordTable.from_records(iter_history(history_dir)).dedup()
+    return write_snapshot(table, path, source_sha256=digest)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Snapshot binario columnar (mmap) del histórico SIPSA")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="Directorio del histórico semanal")
+    parser.add_argument("--out", default=SNAPSHOT_PATH, help="Archivo del snapshot")
+    parser.add_argument("--force", action="store_true", help="Exportar aunque el histórico no haya cambiado")
+    parser.add_argument("--info", action="store_true", help="Solo abrir el snapshot y mostrar su contenido")
+    args = parser.parse_args(argv)
+
+    if not args.info:
+        if not load_manifest(args.history_dir)["weeks"]:
+            logger.error("No hay histórico en %s. Ejecute: python sipsa_plaza_precio_semana.py --sync", args.history_dir)
+            return 1
+        t0 = time.perf_counter()
+        header = export_history(args.history_dir, args.out, args.force)
+        if header is None:
+            logger.info("Snapshot al día con el histórico; no se reescribe")
+        else:
+            logger.info("Snapshot exportado: %s filas en %.3f s", header["rows"], time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    try:
+        snap = SipsaSnapshot(args.out)
+    except (OSError, ValueError) as e:
+        logger.error("No se pudo abrir %s: %s", args.out, e)
+        return 1
+    with snap:
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        print(f"Snapshot: {args.out} ({os.path.getsize(args.out)} bytes, versión {SNAPSHOT_VERSION})")
+        print(f"  {snap.rows} filas, {len(snap.plazas)} plazas, {len(snap.productos)} productos, {len(snap.weeks)} semanas")
+        for week, (a, b) in list(snap.weeks.items())[-5:]:
+            print(f"  {week}: {b - a} filas")
+        print(f"  Apertura (mmap + cabecera): {elapsed_ms:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
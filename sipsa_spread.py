@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Matriz de dispersión de precios entre plazas: producto × plaza × semana.
+
+Carga las últimas semanas del histórico (sipsa_history) en un tensor float64
+(NaN = sin dato) y calcula, para la semana más reciente y con operaciones
+vectorizadas sobre todo el tensor a la vez:
+
+  - precio mínimo/máximo/medio entre plazas, plaza más barata y más cara y
+    dispersión % = (máximo - mínimo) / mínimo × 100 (oportunidades de arbitraje)
+  - rango intra-plaza medio: (maximoKg - minimoKg) / precio, promediado entre plazas
+  - posición de la ciudad de referencia (Medellín) frente a las demás ciudades,
+    comparando el precio medio de sus plazas (1 = la más barata)
+  - variación semanal: cambio % medio frente a la semana anterior en las plazas
+    que reportan ambas semanas
+
+La salida es una tabla compacta (columnas + filas, como las semanas del histórico)
+en out/sipsa_spread_<semana>.json.
+
+Ejecución:
+  python sipsa_plaza_precio_semana.py --sync && python sipsa_spread.py
+  python sipsa_spread.py --weeks 4 --ciudad Bogotá --gzip
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from sipsa_columnar import RecordTable
+from sipsa_history import HISTORY_DIR, iter_history, load_manifest
+from sipsa_registry import normalize_key, registry
+from sipsa_topk import top_k
+from sipsa_util import write_atomic
+
+OUT_DIR = "out"
+DEFAULT_WEEKS = 8
+CIUDAD_REFERENCIA = "medellin"
+TOP_ARBITRAJE = 15
+SPREAD_COLUMNS = (
+    "producto", "categoria", "plazas", "precioMin", "plazaMin", "precioMax", "plazaMax", "precioMedio",
+    "dispersionPct", "rangoIntraPlazaPct", "precioCiudad", "rankCiudad", "ciudades", "variacionSemanalPct",
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class PriceTensor:
+    """Precios [producto, plaza, semana] con maximoKg/minimoKg alineados; semanas en orden ascendente."""
+
+    def __init__(self, productos: list[str], plazas: list[str], weeks: list[str],
+                 precio: np.ndarray, maximo: np.ndarray, minimo: np.ndarray):
+        self.productos = productos
+        self.plazas = plazas
+        self.weeks = weeks
+        self.precio = precio
+        self.maximo = maximo
+        self.minimo = minimo
+
+    @classmethod
+    def from_table(cls, table: RecordTable) -> "PriceTensor":
+        """Ubica cada fila de la tabla en su celda; si una celda se repite, gana la última fila."""
+        semana_de_fecha = [f[:10] if f else None for f in table.fechas.values]
+        weeks = sorted({w for w in semana_de_fecha if w})
+        pos = {w: i for i, w in enumerate(weeks)}
+        # Un -1 extra al final: el código de fecha None (-1) cae en él
+        fecha_a_semana = np.array([pos.get(w, -1) for w in semana_de_fecha] + [-1], dtype=np.intp)
+        semana = fecha_a_semana[table.fecha]
+
+        # precio si existe; si no, precioPromedioKg (igual que la salida semanal)
+        precio = np.where(np.isnan(table.prices["precio"]), table.prices["precioPromedioKg"], table.prices["precio"])
+        ok = (semana >= 0) & (table.producto >= 0) & (table.plaza >= 0) & np.isfinite(precio)
+        celda = (table.producto[ok], table.plaza[ok], semana[ok])
+
+        shape = (len(table.productos), len(table.plazas), len(weeks))
+        tensores = []
+        for valores in (precio, table.prices["maximoKg"], table.prices["minimoKg"]):
+            t = np.full(shape, np.nan)
+            t[celda] = valores[ok]
+            tensores.append(t)
+        return cls(list(table.productos.values), list(table.plazas.values), weeks, *tensores)
+
+    @property
+    def nbytes(self) -> int:
+        return self.precio.nbytes + self.maximo.nbytes + self.minimo.nbytes
+
+
+def load_tensor(history_dir: str = HISTORY_DIR, n_weeks: int = DEFAULT_WEEKS) -> PriceTensor:
+    """Tensor de las últimas n_weeks semanas del histórico."""
+    semanas = list(load_manifest(history_dir)["weeks"])[-n_weeks:]
+    return PriceTensor.from_table(RecordTable.from_records(iter_history(history_dir, weeks=semanas)).dedup())
+
+
+def compute_spread(tensor: PriceTensor, ciudad: str = CIUDAD_REFERENCIA) -> dict[str, np.ndarray]:
+    """Métricas por producto de la última semana del tensor (arrays alineados con tensor.productos)."""
+    n_prod = len(tensor.productos)
+    filas = np.arange(n_prod)
+    actual = tensor.precio[:, :, -1]
+    hay = np.isfinite(actual)
+    n_plazas = hay.sum(axis=1)
+
+    bajos = np.where(hay, actual, np.inf)
+    altos = np.where(hay, actual, -np.inf)
+    plaza_min = bajos.argmin(axis=1)
+    plaza_max = altos.argmax(axis=1)
+    precio_min = bajos[filas, plaza_min]
+    precio_max = altos[filas, plaza_max]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precio_medio = np.where(hay, actual, 0.0).sum(axis=1) / n_plazas
+        dispersion = np.where(n_plazas >= 2, (precio_max - precio_min) / precio_min * 100, np.nan)
+
+        rango = (tensor.maximo[:, :, -1] - tensor.minimo[:, :, -1]) / actual
+        con_rango = np.isfinite(rango)
+        rango_medio = np.where(con_rango, rango, 0.0).sum(axis=1) / con_rango.sum(axis=1) * 100
+
+        # Precio medio por ciudad: suma y conteo por plaza proyectados con una matriz plaza -> ciudad
+        ciudades = [registry.plaza(p).ciudad for p in tensor.plazas]
+        nombres_ciudad = sorted(set(ciudades))
+        col = {c: i for i, c in enumerate(nombres_ciudad)}
+        plaza_ciudad = np.zeros((len(tensor.plazas), len(nombres_ciudad)))
+        plaza_ciudad[np.arange(len(tensor.plazas)), [col[c] for c in ciudades]] = 1.0
+        precio_ciudad = (np.where(hay, actual, 0.0) @ plaza_ciudad) / (hay.astype(np.float64) @ plaza_ciudad)
+        n_ciudades = np.isfinite(precio_ciudad).sum(axis=1)
+        ref = col.get(normalize_key(ciudad))
+        if ref is None:
+            ref_precio = np.full(n_prod, np.nan)
+        else:
+            ref_precio = precio_ciudad[:, ref]
+        rank = np.where(
+            np.isfinite(ref_precio),
+            (np.nan_to_num(precio_ciudad, nan=np.inf) < ref_precio[:, None]).sum(axis=1) + 1,
+            0,
+        )
+
+        if len(tensor.weeks) >= 2:
+            anterior = tensor.precio[:, :, -2]
+            ambas = hay & np.isfinite(anterior) & (anterior > 0)
+            cambio = np.where(ambas, (actual - anterior) / anterior, 0.0)
+            variacion = cambio.sum(axis=1) / ambas.sum(axis=1) * 100
+        else:
+            variacion = np.full(n_prod, np.nan)
+
+    return {
+        "plazas": n_plazas,
+        "precioMin": np.where(n_plazas > 0, precio_min, np.nan),
+        "plazaMin": plaza_min,
+        "precioMax": np.where(n_plazas > 0, precio_max, np.nan),
+        "plazaMax": plaza_max,
+        "precioMedio": precio_medio,
+        "dispersionPct": dispersion,
+        "rangoIntraPlazaPct": rango_medio,
+        "precioCiudad": ref_precio,
+        "rankCiudad": rank,
+        "ciudades": n_ciudades,
+        "variacionSemanalPct": variacion,
+    }
+
+
+def _num(v) -> float | None:
+    return None if not np.isfinite(v) else round(float(v), 2)
+
+
+def spread_rows(tensor: PriceTensor, metricas: dict[str, np.ndarray]) -> list[list]:
+    """Filas de SPREAD_COLUMNS para los productos con precio en la última semana."""
+    rows = []
+    for i in np.flatnonzero(metricas["plazas"] > 0):
+        producto = tensor.productos[i]
+        rows.append([
+            producto,
+            registry.category(producto),
+            int(metricas["plazas"][i]),
+            _num(metricas["precioMin"][i]),
+            tensor.plazas[metricas["plazaMin"][i]],
+            _num(metricas["precioMax"][i]),
+            tensor.plazas[metricas["plazaMax"][i]],
+            _num(metricas["precioMedio"][i]),
+            _num(metricas["dispersionPct"][i]),
+            _num(metricas["rangoIntraPlazaPct"][i]),
+            _num(metricas["precioCiudad"][i]),
+            int(metricas["rankCiudad"][i]) or None,
+            int(metricas["ciudades"][i]),
+            _num(metricas["variacionSemanalPct"][i]),
+        ])
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Dispersión de precios producto × plaza × semana")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="Directorio del histórico semanal")
+    parser.add_argument("--weeks", type=int, default=DEFAULT_WEEKS, help="Semanas del histórico a cargar")
+    parser.add_argument("--ciudad", default=CIUDAD_REFERENCIA, help="Ciudad de referencia para el ranking")
+    parser.add_argument("--out", help="Archivo de salida (por defecto out/sipsa_spread_<semana>.json)")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida con gzip")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    tensor = load_tensor(args.history_dir, max(args.weeks, 1))
+    if not tensor.weeks:
+        logger.error("No hay histórico en %s. Ejecute: python sipsa_plaza_precio_semana.py --sync", args.history_dir)
+        return 1
+    t1 = time.perf_counter()
+    metricas = compute_spread(tensor, args.ciudad)
+    t2 = time.perf_counter()
+    logger.info(
+        "Tensor %s productos × %s plazas × %s semanas (%.1f MB): carga %.3f s, cálculo %.1f ms",
+        len(tensor.productos), len(tensor.plazas), len(tensor.weeks), tensor.nbytes / 1e6, t1 - t0, (t2 - t1) * 1000,
+    )
+
+    semana = tensor.weeks[-1]
+    rows = spread_rows(tensor, metricas)
+    tabla = {"week": semana, "ciudad": normalize_key(args.ciudad), "columns": list(SPREAD_COLUMNS), "rows": rows}
+    out = args.out or os.path.join(OUT_DIR, f"sipsa_spread_{semana}.json" + (".gz" if args.gzip else ""))
+    body = json.dumps(tabla, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    write_atomic(out, gzip.compress(body, mtime=0) if out.endswith(".gz") else body)
+
+    c = {name: i for i, name in enumerate(SPREAD_COLUMNS)}
+    print()
+    print(f"=== Dispersión entre plazas, semana {semana} ({len(rows)} productos) ===")
+    for r in top_k(rows, TOP_ARBITRAJE, score=lambda r: r[c["dispersionPct"]], largest=True):
+        rank = f"{r[c['rankCiudad']]}/{r[c['ciudades']]}" if r[c["rankCiudad"]] else "-"
+        print(f"  {r[c['producto']]}: {r[c['precioMin']]} ({r[c['plazaMin']]}) -> {r[c['precioMax']]} "
+              f"({r[c['plazaMax']]}), +{r[c['dispersionPct']]}%; {args.ciudad}: {rank}")
+    print()
+    logger.info("Tabla guardada: %s", out)
+    print(f"Tabla guardada: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ruta rápida para respuestas SIPSA: parseo incremental del cuerpo SOAP.
+
+En lugar de construir el árbol de objetos Zeep y pasarlo por serialize_object,
+envía el mismo envelope que generaría Zeep, recibe la respuesta en streaming y
+la recorre con lxml.etree.iterparse, liberando cada <return> apenas se emite.
+Cada registro sale como un dict plano (nombre de campo -> valor) y la memoria
+queda acotada a un registro, sin importar el tamaño de la respuesta.
+
+Solo se usa para operaciones con esquema conocido (FAST_PATH_SCHEMAS); para el
+resto los scripts siguen usando la ruta Zeep.
+"""
+
+import logging
+from typing import IO, Iterator
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Conversión por campo de cada operación conocida; los campos no listados
+# (nombres, fechas ISO) se dejan como texto.
+FAST_PATH_SCHEMAS = {
+    "promediosSipsaSemanaMadr": {
+        "artiId": int,
+        "fuenId": int,
+        "futiId": int,
+        "promedioKg": float,
+        "maximoKg": float,
+        "minimoKg": float,
+    },
+    "promediosSipsaCiudad": {
+        "codProducto": int,
+        "regId": int,
+        "precioPromedio": float,
+    },
+}
+
+_RECORD_TAGS = ("{*}return", "{*}Fault")
+
+
+def supports_fast_path(operation_name: str) -> bool:
+    """True si la operación tiene esquema conocido para el parseo incremental."""
+    return operation_name in FAST_PATH_SCHEMAS
+
+
+def _convert(value: str, conv):
+    try:
+        return conv(value)
+    except (ValueError, TypeError):
+        return value
+
+
+def _raise_fault(elem) -> None:
+    from zeep.exceptions import Fault as ZeepFault  # diferido: parsear un payload guardado no requiere zeep
+
+    campos = {etree.QName(c).localname: (c.text or "").strip() for c in elem.iter() if c is not elem}
+    message = campos.get("faultstring") or campos.get("Text") or "SOAP Fault"
+    code = campos.get("faultcode") or campos.get("Value")
+    raise ZeepFault(message, code=code)
+
+
+def iter_soap_records(stream: IO[bytes], field_types: dict | None = None) -> Iterator[dict]:
+    """
+    Recorre un envelope SOAP desde un archivo/stream y emite cada <return> como dict plano.
+
+    Lanza zeep Fault si el cuerpo contiene un SOAP Fault.
+    """
+    field_types = field_types or {}
+    for _, elem in etree.iterparse(stream, events=("end",), tag=_RECORD_TAGS, huge_tree=True):
+        if etree.QName(elem).localname == "Fault":
+            _raise_fault(elem)
+        record = {}
+        for child in elem:
+            name = etree.QName(child).localname
+            text = child.text
+            if text is None:
+                record[name] = None
+                continue
+            conv = field_types.get(name)
+            record[name] = _convert(text, conv) if conv else text
+        yield record
+        # Liberar el elemento y los hermanos ya procesados para mantener memoria acotada
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def post_operation(client, operation_name: str, operation_timeout: float, **kwargs):
+    """POST del envelope de Zeep para la operación; devuelve la respuesta requests en modo stream."""
+    from sipsa_client import CONNECT_TIMEOUT
+
+    binding = client.service._binding
+    options = client.service._binding_options
+    envelope, http_headers = binding._create(operation_name, (), kwargs, client=client, options=options)
+    message = etree.tostring(envelope, encoding="utf-8", xml_declaration=True)
+    transport = client.transport
+    # CachingTransport.request aplica el fallback HTTPS -> HTTP; un Transport Zeep simple va directo a la sesión
+    request = getattr(transport, "request", transport.session.request)
+    response = request(
+        "POST",
+        options["address"],
+        data=message,
+        headers=http_headers,
+        timeout=(CONNECT_TIMEOUT, operation_timeout),
+        stream=True,
+    )
+    if response.status_code != 200 and "xml" not in response.headers.get("Content-Type", ""):
+        response.close()
+        response.raise_for_status()
+    response.raw.decode_content = True
+    return response
+
+
+def iter_operation_records(client, operation_name: str, operation_timeout: float, **kwargs) -> Iterator[dict]:
+    """
+    Llama a la operación SOAP con el envelope de Zeep y emite los registros en streaming.
+
+    Usa la sesión y el endpoint del cliente Zeep; no construye objetos Zeep para la respuesta.
+    """
+    from sipsa_client import session_stats
+
+    response = post_operation(client, operation_name, operation_timeout, **kwargs)
+    body = _CountingReader(response.raw)
+    try:
+        yield from iter_soap_records(body, FAST_PATH_SCHEMAS.get(operation_name))
+        response.raise_for_status()
+    finally:
+        session_stats(client.transport.session).record(response, decoded_bytes=body.bytes)
+        response.close()
+
+
+class _CountingReader:
+    """Envoltorio de lectura que cuenta los bytes ya descomprimidos."""
+
+    def __init__(self, raw: IO[bytes]):
+        self.raw = raw
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes += len(data)
+        return data
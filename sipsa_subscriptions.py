@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Alertas de precio por suscripción sobre las ProductAlert del motor de ahorro.
+
+Cada suscripción tiene un contacto, un tipo de umbral y, opcionalmente, producto
+y plaza (sin ellos aplica a todos):
+
+  precio     currentPrice <= umbral
+  ahorro     savingsPercentage >= umbral
+  temporada  savingsPercentage > TEMPORADA_UMBRAL (flag "De Temporada", project.md §3.3)
+
+La plaza puede ser el id de un mercado del PRD (mayorista, minorista, florez) o el
+nombre de la plaza SIPSA; producto y plaza se comparan por clave normalizada.
+
+Las suscripciones se indexan por (tipo, producto, plaza), con los umbrales de cada
+clave ordenados: una alerta consulta a lo sumo 6 claves (producto o comodín ×
+plaza, mercado o comodín) y con bisect toma solo las suscripciones que cumple,
+sin recorrer las demás. En cada refresco las suscripciones ya evaluadas solo
+se comparan con las alertas nuevas o con precio/ahorro distinto al de la última
+ejecución; las suscripciones nuevas o modificadas se comparan con todas las
+alertas vigentes (estado, con la huella de cada suscripción, en
+.cache/sipsa/dispatch_state.json). Las notificaciones se agrupan por contacto
+y se envían en lotes a un sink: archivo NDJSON o POST HTTP (p. ej. un servidor
+de prueba).
+
+Ejecución:
+  python sipsa_subscriptions.py add --contacto ana@correo.com --tipo precio --producto "Tomate chonto" --umbral 3000
+  python sipsa_subscriptions.py add --contacto ana@correo.com --tipo temporada --plaza minorista
+  python sipsa_ahorro.py && python sipsa_subscriptions.py dispatch
+  python sipsa_subscriptions.py dispatch --sink http://127.0.0.1:9000/notify
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import urllib.request
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Iterable, NamedTuple, Protocol
+
+from sipsa_ahorro import OUT_PATH as ALERTS_PATH
+from sipsa_registry import normalize_key, registry
+from sipsa_util import write_atomic
+
+SUBSCRIPTIONS_PATH = os.path.join("out", "subscriptions.json")
+DISPATCH_STATE_PATH = os.path.join(".cache", "sipsa", "dispatch_state.json")
+DISPATCH_STATE_VERSION = 2
+NOTIFICATIONS_PATH = os.path.join("out", "notifications.ndjson")
+TIPOS = ("precio", "ahorro", "temporada")
+TEMPORADA_UMBRAL = 15.0
+BATCH_SIZE = 100
+HTTP_TIMEOUT = 10
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class Subscription(NamedTuple):
+    id: str
+    contacto: str
+    tipo: str
+    producto: str | None = None
+    plaza: str | None = None  # id de mercado del PRD o nombre de plaza SIPSA
+    umbral: float | None = None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Subscription":
+        tipo = d.get("tipo")
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de suscripción inválido: {tipo!r} (use {', '.join(TIPOS)})")
+        umbral = d.get("umbral")
+        if tipo != "temporada" and umbral is None:
+            raise ValueError(f"La suscripción de tipo {tipo} requiere umbral")
+        sub = cls(
+            id=d.get("id") or "",
+            contacto=d["contacto"],
+            tipo=tipo,
+            producto=d.get("producto") or None,
+            plaza=d.get("plaza") or None,
+            umbral=float(umbral) if umbral is not None else None,
+        )
+        return sub if sub.id else sub._replace(id=_subscription_id(sub))
+
+
+def _subscription_id(sub: Subscription) -> str:
+    clave = "|".join(str(v) for v in (sub.contacto, sub.tipo, sub.producto, sub.plaza, sub.umbral))
+    return "s-" + hashlib.sha1(clave.encode("utf-8")).hexdigest()[:10]
+
+
+def _fingerprint(sub: Subscription) -> str:
+    """Huella de todos los campos: cambia si se edita una suscripción aunque conserve su id."""
+    return hashlib.sha1(json.dumps(sub._asdict(), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _plaza_key(plaza: str | None):
+    if plaza is None:
+        return None
+    if plaza in registry.markets:
+        return ("m", plaza)
+    return ("p", normalize_key(plaza))
+
+
+def load_subscriptions(path: str = SUBSCRIPTIONS_PATH) -> list[Subscription]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [Subscription.from_dict(d) for d in data]
+
+
+def save_subscriptions(subs: list[Subscription], path: str = SUBSCRIPTIONS_PATH) -> None:
+    body = json.dumps([s._asdict() for s in subs], ensure_ascii=False, indent=2)
+    write_atomic(path, body.encode("utf-8"))
+
+
+class SubscriptionIndex:
+    """Índice invertido (tipo, producto, plaza) -> suscripciones, con umbrales ordenados por clave."""
+
+    def __init__(self, subs: Iterable[Subscription]):
+        por_clave: dict[tuple, list[Subscription]] = {}
+        self.subscriptions = list(subs)
+        self.size = len(self.subscriptions)
+        for s in self.subscriptions:
+            key = (s.tipo, normalize_key(s.producto) if s.producto else None, _plaza_key(s.plaza))
+            por_clave.setdefault(key, []).append(s)
+        # Por clave: (umbrales ascendentes, suscripciones en el mismo orden)
+        self._index: dict[tuple, tuple[list[float], list[Subscription]]] = {}
+        for key, lista in por_clave.items():
+            lista.sort(key=lambda s: s.umbral or 0.0)
+            self._index[key] = ([s.umbral or 0.0 for s in lista], lista)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def match(self, alert: dict) -> list[tuple[Subscription, str]]:
+        """Suscripciones que cumple la alerta, con el motivo."""
+        productos = (normalize_key(alert["name"]), None)
+        plazas = [("p", normalize_key(alert["market"])), None]
+        market = registry.market(alert["market"])
+        if market is not None:
+            plazas.append(("m", market))
+        precio, ahorro = alert["currentPrice"], alert["savingsPercentage"]
+        hits = []
+        for producto in productos:
+            for plaza in plazas:
+                entry = self._index.get(("precio", producto, plaza))
+                if entry is not None:
+                    umbrales, subs = entry
+                    hits.extend((s, f"precio {precio} <= {s.umbral:g}") for s in subs[bisect_left(umbrales, precio):])
+                entry = self._index.get(("ahorro", producto, plaza))
+                if entry is not None:
+                    umbrales, subs = entry
+                    hits.extend((s, f"ahorro {ahorro}% >= {s.umbral:g}%") for s in subs[:bisect_right(umbrales, ahorro)])
+                if ahorro > TEMPORADA_UMBRAL:
+                    entry = self._index.get(("temporada", producto, plaza))
+                    if entry is not None:
+                        hits.extend((s, f"De Temporada ({ahorro}%)") for s in entry[1])
+        return hits
+
+
+class Sink(Protocol):
+    def send(self, batch: list[dict]) -> None: ...
+
+
+class FileSink:
+    """Agrega cada notificación como una línea NDJSON."""
+
+    def __init__(self, path: str = NOTIFICATIONS_PATH):
+        self.path = path
+
+    def send(self, batch: list[dict]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for n in batch:
+                f.write(json.dumps(n, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+class HttpSink:
+    """POST JSON {"notifications": [...]} por lote; un estado HTTP de error lanza excepción."""
+
+    def __init__(self, url: str, timeout: float = HTTP_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, batch: list[dict]) -> None:
+        body = json.dumps({"notifications": batch}, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+
+def make_sink(spec: str) -> Sink:
+    """'http(s)://...' -> HttpSink; cualquier otra cosa es la ruta de un FileSink."""
+    if spec.startswith(("http://", "https://")):
+        return HttpSink(spec)
+    return FileSink(spec)
+
+
+class AlertDispatcher:
+    """Evalúa alertas nuevas o cambiadas (y suscripciones nuevas) contra el índice y envía las notificaciones en lotes."""
+
+    def __init__(self, sink: Sink, subscriptions_path: str = SUBSCRIPTIONS_PATH,
+                 state_path: str = DISPATCH_STATE_PATH, batch_size: int = BATCH_SIZE):
+        self.sink = sink
+        self.subscriptions_path = subscriptions_path
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self._index: SubscriptionIndex | None = None
+        self._index_mtime = None
+
+    @property
+    def index(self) -> SubscriptionIndex:
+        """Índice de suscripciones; se reconstruye solo si el archivo cambió."""
+        try:
+            mtime = os.stat(self.subscriptions_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._index is None or mtime != self._index_mtime:
+            self._index = SubscriptionIndex(load_subscriptions(self.subscriptions_path))
+            self._index_mtime = mtime
+        return self._index
+
+    def _load_state(self, index: SubscriptionIndex) -> dict:
+        """{"alerts": {id: [precio, ahorro]}, "subscriptions": {id: huella}} de la última ejecución."""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {"alerts": {}, "subscriptions": {}}
+        if state.get("version") != DISPATCH_STATE_VERSION:
+            # Estado v1 (solo alertas): las suscripciones actuales se dan por evaluadas
+            return {"alerts": state, "subscriptions": {s.id: _fingerprint(s) for s in index.subscriptions}}
+        return state
+
+    def dispatch(self, alerts: list[dict], only_changed: bool = True) -> dict:
+        """
+        Notifica las suscripciones que cumplen las alertas; devuelve un resumen.
+
+        Las alertas cambiadas se comparan con todas las suscripciones; las que no
+        cambiaron, solo con las suscripciones nuevas o modificadas desde la última
+        ejecución. Con only_changed=False se evalúa todo.
+        """
+        index = self.index
+        previo = self._load_state(index) if only_changed else {"alerts": {}, "subscriptions": {}}
+        actual = {a["id"]: [a["currentPrice"], a["savingsPercentage"]] for a in alerts}
+        huellas = {s.id: _fingerprint(s) for s in index.subscriptions}
+        nuevas = SubscriptionIndex(s for s in index.subscriptions if previo["subscriptions"].get(s.id) != huellas[s.id])
+
+        cambiadas = 0
+        por_contacto: dict[str, list[dict]] = {}
+        for a in alerts:
+            if previo["alerts"].get(a["id"]) != actual[a["id"]]:
+                cambiadas += 1
+                hits = index.match(a)
+            elif nuevas.size:
+                hits = nuevas.match(a)
+            else:
+                continue
+            for sub, motivo in hits:
+                por_contacto.setdefault(sub.contacto, []).append({
+                    "subscription": sub.id,
+                    "motivo": motivo,
+                    "alert": {k: a[k] for k in ("id", "name", "category", "market", "currentPrice", "savingsPercentage")},
+                })
+
+        ahora = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        mensajes = [{"contacto": c, "createdAt": ahora, "items": items} for c, items in por_contacto.items()]
+        for i in range(0, len(mensajes), self.batch_size):
+            self.sink.send(mensajes[i:i + self.batch_size])
+        # El estado se guarda solo si el envío terminó: si el sink falla, se reintenta en el próximo refresco
+        state = {"version": DISPATCH_STATE_VERSION, "alerts": actual, "subscriptions": huellas}
+        write_atomic(self.state_path, json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        return {
+            "subscriptions": len(index),
+            "new_subscriptions": len(nuevas),
+            "alerts": len(alerts),
+            "changed": cambiadas,
+            "notifications": sum(len(m["items"]) for m in mensajes),
+            "contacts": len(mensajes),
+        }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Alertas de precio por suscripción")
+    parser.add_argument("--subscriptions", default=SUBSCRIPTIONS_PATH, help="Archivo JSON de suscripciones")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_add = sub.add_parser("add", help="Agregar una suscripción")
+    p_add.add_argument("--contacto", required=True, help="Correo u otro identificador del destinatario")
+    p_add.add_argument("--tipo", choices=TIPOS, required=True)
+    p_add.add_argument("--producto", help="Nombre del producto SIPSA (por defecto todos)")
+    p_add.add_argument("--plaza", help="Id de mercado del PRD o nombre de plaza SIPSA (por defecto todas)")
+    p_add.add_argument("--umbral", type=float, help="Precio máximo (precio) o ahorro %% mínimo (ahorro)")
+
+    p_dispatch = sub.add_parser("dispatch", help="Evaluar alertas y enviar notificaciones")
+    p_dispatch.add_argument("--alerts", default=ALERTS_PATH, help="ProductAlert JSON del motor de ahorro")
+    p_dispatch.add_argument("--sink", default=NOTIFICATIONS_PATH, help="Archivo NDJSON o URL http(s) de destino")
+    p_dispatch.add_argument("--all", action="store_true", help="Evaluar todas las alertas, no solo las cambiadas")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "add":
+        try:
+            nueva = Subscription.from_dict(vars(args))
+        except ValueError as e:
+            parser.error(str(e))
+        subs = [s for s in load_subscriptions(args.subscriptions) if s.id != nueva.id] + [nueva]
+        save_subscriptions(subs, args.subscriptions)
+        print(f"Suscripción {nueva.id} guardada ({len(subs)} en total)")
+        return 0
+
+    try:
+        with open(args.alerts, "r", encoding="utf-8") as f:
+            alerts = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("No se pudieron leer las alertas %s: %s. Ejecute: python sipsa_ahorro.py", args.alerts, e)
+        return 1
+    dispatcher = AlertDispatcher(make_sink(args.sink), args.subscriptions)
+    try:
+        resumen = dispatcher.dispatch(alerts, only_changed=not args.all)
+    except OSError as e:
+        logger.error("Falló el envío a %s: %s", args.sink, e)
+        return 1
+    print(
+        f"{resumen['changed']} de {resumen['alerts']} alertas cambiadas, "
+        f"{resumen['new_subscriptions']} suscripciones nuevas o modificadas; "
+        f"{resumen['notifications']} notificaciones para {resumen['contacts']} contactos "
+        f"({resumen['subscriptions']} suscripciones) -> {args.sink}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
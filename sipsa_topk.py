@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ranking top-K por grupo con heaps acotados, en una sola pasada.
+
+Para "los N más baratos/caros", "las 15 plazas con más registros" o "top 4 por
+categoría" no hace falta ordenar todo: cada grupo mantiene un heap de tamaño k
+y cada elemento cuesta O(log k). Por defecto los empates se resuelven por orden
+de llegada (gana el primero), igual que sorted(...)[:k] o sorted(..., reverse=True)[:k].
+Con ties_last=True gana el último y va primero, como sorted(...)[-k:][::-1].
+"""
+
+import heapq
+from itertools import count
+from typing import Callable, Hashable, Iterable
+
+
+class GroupedTopK:
+    """
+    Los k elementos de menor (o mayor, con largest=True) puntaje de cada grupo.
+
+    Los elementos con puntaje None se ignoran. ties_last=True hace que en empate
+    gane (y vaya primero) el elemento que llegó después.
+    """
+
+    def __init__(self, k: int, largest: bool = False, ties_last: bool = False):
+        if k < 0:
+            raise ValueError("k debe ser >= 0")
+        self.k = k
+        self.largest = largest
+        self.ties_last = ties_last
+        self._heaps: dict[Hashable, list] = {}
+        self._seq = count()
+
+    def push(self, group: Hashable, score, item) -> None:
+        if score is None or self.k == 0:
+            return
+        # La raíz del heap es siempre el peor elemento retenido (el primero en salir):
+        # para los menores se guarda -score, así el de mayor puntaje queda en la raíz;
+        # en empate sale el de llegada más tardía (-seq menor), o la más temprana
+        # con ties_last (seq menor).
+        s = score if self.largest else -score
+        seq = next(self._seq)
+        entry = (s, seq if self.ties_last else -seq, item)
+        heap = self._heaps.get(group)
+        if heap is None:
+            self._heaps[group] = [entry]
+        elif len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    def extend(self, items: Iterable, score: Callable, group: Callable | None = None) -> "GroupedTopK":
+        """Agrega items calculando puntaje (y grupo, si se indica) con las funciones dadas."""
+        push = self.push
+        if group is None:
+            for item in items:
+                push(None, score(item), item)
+        else:
+            for item in items:
+                push(group(item), score(item), item)
+        return self
+
+    def groups(self) -> list:
+        return list(self._heaps)
+
+    def get(self, group: Hashable = None) -> list:
+        """Elementos del grupo del mejor al peor."""
+        heap = self._heaps.get(group, [])
+        return [e[2] for e in sorted(heap, key=lambda e: (-e[0], -e[1]))]
+
+    def result(self) -> dict:
+        """{grupo: elementos del mejor al peor}, grupos en orden de primera aparición."""
+        return {g: self.get(g) for g in self._heaps}
+
+
+def top_k(items: Iterable, k: int, score: Callable, largest: bool = False, ties_last: bool = False) -> list:
+    """Los k items de menor (o mayor) puntaje, del mejor al peor; puntaje None se ignora."""
+    return GroupedTopK(k, largest, ties_last).extend(items, score).get()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Utilidades de archivos compartidas por los scripts SIPSA.
+
+Solo usa la biblioteca estándar, para que módulos sin red (spread, diff,
+historial, métricas) no arrastren zeep ni requests al importarlas.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+from typing import Iterator
+
+_HASH_BLOCK = 1 << 20
+
+
+@contextlib.contextmanager
+def atomic_path(path: str, suffix: str = "") -> Iterator[str]:
+    """
+    Ruta temporal junto a path: lo escrito en ella reemplaza a path al salir sin error.
+
+    Si el bloque falla, el temporal se borra y path queda como estaba. suffix sirve
+    para librerías que exigen extensión (np.savez agrega .npz si falta).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}{suffix}"
+    try:
+        yield tmp
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def write_atomic(path: str, data: bytes | str) -> None:
+    """Escribe en un temporal y renombra, para no dejar archivos a medias; str se guarda en UTF-8."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with atomic_path(path) as tmp, open(tmp, "wb") as f:
+        f.write(data)
+
+
+def read_json(path: str) -> dict | None:
+    """JSON de path; None si no existe o no se puede leer."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_sha256(path: str) -> str:
+    """sha256 del contenido de path, leído por bloques."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Selecciones y vistas sobre registros normalizados (sipsa_normalizer.Registro).
+
+Las comparten los scripts semanal (sipsa_plaza_precio_semana) y por ciudad
+(sipsa_medellin_test), el pipeline y el daemon: ventana de la última semana,
+registro de salida semanal, reparto por ciudad, top por precio y fechaCaptura
+más reciente. No dependen de zeep ni de la red.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from sipsa_normalizer import Registro
+from sipsa_registry import normalize_key, registry
+from sipsa_topk import GroupedTopK
+
+OPERATION_PLAZA_SEMANA = "promediosSipsaSemanaMadr"
+OPERATION_CIUDAD = "promediosSipsaCiudad"
+DIAS_ULTIMA_SEMANA = 7
+MEDELLIN_NORMALIZED = "medellin"  # comparación sin acento y case-insensitive
+TODAS_LAS_CIUDADES = "all"
+TOP_N = 20
+
+
+def select_ultima_semana(registros: Iterable[Registro], dias: int = DIAS_ULTIMA_SEMANA) -> tuple[int, list[Registro]]:
+    """
+    Recorre los registros una sola vez y devuelve (total, registros de la última semana).
+
+    Si ninguno cae en los últimos `dias` días (DIAS_ULTIMA_SEMANA), usa los que están a esa
+    distancia de la fecha más reciente del set (p. ej. última semana publicada en el
+    servicio), ordenados de más reciente a más antiguo. Solo se retienen los registros
+    de ambas ventanas, no la respuesta completa.
+    """
+    ahora = datetime.now(timezone.utc)
+    limite = ahora - timedelta(days=dias)
+    tope = ahora + timedelta(days=1)
+    total = 0
+    en_ventana = []
+    recientes = []  # (fecha, registro) a <= dias de la fecha máxima vista
+    fecha_max = None
+    sin_fecha = []
+    for r in registros:
+        total += 1
+        f = r.fecha
+        if f is None:
+            if len(sin_fecha) < 5000:
+                sin_fecha.append(r)
+            continue
+        if limite <= f <= tope:
+            en_ventana.append(r)
+        if en_ventana:
+            continue
+        if fecha_max is None or f > fecha_max:
+            fecha_max = f
+            recientes = [(fr, rr) for fr, rr in recientes if (fecha_max - fr).days <= dias]
+        if (fecha_max - f).days <= dias:
+            recientes.append((f, r))
+
+    if en_ventana:
+        return total, en_ventana
+    if recientes:
+        recientes.sort(key=lambda x: x[0], reverse=True)
+        return total, [r for _, r in recientes]
+    # Sin fechas interpretables: conservar los primeros registros recibidos
+    return total, sin_fecha
+
+
+def registro_salida(r: Registro) -> dict:
+    """Registro de salida: producto, plaza, precio (o promedioKg), fecha ISO y extremos por kg."""
+    return {
+        "producto": r.producto,
+        "plaza": r.plaza,
+        "precio": r.precio,
+        "precioPromedioKg": r.promedioKg,  # por si el servicio devuelve kg
+        "fecha": r.fecha_iso,
+        "maximoKg": r.maximoKg,
+        "minimoKg": r.minimoKg,
+    }
+
+
+def partition_by_city(registros: Iterable[Registro], ciudades: Iterable[str] | None = None) -> dict[str, list[Registro]]:
+    """
+    Reparte los registros por clave normalizada de ciudad en una sola pasada.
+
+    ciudades None toma todas las que aparezcan (los registros sin ciudad se descartan);
+    si no, solo las pedidas, cada una con su balde aunque quede vacío.
+    """
+    city_key = registry.city_key
+    if ciudades is None:
+        baldes: dict[str, list[Registro]] = {}
+        for r in registros:
+            clave = city_key(r.ciudad)
+            balde = baldes.get(clave)
+            if balde is None:
+                balde = baldes[clave] = []
+            balde.append(r)
+        baldes.pop("", None)
+        return baldes
+    baldes = {normalize_key(c): [] for c in ciudades}
+    for r in registros:
+        balde = baldes.get(city_key(r.ciudad))
+        if balde is not None:
+            balde.append(r)
+    return baldes
+
+
+def filter_medellin(registros: Iterable[Registro]) -> list[Registro]:
+    """Filtra registros donde ciudad sea Medellín (case-insensitive, con/sin acento)."""
+    return partition_by_city(registros, [MEDELLIN_NORMALIZED])[MEDELLIN_NORMALIZED]
+
+
+def top_por_precio(registros: list[Registro], n: int = TOP_N) -> tuple[list[Registro], list[Registro]]:
+    """
+    (n más baratos, n más caros) por precio promedio, con heaps acotados; sin precio no cuentan.
+
+    Los empates quedan como en sorted(...)[:n] y sorted(...)[-n:][::-1].
+    """
+    baratos, caros = GroupedTopK(n), GroupedTopK(n, largest=True, ties_last=True)
+    for r in registros:
+        baratos.push(None, r.precio, r)
+        caros.push(None, r.precio, r)
+    return baratos.get(), caros.get()
+
+
+def latest_fecha_captura(registros: list[Registro]) -> str | None:
+    """Obtiene la fechaCaptura más reciente (como string ISO)."""
+    con_fecha = [r for r in registros if r.fecha is not None]
+    if con_fecha:
+        return max(con_fecha, key=lambda r: r.fecha).fecha_iso
+    textos = [r.fecha_iso for r in registros if r.fecha_iso]
+    return max(textos) if textos else None
+
+
+def city_slug(clave: str) -> str:
+    """Clave de ciudad apta para nombre de archivo (medellin, bogota_d_c...)."""
+    return re.sub(r"[^a-z0-9]+", "_", clave).strip("_") or "sin_ciudad"
+
+
+def print_top(titulo: str, items: list[dict]) -> None:
+    """Imprime un ranking numerado de {"producto", "precio"}."""
+    print(titulo)
+    for i, item in enumerate(items, 1):
+        precio = item["precio"] if item["precio"] is not None else "N/A"
+        print(f"  {i:2}. {item['producto'] or 'N/A'}: {precio}")
+    print()